@@ -0,0 +1,75 @@
+# Benchmark neopo's extraction engine against tarfile.extractall, failing if it is slower
+# Usage: python ci/bench-extract.py [files] [directory]
+import io
+import os
+import sys
+import time
+import shutil
+import random
+import tarfile
+import tempfile
+
+from neopo.extract import extract_tarball, parallel_extraction
+
+# Extractions timed with each method, and the allowed slowdown against extractall
+ROUNDS = 3
+TOLERANCE = 1.1
+
+# Build a synthetic toolchain-like archive of many small files and a few large ones
+def create_archive(archive, count):
+    random.seed(count)
+    with tarfile.open(archive, "w:gz") as tarball:
+        for index in range(count):
+            size = 64 * 1024 * 1024 if index % 10000 == 0 else random.randint(100, 8000)
+            info = tarfile.TarInfo("toolchain/dir%03d/sub%02d/file%05d.h" % (index % 500, index % 7, index))
+            info.size = size
+            info.mode = 0o644
+            info.mtime = time.time()
+            tarball.addfile(info, io.BytesIO(os.urandom(size)))
+
+# Time one extraction into an empty directory, until its files are on disk, so writes
+# left over from earlier runs are never counted against the next one
+def measure(name, extract, archive, destination):
+    shutil.rmtree(destination, ignore_errors=True)
+    os.makedirs(destination)
+    os.sync()
+    start = time.perf_counter()
+    extract(archive, destination)
+    os.sync()
+    elapsed = time.perf_counter() - start
+    print("%-12s %8.2f s" % (name, elapsed))
+    return elapsed
+
+def extractall(archive, destination):
+    with tarfile.open(archive, "r:gz") as tarball:
+        tarball.extractall(destination)
+
+def engine(archive, destination):
+    with tarfile.open(archive, "r|gz") as tarball:
+        extract_tarball(tarball, destination, os.path.getsize(archive))
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    work = tempfile.mkdtemp(dir=sys.argv[2] if len(sys.argv) > 2 else None)
+    try:
+        archive = os.path.join(work, "synthetic.tar.gz")
+        print("Creating archive with %d files..." % count)
+        create_archive(archive, count)
+        destination = os.path.join(work, "out")
+        pool = parallel_extraction(os.path.getsize(archive))
+        print("neopo extracts with %s" % ("a pool of writers" if pool else "tarfile"))
+        # Alternate the extractions and keep the best time of each, as disks are noisy
+        times = {"extractall": [], "neopo": []}
+        for _ in range(ROUNDS):
+            times["extractall"].append(measure("extractall", extractall, archive, destination))
+            times["neopo"].append(measure("neopo", engine, archive, destination))
+        baseline, extracted = min(times["extractall"]), min(times["neopo"])
+        print("speedup      %8.2fx" % (baseline / extracted))
+    finally:
+        shutil.rmtree(work)
+    if extracted > baseline * TOLERANCE:
+        print("Extraction is slower than tarfile.extractall!")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
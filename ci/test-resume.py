@@ -0,0 +1,90 @@
+#Check that library downloads resume after the server drops the connection, and
+#that a download which can not be extracted leaves nothing behind for the next attempt
+import io
+import os
+import sys
+import time
+import shutil
+import tarfile
+import tempfile
+import threading
+import http.server
+
+# Keep partial downloads out of the real neopo directory
+ROOT = tempfile.mkdtemp(prefix="neopo-resume-")
+os.environ["NEOPO_PATH"] = ROOT
+
+from neopo import download
+from neopo.store import partial_path
+from neopo.utility import download_library_archive
+
+# Retry quickly, the server comes back at once
+download.BACKOFF = 0.01
+
+# A gzipped library archive large enough to be cut off halfway
+def create_archive():
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tarball:
+        for index in range(4):
+            data = os.urandom(256 * 1024)
+            info = tarfile.TarInfo("src/part%d.cpp" % index)
+            info.size = len(data)
+            tarball.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+ARCHIVE = create_archive()
+
+# Serves the archive with Range support. The first response is cut off halfway, and
+# in corrupt mode the resumed response sends different bytes.
+class Handler(http.server.BaseHTTPRequestHandler):
+    mode = "drop"
+    requests = 0
+
+    def do_GET(self):
+        Handler.requests += 1
+        start = int(self.headers["Range"][6:-1]) if self.headers.get("Range") else 0
+        body = ARCHIVE[start:]
+        if Handler.mode == "corrupt" and start:
+            body = bytes(byte ^ 0x55 for byte in body)
+        self.send_response(206 if start else 200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if Handler.requests == 1:
+            self.wfile.write(body[:len(body) // 2])
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+
+failed = False
+project = os.path.join(ROOT, "project")
+for mode in ["drop", "corrupt"]:
+    Handler.mode, Handler.requests = mode, 0
+    url = "http://127.0.0.1:%d/%s.tar.gz" % (server.server_address[1], mode)
+    library = os.path.join(project, "lib", mode)
+    start = time.monotonic()
+    try:
+        download_library_archive(url, mode, project)
+        error = None
+    except Exception as exception:
+        error = exception
+
+    if mode == "drop":
+        passed = error is None and Handler.requests == 2 and len(os.listdir(os.path.join(library, "src"))) == 4
+    else:
+        passed = error is not None and not os.path.exists(library)
+    passed = passed and not os.path.exists(partial_path(url))
+    print("%-8s %s in %.2fs after %d requests%s" % (mode, "passed" if passed else "FAILED", time.monotonic() - start,
+                                                   Handler.requests, " (%r)" % error if error else ""))
+    failed = failed or not passed
+
+server.shutdown()
+shutil.rmtree(ROOT, ignore_errors=True)
+if failed:
+    print("Resuming library downloads is broken!")
+    sys.exit(1)
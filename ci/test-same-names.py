@@ -0,0 +1,56 @@
+#Check that projects with the same name and sources, built one after the other with the
+#same configuration, never link each other's objects from the shared Device OS libraries
+#Usage: python ci/test-same-names.py [platform] [version]
+import os
+import sys
+import glob
+import shutil
+import tempfile
+
+import neopo
+
+platform = sys.argv[1] if len(sys.argv) > 1 else "argon"
+version = sys.argv[2] if len(sys.argv) > 2 else "2.0.0-rc.3"
+
+APPLICATION = """#include "Particle.h"
+
+const char *marker();
+const char *volatile used;
+
+void setup() { used = marker(); }
+
+void loop() {}
+"""
+
+# Both projects are named app and have a src/main.cpp, which only differs in its marker
+root = tempfile.mkdtemp(prefix="neopo-names-")
+projects = {}
+for name in ["first", "second"]:
+    project = os.path.join(root, name, "app")
+    os.makedirs(os.path.dirname(project))
+    neopo.create(project, platform, version)
+    with open(os.path.join(project, "src", "app.cpp"), "w") as file:
+        file.write(APPLICATION)
+    with open(os.path.join(project, "src", "main.cpp"), "w") as file:
+        file.write('const char *marker() { return "neopo-marker-%s"; }\n' % name)
+    projects[name] = project
+
+# Building the first project again must not reuse main.o of the second
+neopo.build(projects["first"])
+neopo.build(projects["second"])
+neopo.build(projects["first"], force=True)
+
+failed = False
+for name, project in projects.items():
+    binaries = glob.glob(os.path.join(project, "target", "*", "*", "app.bin"))
+    with open(binaries[0], "rb") as file:
+        contents = file.read()
+    markers = [other for other in projects if b"neopo-marker-" + other.encode() in contents]
+    passed = markers == [name]
+    print("%-8s %s (markers: %s)" % (name, "passed" if passed else "FAILED", ", ".join(markers) or "none"))
+    failed = failed or not passed
+
+shutil.rmtree(root, ignore_errors=True)
+if failed:
+    print("Projects picked up each other's objects!")
+    sys.exit(1)
@@ -0,0 +1,56 @@
+#Check that the commands run by bash completion start quickly
+import sys
+import subprocess
+
+# Commands run by the completion script on every <TAB>
+COMMANDS = ["options", "options-iterable", "options-legacy",
+            "list-versions", "platforms", "projects", "targets"]
+
+# Import time allowed per command after the interpreter has started (microseconds)
+BUDGET = 40000
+
+# Best of this many runs is compared with the budget
+RUNS = 3
+
+# Modules that only downloading, building and help need
+HEAVY_MODULES = ["subprocess", "platform", "hashlib", "tarfile", "http.client", "urllib.request",
+                 "concurrent.futures", "xml.etree.ElementTree", "neopo.utility", "neopo.help_info",
+                 "neopo.workbench", "neopo.toolchain", "neopo.project", "neopo.build"]
+
+# Run a command with -X importtime, returning the time spent importing from neopo
+# onwards and the names of every module imported along the way
+def measure(command):
+    process = subprocess.run([sys.executable, "-X", "importtime", "-m", "neopo", command],
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                             universal_newlines=True, check=True)
+    # Nested imports are listed before the module that imported them
+    total, modules, pending, started = 0, [], [], False
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        top_level = not name[1:].startswith(" ")
+        name = name.strip()
+        pending.append(name)
+        if top_level:
+            started = started or name == "neopo"
+            if started:
+                modules.extend(pending)
+                total += int(cumulative)
+            pending = []
+    return total, modules
+
+failed = False
+for command in COMMANDS:
+    # Warm up bytecode and cache snapshots before measuring
+    measure(command)
+    results = [measure(command) for _ in range(RUNS)]
+    total = min(result[0] for result in results)
+    heavy = sorted(set(HEAVY_MODULES).intersection(results[0][1]))
+    print("%-16s %6.1f ms %s" % (command, total / 1000, " ".join(heavy)))
+    if total > BUDGET or heavy:
+        failed = True
+
+if failed:
+    print("Completion startup is over budget (%.1f ms) or imports heavy modules!" % (BUDGET / 1000))
+    sys.exit(1)
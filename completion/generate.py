@@ -1,13 +1,7 @@
 from neopo.command import commands, iterable_commands, legacy_commands
 
 print(r'''# neopo(1) completion
-# depends on jq(1)
-
-_find_toolchains() {
-    [ -n "$NEOPO_PATH" ] && [ -d "$NEOPO_PATH/toolchains" ] && echo "$NEOPO_PATH/toolchains" && return
-    [ -n "$NEOPO_LOCAL" ] && [ -d "$HOME/.local/share/neopo/toolchains" ] && echo "$HOME/.local/share/neopo/toolchains" && return
-    [ -d "$HOME/.particle/toolchains" ] && echo "$HOME/.particle/toolchains" || exit
-}
+# reads the completion index written by neopo install/update/get
 
 _find_cache() {
     [ -n "$NEOPO_PATH" ] && [ -d "$NEOPO_PATH/resources/cache" ] && echo "$NEOPO_PATH/resources/cache" && return
@@ -28,32 +22,31 @@ _project() {
     COMPREPLY=($(compgen -W  "$_projects" -- "$cur"))
 }
 
-_get_versions() {
-    local _versions _dir _installed
-    _versions=$(jq -r .[].version $(_find_cache)/firmware.json)
-
-    for _dir in $(_find_toolchains)/deviceOS/*/; do
-        [ "$(basename $_dir)" != '*' ] && _installed="$(basename $_dir)\n${_installed}"
-    done
-
-    [ -z $_installed ] && _versions=$(echo "${_versions}" | sort -V | uniq) || _versions=$(echo -e "${_installed}${_versions}" | sort -V | uniq)
+# Print the words stored under a key in the completion index
+_index() {
+    local _key _words _file
+    _file="$(_find_cache)/completion.index"
+    [ -f "$_file" ] || return
+    while read -r _key _words; do
+        if [ "$_key" == "$1" ]; then
+            echo "$_words"
+            return
+        fi
+    done < "$_file"
+}
 
-    COMPREPLY=($(compgen -W  "$_versions" -- "$cur"))
+_get_versions() {
+    COMPREPLY=($(compgen -W  "$(_index versions)" -- "$cur"))
 }
 
 _run() {
-    local _targets _buildscripts
-    _buildscripts=$(jq -r .buildscripts $(_find_cache)/manifest.json)
-    _targets=$(grep '.PHONY' $(_find_toolchains)/buildscripts/$_buildscripts/Makefile)
-    _targets="${_targets#.PHONY: *}"
-    COMPREPLY=($(compgen -W  "$_targets" -- "$cur"))
+    local _buildscripts
+    _buildscripts=$(_index buildscripts)
+    COMPREPLY=($(compgen -W  "$(_index targets@$_buildscripts)" -- "$cur"))
 }
 
 _configure() {
-    local _platforms _cache
-    _cache=$(_find_cache)
-    _platforms=$(jq -r .[].name $_cache/platforms.json | tr '\n' ' ' && echo)
-    COMPREPLY=($(compgen -W  "$_platforms" -- "$cur"))
+    COMPREPLY=($(compgen -W  "$(_index platforms)" -- "$cur"))
 }
 
 _neopo() {
@@ -103,16 +96,36 @@ _neopo() {
         return 0
     fi
 
-    if [ "$prev" == "bootloader" ]; then
+    if [ "$prev" == "bootloader" ] || [ "$prev" == "warm" ]; then
         _configure
         return 0
     fi
 
-    if [ "$prev1" == "bootloader" ]; then
+    if [ "$prev1" == "bootloader" ] || [ "$prev1" == "warm" ]; then
         _get_versions
         return 0
     fi
 
+    if [ "$prev" == "daemon" ]; then
+        COMPREPLY=($(compgen -W "start stop status serve" -- "$cur"))
+        return 0
+    fi
+
+    if [ "$prev" == "library-store" ]; then
+        COMPREPLY=($(compgen -W "list clear" -- "$cur"))
+        return 0
+    fi
+
+    if [ "$prev" == "outputs" ]; then
+        COMPREPLY=($(compgen -W "list prune" -- "$cur"))
+        return 0
+    fi
+
+    if [ "$prev1" == "outputs" ]; then
+        _project
+        return 0
+    fi
+
     local legacy_options="serial dfu"
     local legacy_options2="open close"
 
@@ -129,6 +142,22 @@ _neopo() {
     case "$prev" in
     create|compile|build|flash|flash-all|clean|settings|libs)
         _project;;
+    --platforms)
+        _configure;;
+    --versions)
+        _get_versions;;
+    matrix|watch|check|test)
+        _project;;
+    build-all)
+        COMPREPLY=($(compgen -d -- "$cur"));;
+    jobs)
+        COMPREPLY=($(compgen -W "auto" -- "$cur"));;
+    pch|shared-libs)
+        COMPREPLY=($(compgen -W "on off" -- "$cur"));;
+    unity)
+        COMPREPLY=($(compgen -W "on off 4 8 16" -- "$cur"));;
+    scratch)
+        COMPREPLY=($(compgen -W "auto off" -d -- "$cur"));;
     run|export)
        _run;;
     configure)
@@ -3,6 +3,8 @@
 # https://neopo.xyz
 
 import os
+import sys
+import types
 
 # Disable RuntimeWarning for neopo.particle and neopo.script
 import warnings
@@ -16,3 +18,13 @@ from .cli import install, upgrade, uninstall, versions, create
 from .cli import build, flash, flash_all, clean
 from .cli import run, configure, flags, settings, libs
 from .cli import update, get
+
+# Submodules are imported lazily by the commands that use them, which would
+# replace API functions sharing their name (build, particle, script, iterate).
+class NeopoModule(types.ModuleType):
+    def __setattr__(self, name, value):
+        if isinstance(value, types.ModuleType) and callable(self.__dict__.get(name)):
+            return
+        super().__setattr__(name, value)
+
+sys.modules[__name__].__class__ = NeopoModule
@@ -0,0 +1,258 @@
+import os
+import sys
+import time
+import queue
+import threading
+import subprocess
+import concurrent.futures
+
+# Local imports
+from .common import ProcessError, UserError, projectFiles, min_particle_env
+from .completion import valid_projects
+from .jobs import make_jobs, split_jobs_option
+from .project import get_settings
+from .build import project_artifact, split_option
+from .toolchain import get_firmware_data, get_supported_platforms, platform_convert, missing_firmware_deps
+from .workbench import install_deps
+
+# Directories that are Particle projects, or that contain Particle projects
+def discover_projects(directories):
+    projects = []
+    for directory in directories:
+        directory = os.path.abspath(directory)
+        if not os.path.isdir(directory):
+            raise UserError("%s is not a directory!" % directory)
+        if os.path.isfile(os.path.join(directory, projectFiles["properties"])):
+            candidates = [directory]
+        else:
+            candidates = [os.path.join(directory, project) for project in valid_projects(directory)]
+        projects.extend(project for project in candidates if project not in projects)
+    return projects
+
+# Split a budget of make jobs into one slot per concurrent build, so the builds
+# running at any time never use more jobs than the budget
+def job_slots(budget, builds):
+    workers = max(1, min(budget, builds))
+    slots = queue.Queue()
+    for worker in range(workers):
+        slots.put(budget // workers + (1 if worker < budget % workers else 0))
+    return workers, slots
+
+# Environment in which a child neopo uses the same package and installation
+def child_env():
+    temp_env = min_particle_env()
+    package_parent = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    temp_env["PYTHONPATH"] = os.pathsep.join(filter(None, [package_parent, temp_env.get("PYTHONPATH")]))
+    temp_env["PYTHONUNBUFFERED"] = "1"
+    return temp_env
+
+# Run a neopo command for a build in a child process, printing its output with a prefix.
+# Output is held back until the end when quiet, and only printed if the build fails.
+def run_build(build, slots, width, verbosity, output_lock):
+    jobs = slots.get()
+    try:
+        artifact = build.get("artifact")
+        before = os.path.getmtime(artifact) if artifact and os.path.isfile(artifact) else None
+        command = [sys.executable, "-m", "neopo", *build["command"], "-j", str(jobs)]
+        verbosity == 1 and command.append("-v")
+
+        start = time.monotonic()
+        lines = []
+        process = subprocess.Popen(command, env=child_env(), stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT, universal_newlines=True,
+                                   errors="replace")
+        for line in process.stdout:
+            line = "%s | %s" % (build["name"].ljust(width), line.rstrip("\n"))
+            if verbosity == -1:
+                lines.append(line)
+            else:
+                with output_lock:
+                    print(line, flush=True)
+        returncode = process.wait()
+        build["duration"] = time.monotonic() - start
+
+        if returncode != 0:
+            build["status"] = "failed"
+            if lines:
+                with output_lock:
+                    print(*lines, sep="\n", flush=True)
+        elif artifact and os.path.isfile(artifact):
+            build["status"] = "up to date" if os.path.getmtime(artifact) == before else "built"
+            build["size"] = os.path.getsize(artifact)
+        else:
+            build["status"] = "built"
+        return build
+    finally:
+        slots.put(jobs)
+
+# Artifact size of a build for display
+def format_size(build):
+    size = build.get("size")
+    return "%.1f KiB" % (size / 1024) if size is not None else "-"
+
+# Print rows of cells as a table with aligned columns
+def print_table(rows):
+    widths = [max(len(row[column]) for row in rows) for column in range(len(rows[0]))]
+    print()
+    for row in rows:
+        print("  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip())
+
+# Print the status, duration and artifact size of each build as a table
+def print_summary(builds):
+    rows = [("PROJECT", "STATUS", "TIME", "SIZE")]
+    for build in builds:
+        rows.append((build["name"], build.get("status", "not run"),
+                     "%.1fs" % build.get("duration", 0), format_size(build)))
+    print_table(rows)
+
+# Raise an error if any build did not succeed
+def check_builds(builds):
+    failed = [build for build in builds if build.get("status") not in ("built", "up to date")]
+    if failed:
+        raise ProcessError("%d of %d builds failed!" % (len(failed), len(builds)))
+
+# Run builds concurrently, sharing a budget of make jobs between them. Each build
+# is a dictionary with a name, the neopo command to run, and optionally the
+# artifact it produces. The status, duration and artifact size are added to it.
+def run_builds(builds, budget, verbosity=0):
+    if not builds:
+        return
+    workers, slots = job_slots(budget, len(builds))
+    width = max(len(build["name"]) for build in builds)
+    output_lock = threading.Lock()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_build, build, slots, width, verbosity, output_lock)
+                   for build in builds]
+        for future in futures:
+            try:
+                future.result()
+            except OSError as error:
+                print("Failed to run build: %s" % error)
+
+# Build every project in the given directories (or the current directory)
+def build_all(directories, jobs=None, verbosity=0, force=False):
+    projects = discover_projects(directories or [os.getcwd()])
+    if not projects:
+        raise UserError("No Particle projects found!")
+
+    builds, versions = [], set()
+    for project in projects:
+        build = {"name": os.path.relpath(project), "command": ["build", project]}
+        force and build["command"].append("--force")
+        try:
+            platform, version = get_settings(project)
+            build["artifact"] = project_artifact(project, platform, version)
+            versions.add(version)
+        except (FileNotFoundError, KeyError):
+            pass
+        builds.append(build)
+
+    # Install what the projects are missing once, so builds never install the same
+    # dependency at the same time. Invalid versions fail in their own build.
+    prefetch_firmware(sorted(version for version in versions if get_supported_platforms(version)))
+    run_builds(builds, make_jobs(jobs), verbosity)
+    print_summary(builds)
+    check_builds(builds)
+
+# Wrapper for [build-all]
+def build_all_command(args):
+    verbosity_dict = {"-v": 1, "-q": -1}
+    force = "--force" in args
+    jobs, args = split_jobs_option([arg for arg in args[2:] if arg != "--force"])
+    verbosity = 0
+    directories = []
+    for arg in args:
+        if arg in verbosity_dict:
+            verbosity = verbosity_dict[arg]
+        elif arg.startswith("-"):
+            raise UserError("Invalid option: %s" % arg)
+        else:
+            directories.append(arg)
+    build_all(directories, jobs, verbosity, force)
+
+# Check whether a deviceOS version supports a platform
+def platform_supported(platform, version):
+    platform_id = platform_convert(platform, "name", "id", None if get_firmware_data(version) else version)
+    return bool(platform_id) and platform_id in get_supported_platforms(version)
+
+# Install the deviceOS versions and toolchains needed by all versions at once
+def prefetch_firmware(versions):
+    deps = {}
+    for version in versions:
+        for dep in missing_firmware_deps(version):
+            deps.setdefault((dep["name"], dep["version"]), dep)
+    install_deps(list(deps.values()), False)
+
+# Build a project for every supported combination of platforms and deviceOS versions,
+# each into its own output directory and without changing the project settings
+def build_matrix(project, platforms, versions, jobs=None, verbosity=0, force=False):
+    if not os.path.isfile(os.path.join(project, projectFiles["properties"])):
+        raise UserError("%s is not a Particle project!" % project)
+    for version in versions:
+        if not get_supported_platforms(version):
+            raise UserError("Invalid deviceOS version %s!" % version)
+
+    cells = {}
+    for version in versions:
+        for platform in platforms:
+            if not platform_supported(platform, version):
+                cells[platform, version] = {"status": "unsupported"}
+                continue
+            build = {"name": "%s@%s" % (platform, version),
+                     "command": ["build", project, "--platform", platform, "--version", version],
+                     "artifact": project_artifact(project, platform, version)}
+            force and build["command"].append("--force")
+            cells[platform, version] = build
+    builds = [build for build in cells.values() if "command" in build]
+    if not builds:
+        raise UserError("None of the platforms are supported by these deviceOS versions!")
+
+    prefetch_firmware([version for version in versions
+                       if any("command" in cells[platform, version] for platform in platforms)])
+    run_builds(builds, make_jobs(jobs), verbosity)
+
+    # Grid of platforms by versions
+    rows = [("PLATFORM", *versions)]
+    for platform in platforms:
+        row = [platform]
+        for version in versions:
+            cell = cells[platform, version]
+            if cell.get("status") in ("built", "up to date"):
+                row.append("ok %s" % format_size(cell))
+            else:
+                row.append(cell.get("status", "not run"))
+        rows.append(row)
+    print_table(rows)
+    check_builds(builds)
+
+# Split a comma or space separated list option
+def list_option(args, name):
+    value, args = split_option(args, name)
+    return [item for item in (value or "").replace(",", " ").split()], args
+
+# Wrapper for [matrix]
+def matrix_command(args):
+    verbosity_dict = {"-v": 1, "-q": -1}
+    force = "--force" in args
+    jobs, args = split_jobs_option([arg for arg in args[2:] if arg != "--force"])
+    platforms, args = list_option(args, "--platforms")
+    versions, args = list_option(args, "--versions")
+    verbosity = 0
+    project = os.getcwd()
+    for arg in args:
+        if arg in verbosity_dict:
+            verbosity = verbosity_dict[arg]
+        elif arg.startswith("-"):
+            raise UserError("Invalid option: %s" % arg)
+        else:
+            project = os.path.abspath(arg)
+
+    # Use the configured platform or version for whichever is not given
+    if not (platforms and versions):
+        try:
+            platform, version = get_settings(project)
+        except (FileNotFoundError, KeyError) as error:
+            raise UserError("You must specify --platforms and --versions!") from error
+        platforms, versions = platforms or [platform], versions or [version]
+    build_matrix(project, platforms, versions, jobs, verbosity, force)
@@ -1,31 +1,51 @@
 import os
+import json
+import shutil
 import time
 import pathlib
+import contextlib
+import signal
+import tempfile
+import shlex
 import subprocess
 
 # Local imports
 from .common import PARTICLE_DEPS, running_on_windows, particle_cli, projectFiles
 from .common import ProcessError, ProjectError, UserError, min_particle_env
 from .manifest import load_manifest, get_manifest_value
-from .project import get_settings, check_libraries, get_flags
+from .common import NEOPO_PCH, NEOPO_SCRATCH, NEOPO_SHARED_LIBS
+from .project import get_settings, check_libraries, get_flags, get_setting
+from .jobs import make_jobs, requested_jobs, split_jobs_option
 from .toolchain import get_compiler, check_firmware_version, get_firmware_path, platform_convert
-from .utility import write_executable
-
-# Export a build command to a script
-def export_build_process(project_path, process, environment, target):
+from .utility import write_executable, write_file
+from .fingerprint import build_fingerprint, up_to_date, record_build
+from .compiler_cache import compiler_shims, trim_cache
+from .prebuilt import PREBUILT_TARGETS, PROJECT_LIBS_DIR, libraries_path, libraries_lock, copy_libraries
+from .prebuilt import mark_complete
+from .outputs import select_output, output_lock
+from .scratch import scratch_root, scratch_path
+from .precompiled import precompiled_env
+from .unity import UNITY_DIR, plan_staging, stage_project, isolate_failed, copy_artifacts
+from .unity import count_objects, link_time
+from .libstore import shared_libraries, seed_objects, store_objects
+
+# Export a build command to a script. The script runs the requested number of
+# jobs, or one per core of the machine running it, unless JOBS is set.
+def export_build_process(project_path, process, environment, target, jobs=None):
     path = os.path.join(project_path, "bin")
     pathlib.Path(path).mkdir(parents=True, exist_ok=True)
     script = os.path.join(path, "neopo-%s.sh" % target)
 
     tools = environment["PATH"].split(os.pathsep)[:-3:-1]
     path_line = 'PATH="$PATH:%s"\n' % os.pathsep.join(tools)
+    jobs_line = 'JOBS="${JOBS:-%s}"\n' % (jobs if jobs else "$(getconf _NPROCESSORS_ONLN 2>/dev/null || echo 1)")
 
     # Format make line better
-    temp = [" ".join(process[:3])]
+    temp = [" ".join([process[0], '-j"$JOBS"', *process[1:3]])]
     temp.extend(process[3:])
     make_lines = " \\\n".join(temp)
 
-    content = "\n".join(["#!/bin/sh", path_line]) + "\n" + make_lines + "\n"
+    content = "\n".join(["#!/bin/sh", path_line, jobs_line]) + "\n" + make_lines + "\n"
     write_executable(content.encode("utf-8"), script)
 
     print("Exported to %s" % script)
@@ -41,9 +61,27 @@ def add_build_tools(environment, version=None):
     toolpath = os.path.join(toolpath, "bin") if running_on_windows else toolpath
     add_to_path(environment, toolpath)
 
+# Add a gcc-arm version to PATH, wrapped by the compiler cache (and precompiled
+# headers) unless the environment is exported for use without neopo
+def add_compiler(environment, compiler_version, cached=True, precompiled=False):
+    compiler_bin = os.path.join(PARTICLE_DEPS, "gcc-arm", compiler_version, "bin")
+    add_to_path(environment, compiler_shims(compiler_bin, precompiled) if cached else compiler_bin)
+
+# Environment for make in a prepared build, with its build tools and compiler on PATH.
+# It is made again for every run of a reused build, since the environment may differ.
+def build_environment(build, cached=True):
+    configuration = build["configuration"]
+    environment = min_particle_env()
+    add_build_tools(environment, configuration["buildtools"])
+    add_compiler(environment, configuration["gcc-arm"], cached, build["precompiled"])
+    if build["precompiled"]:
+        precompiled_env(environment, build["project"], build.get("scratch", build["output"]),
+                        build["stage"]["path"] if "stage" in build else None)
+    return environment
+
 # Build and flash bootloader to connected device [WIP]
-def flash_bootloader(platform, firmware_version, verbosity=1):
-    bootloader_bin = build_bootloader(platform, firmware_version, verbosity)
+def flash_bootloader(platform, firmware_version, verbosity=1, jobs=None):
+    bootloader_bin = build_bootloader(platform, firmware_version, verbosity, jobs)
     temp_env = min_particle_env()
     usb_listen = [particle_cli, "usb", "listen"]
     serial_flash = [particle_cli, "serial", "flash", "--yes", bootloader_bin]
@@ -59,17 +97,16 @@ def flash_bootloader(platform, firmware_version, verbosity=1):
         return
 
 # Build bootloader and return path to built file [WIP]
-def build_bootloader(platform, firmware_version, verbosity=1):
+def build_bootloader(platform, firmware_version, verbosity=1, jobs=None):
     compiler_version, script_version, tools_version, _ = load_manifest()
 
     temp_env = min_particle_env()
     add_build_tools(temp_env, tools_version)
-    add_to_path(temp_env, os.path.join(
-        PARTICLE_DEPS, "gcc-arm", compiler_version, "bin"))
+    add_compiler(temp_env, compiler_version)
 
     device_os_path = os.path.join(PARTICLE_DEPS, "deviceOS", firmware_version)
     bootloader = os.path.join(device_os_path, "bootloader")
-    process = ["make", "PLATFORM=" + platform]
+    process = ["make", "-j%d" % make_jobs(jobs), "PLATFORM=" + platform]
     verbosity != 1 and process.append("-s")
 
     OLDPWD = os.path.abspath(os.curdir)
@@ -78,10 +115,11 @@ def build_bootloader(platform, firmware_version, verbosity=1):
         subprocess.run(process, env=temp_env, shell=running_on_windows, check=True,
                         stdout=subprocess.PIPE if verbosity == -1 else None,
                         stderr=subprocess.PIPE if verbosity == -1 else None)
-    except subprocess.CalledProcessError as error:
+    except subprocess.CalledProcessError:
         pass
     finally:
         os.chdir(OLDPWD)
+        trim_cache()
 
     platform_id = platform_convert(platform, "name", "id")
 
@@ -93,8 +131,16 @@ def build_bootloader(platform, firmware_version, verbosity=1):
     else:
         raise ProcessError("%s was not built!" % target)
 
-# Use the Makefile to build the specified target
-def build_project(project_path, command, help_only, verbosity, export=False):
+# Firmware binary written by the compile-user target
+def project_artifact(project_path, platform, firmware_version):
+    return os.path.join(project_path, "target", firmware_version, platform,
+                        "%s.bin" % os.path.basename(project_path))
+
+# Resolve the toolchains, settings and make command used to build the specified target.
+# A platform or version overrides the one configured in the project. Returns None
+# when the build is exported to a script instead.
+def prepare_build(project_path, command, help_only, verbosity, export=False, jobs=None,
+                  platform=None, version=None):
     compiler_version, script_version, tools_version, firmware_version = load_manifest()
     temp_env = min_particle_env()
     add_build_tools(temp_env, tools_version)
@@ -117,11 +163,16 @@ def build_project(project_path, command, help_only, verbosity, export=False):
     if verbosity == 0:
         process[process.index("-f")] = "-sf"
 
+    build = {"project": project_path, "command": command, "verbosity": verbosity,
+             "process": process, "env": temp_env, "libraries": None, "output": None}
     if help_only:
         process.append("help")
     else:
         try:
-            device_platform, firmware_version = get_settings(project_path)
+            device_platform, firmware_version = platform, version
+            if not (platform and version):
+                device_platform, firmware_version = get_settings(project_path)
+                device_platform, firmware_version = platform or device_platform, version or firmware_version
             compiler_version = get_compiler(firmware_version)
 
             if not check_firmware_version(device_platform, firmware_version):
@@ -137,9 +188,8 @@ def build_project(project_path, command, help_only, verbosity, export=False):
             else:
                 raise UserError("%s is not a Particle project!" % project_path) from error
 
-        # Add compiler to path
-        add_to_path(temp_env, os.path.join(
-            PARTICLE_DEPS, "gcc-arm", compiler_version, "bin"))
+        # Precompile Particle.h into the output directory if enabled
+        precompiled = get_setting(project_path, "PRECOMPILED_HEADER", NEOPO_PCH) and not export
 
         # Set additional variables for make
         device_os_path = get_firmware_path(firmware_version)
@@ -148,20 +198,243 @@ def build_project(project_path, command, help_only, verbosity, export=False):
         process.append("DEVICE_OS_PATH=%s" % device_os_path)
         process.append("PLATFORM=%s" % device_platform)
         process.append("EXTRA_CFLAGS=%s" % extra_compiler_flags)
+
+        # Intermediate files go to a scratch directory instead of the project if one is set
+        scratch = None if export or running_on_windows else \
+            get_setting(project_path, "BUILD_SCRATCH", NEOPO_SCRATCH)
+        scratch = scratch_root(scratch) if scratch else None
+
+        # Link against Device OS libraries shared by projects with the same configuration
+        if command in PREBUILT_TARGETS and not export:
+            build["libraries"] = libraries_path(device_platform, firmware_version, device_os_path,
+                                                compiler_version, script_version, extra_compiler_flags,
+                                                scratch)
         process.append(command)
 
+        build["configuration"] = {
+            "platform": device_platform,
+            "deviceOS": firmware_version,
+            "deviceOS-path": device_os_path,
+            "EXTRA_CFLAGS": extra_compiler_flags,
+            "gcc-arm": compiler_version,
+            "buildscripts": script_version,
+            "buildtools": tools_version
+        }
+        build["artifact"] = project_artifact(project_path, device_platform, firmware_version)
+        build["output"] = os.path.dirname(build["artifact"])
+        if scratch:
+            build["scratch"] = scratch_path(scratch, project_path, build["configuration"])
+
+        # The modules built from the application stay in the project (or its scratch
+        # directory), and the shared Device OS modules are copied next to them
+        if build["libraries"]:
+            build["project-libraries"] = os.path.join(build.get("scratch", build["output"]), PROJECT_LIBS_DIR)
+            process.insert(-1, "BUILD_PATH_BASE=%s" % build["project-libraries"])
+
+        # Build a staged copy of the project, with its sources compiled in batches for a
+        # unity build, in the scratch directory if there is one, or with the objects of
+        # its libraries from the shared store. Make keeps going after errors in unity
+        # builds so every batch that fails can be found.
+        unity = get_setting(project_path, "UNITY_BATCH") if command in PREBUILT_TARGETS and not export else None
+        unity = None if running_on_windows else unity
+        shared = command in PREBUILT_TARGETS and not (export or running_on_windows) \
+            and get_setting(project_path, "SHARED_LIBRARIES", NEOPO_SHARED_LIBS)
+        if command in PREBUILT_TARGETS and (unity or scratch or shared):
+            base = build["scratch"] if scratch else os.path.join(build["output"], UNITY_DIR)
+            build["stage"] = {"batch": unity or 1, "path": os.path.join(base, os.path.basename(project_path)),
+                              "shared": shared}
+            process[process.index("APPDIR=%s" % project_path)] = "APPDIR=%s" % build["stage"]["path"]
+            if unity:
+                process.insert(1, "-k")
+        build["precompiled"] = precompiled
+        build["env"] = temp_env = build_environment(build, not export)
+
     # Export the build process to a shell script
     if export and not help_only:
-        export_build_process(project_path, process, temp_env, command)
+        export_build_process(project_path, process, temp_env, command,
+                             requested_jobs(jobs, get_setting(project_path, "MAKE_JOBS")))
+        return None
+
+    # Run make in parallel, as requested for this command or project or automatically
+    process.insert(1, "-j%d" % make_jobs(jobs, None if help_only else get_setting(project_path, "MAKE_JOBS")))
+    return build
+
+# Run make, returning its exit code, or None if it was stopped because the cancel
+# event was set. Make runs in its own process group so the compilers stop too.
+def run_make(process, environment, verbosity, cancel=None):
+    output = subprocess.DEVNULL if verbosity == -1 else None
+    make = subprocess.Popen(process, env=environment, shell=running_on_windows,
+                            stdout=output, stderr=output, start_new_session=cancel is not None)
+    if cancel is None:
+        return make.wait()
+    while True:
+        try:
+            return make.wait(timeout=0.1)
+        except subprocess.TimeoutExpired:
+            if cancel.is_set():
+                if running_on_windows:
+                    make.terminate()
+                else:
+                    os.killpg(make.pid, signal.SIGTERM)
+                make.wait()
+                return None
+
+# Directories a staged build compiles the application into, by name: the target
+# directory of the staged project and the project's BUILD_PATH_BASE
+def object_roots(build):
+    return {"target": os.path.join(build["stage"]["path"], "target"),
+            PROJECT_LIBS_DIR: build["project-libraries"]}
+
+# Names of the sources that make would still compile for a build, asked from make
+# without running anything
+def pending_sources(build):
+    process = ["-f" if arg == "-sf" else arg for arg in build["process"] if arg != "-k"]
+    process[1:1] = ["-n", "-w"]
+    result = subprocess.run(process, env=build["env"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                            universal_newlines=True, errors="replace")
+    sources = set()
+    for line in result.stdout.splitlines():
+        try:
+            words = shlex.split(line)
+        except ValueError:
+            continue
+        if "-c" in words:
+            sources.update(os.path.basename(word) for word in words)
+    return sources
+
+# Run make for a staged build and copy the binaries back to the project. When batches
+# of a unity build fail to compile their sources are compiled on their own and make
+# runs again, so errors caused by batching do not fail the build. Libraries from the
+# shared store are seeded before make and stored after it if they were compiled.
+def run_staged_make(build, cancel=None):
+    project_path, stage = build["project"], build["stage"]
+    roots = object_roots(build)
+    libraries = shared_libraries(project_path) if stage["shared"] else []
+    plan = stage_project(project_path, stage["path"], stage["batch"])
+    seed_objects(stage["path"], roots, libraries, build["configuration"], stage["batch"])
+    returncode = run_make(build["process"], build["env"], build["verbosity"], cancel)
+    if returncode not in (0, None) and stage["batch"] > 1 and \
+            isolate_failed(stage["path"], plan, pending_sources(build)):
+        plan = stage_project(project_path, stage["path"], stage["batch"])
+        seed_objects(stage["path"], roots, libraries, build["configuration"], stage["batch"])
+        returncode = run_make(build["process"], build["env"], build["verbosity"], cancel)
+    if returncode == 0:
+        store_objects(stage["path"], roots, libraries, build["configuration"], stage["batch"])
+        os.makedirs(build["output"], exist_ok=True)
+        copy_artifacts(project_path, stage["path"], build["output"])
+        stage["objects"] = count_objects(plan)
+    return returncode
+
+# Print the number of objects and the time spent linking for a build that linked
+# the firmware, to compare unity builds with normal ones
+def report_build(build, start):
+    elf = os.path.splitext(build["artifact"])[0] + ".elf"
+    if not os.path.isfile(elf) or os.path.getmtime(elf) < start:
         return
-
-    # Run makefile with given verbosity
+    stage = build.get("stage")
+    if stage:
+        objects, linking = stage["objects"], link_time([os.path.join(stage["path"], "target"),
+                                                         build["project-libraries"], build["libraries"]], elf)
+    else:
+        objects, linking = count_objects(plan_staging(build["project"], 1, {})), link_time(
+            [build["output"], build["libraries"]], elf)
+    print("Built %s from %d objects%s in %.1fs%s." % (
+        os.path.basename(build["artifact"]), objects,
+        " (unity build in batches of %d)" % stage["batch"] if stage and stage["batch"] > 1 else "",
+        time.time() - start, ", linking took %.1fs" % linking if linking is not None else ""))
+
+# Run a prepared build in the output directory of its configuration. Compiling is
+# skipped when the sources and configuration match the last successful build,
+# unless forced. Returns the binary for compile-user, or None if cancelled.
+def run_build(build, force=False, cancel=None):
+    project_path, command, output_path = build["project"], build["command"], build["output"]
+    artifact, fingerprint = build.get("artifact"), None
     try:
-        subprocess.run(process, env=temp_env, shell=running_on_windows, check=True,
-                        stdout=subprocess.PIPE if verbosity == -1 else None,
-                        stderr=subprocess.PIPE if verbosity == -1 else None)
-    except subprocess.CalledProcessError as error:
-        raise ProcessError("\n*** %s FAILED ***\n" % command.upper()) from error
+        with output_lock(output_path) if output_path else contextlib.suppress():
+            if output_path:
+                select_output(project_path, output_path, build["configuration"])
+
+            # Return the existing binary if nothing that affects it has changed
+            if command == "compile-user":
+                fingerprint = build_fingerprint(project_path, build["configuration"])
+                if not force and up_to_date(output_path, fingerprint):
+                    if build["verbosity"] != -1:
+                        print("%s is up to date. To rebuild anyway use --force." % artifact)
+                    return artifact
+
+            # Run makefile with given verbosity
+            with libraries_lock(build["libraries"]):
+                if build["libraries"]:
+                    copy_libraries(build["libraries"], build["project-libraries"])
+                start = time.time()
+                if build.get("stage"):
+                    returncode = run_staged_make(build, cancel)
+                else:
+                    returncode = run_make(build["process"], build["env"], build["verbosity"], cancel)
+                if returncode is None:
+                    return None
+                if returncode != 0:
+                    raise ProcessError("\n*** %s FAILED ***\n" % command.upper())
+                if build["libraries"]:
+                    mark_complete(build["libraries"], build["project-libraries"])
+
+            # Cleaning a project also cleans its build tree in the scratch directory
+            if command == "clean-user" and build.get("scratch"):
+                shutil.rmtree(build["scratch"], ignore_errors=True)
+            if artifact and (build.get("stage", {}).get("batch", 1) > 1 or build["verbosity"] == 1):
+                report_build(build, start)
+
+            if fingerprint and os.path.isfile(artifact):
+                record_build(output_path, fingerprint, artifact)
+                return artifact
+    finally:
+        trim_cache()
+
+# Prepared builds that a long running process (the daemon) reuses while nothing
+# they depend on changes. An object with get(key) and put(key, build) methods.
+prepared_builds = None
+
+# Reuse prepared builds from an object like prepared_builds
+def reuse_prepared_builds(contexts):
+    global prepared_builds
+    prepared_builds = contexts
+
+# Use the Makefile to build the specified target
+def build_project(project_path, command, help_only, verbosity, export=False, force=False, jobs=None,
+                  platform=None, version=None):
+    reusable = prepared_builds is not None and not (help_only or export)
+    key = json.dumps([project_path, command, verbosity, platform, version])
+    build = prepared_builds.get(key) if reusable else None
+    if build:
+        # The number of jobs and the environment may differ between requests
+        build["process"][1] = "-j%d" % make_jobs(jobs, get_setting(project_path, "MAKE_JOBS"))
+        build["env"] = build_environment(build)
+    else:
+        build = prepare_build(project_path, command, help_only, verbosity, export, jobs, platform, version)
+        if build and reusable:
+            prepared_builds.put(key, build)
+    if build:
+        return run_build(build, force)
+
+# Remove an option with a value (--name value or --name=value) from command arguments,
+# returning its value (or None) and the remaining arguments
+def split_option(args, name):
+    value, remaining = None, []
+    index = 0
+    while index < len(args):
+        arg = args[index]
+        if arg == name:
+            if index + 1 >= len(args):
+                raise UserError("You must specify a value for %s!" % name)
+            value = args[index + 1]
+            index += 2
+            continue
+        if isinstance(arg, str) and arg.startswith(name + "="):
+            value = arg.partition("=")[2]
+        else:
+            remaining.append(arg)
+        index += 1
+    return value, remaining
 
 # Parse the project path from the specified index and run a Makefile target
 def build_command(command, index, args, export=False):
@@ -169,6 +442,15 @@ def build_command(command, index, args, export=False):
     project = None
     verbosity_dict = {"": 0, "-v": 1, "-q": -1}
 
+    # Rebuild even if nothing changed since the last build
+    force = "--force" in args
+    args = [arg for arg in args if arg != "--force"]
+    jobs, args = split_jobs_option(args)
+
+    # Build for another platform or version than the project is configured for
+    platform, args = split_option(args, "--platform")
+    version, args = split_option(args, "--version")
+
     try:
         # Project specified, verbosity may follow
         if not args[index].startswith("-"):
@@ -191,7 +473,7 @@ def build_command(command, index, args, export=False):
         raise UserError("Invalid verbosity!") from error
 
     # Build the given project with a command and verbosity
-    build_project(project, command, False, verbosity, export)
+    return build_project(project, command, False, verbosity, export, force, jobs, platform, version)
 
 # Print help information directly from Makefile
 def build_help():
@@ -210,7 +492,7 @@ def flash_command(args):
     build_command("flash-user", 2, args)
 
 def compile_command(args):
-    build_command("compile-user", 2, args)
+    return build_command("compile-user", 2, args)
 
 def flash_all_command(args):
     build_command("flash-all", 2, args)
@@ -222,20 +504,51 @@ def clean_command(args):
 def export_command(args):
     run_command(args, True)
 
+# Build the Device OS libraries for a platform and version ahead of time by
+# compiling an empty application with the same configuration as a project
+def warm_libraries(platform, firmware_version, verbosity=0):
+    if not check_firmware_version(platform, firmware_version):
+        raise ProjectError("Firmware related error!")
+    with tempfile.TemporaryDirectory() as temp:
+        project_path = os.path.join(temp, "warm")
+        pathlib.Path(os.path.join(project_path, "src")).mkdir(parents=True)
+        pathlib.Path(os.path.join(project_path, ".vscode")).mkdir()
+        write_file("name=warm\n", os.path.join(project_path, projectFiles["properties"]), "w")
+        write_file('#include "Particle.h"\n\nvoid setup() {}\n\nvoid loop() {}\n',
+                   os.path.join(project_path, "src", "warm.cpp"), "w")
+        write_file(json.dumps({"particle.targetPlatform": platform, "particle.firmwareVersion": firmware_version}),
+                   os.path.join(project_path, projectFiles["settings"]), "w")
+        build_project(project_path, "compile-user", False, verbosity, force=True)
+    print("Device OS %s libraries for %s are ready." % (firmware_version, platform))
+
+# Wrapper for [warm]
+def warm_command(args):
+    try:
+        device_platform = args[2]
+        firmware_version = args[3]
+    except IndexError as error:
+        raise UserError("You must specify platform and device os version!") from error
+
+    verbosity_dict = {None: 0, "-v": 1, "-q": -1}
+    try:
+        verbosity = verbosity_dict[args[4] if len(args) > 4 else None]
+    except KeyError as error:
+        raise UserError("Invalid verbosity!") from error
+    warm_libraries(device_platform, firmware_version, verbosity)
+
 # Wrapper for flash-bootloader
 def flash_bootloader_command(args):
     try:
         device_platform = args[2]
         firmware_version = args[3]
     except IndexError as error:
-        raise UserError("You must specify platform and device os version!")
+        raise UserError("You must specify platform and device os version!") from error
 
     verbosity_dict = {None: 0, "-v": 1, "-q": -1}
     try:
-        verbosity = args[4]
-    except IndexError:
-        verbosity = None
-    verbosity_level=verbosity_dict[verbosity]
+        verbosity_level = verbosity_dict[args[4] if len(args) > 4 else None]
+    except KeyError as error:
+        raise UserError("Invalid verbosity!") from error
 
     if not check_firmware_version(device_platform, firmware_version):
         raise ProjectError("Firmware related error!")
@@ -0,0 +1,156 @@
+import os
+import sys
+import marshal
+
+# Local imports
+from .common import jsonFiles, CACHE_DIR, operating_system
+
+# Dependency names and the JSON caches that describe them
+DEPENDENCY_CACHES = {
+    "gcc-arm": "compilers",
+    "buildtools": "tools",
+    "buildscripts": "scripts",
+    "openocd": "debuggers"
+}
+
+# Compact pre-indexed copy of the JSON caches, rebuilt when any of them changes
+SNAPSHOT_FILE = os.path.join(CACHE_DIR, "catalog.marshal")
+SNAPSHOT_VERSION = (1, sys.version_info[:2])
+SNAPSHOT_SOURCES = ["firmware", "platforms", "toolchains", "compilers", "tools", "scripts", "debuggers"]
+
+# Fingerprint the snapshot sources by modification time and size
+def source_stamps():
+    stamps = {}
+    for key in SNAPSHOT_SOURCES:
+        stat = os.stat(jsonFiles[key])
+        stamps[key] = (stat.st_mtime_ns, stat.st_size)
+    return stamps
+
+# The JSON caches written by install/update, each loaded at most once per process
+# and indexed by the fields lookups use. Custom .workbench/manifest.json files
+# shipped with unlisted deviceOS versions are folded in the same way.
+class Catalog:
+    def __init__(self):
+        self.caches = {}
+        self.indexes = {}
+        self.custom = {}
+
+    # Use the snapshot if it matches the JSON caches, otherwise rebuild it from them
+    def restore(self):
+        try:
+            stamps = source_stamps()
+        except FileNotFoundError:
+            # Loading will report the missing cache
+            return
+        try:
+            with open(SNAPSHOT_FILE, "rb") as file:
+                snapshot = marshal.loads(file.read())
+            if snapshot["version"] == SNAPSHOT_VERSION and snapshot["sources"] == stamps:
+                self.caches, self.indexes = snapshot["caches"], snapshot["indexes"]
+                return
+        except (OSError, EOFError, ValueError, TypeError, KeyError):
+            pass
+
+        # Load and index everything so the snapshot is complete
+        self.index("firmware", "version")
+        self.index("platforms", "name")
+        self.index("platforms", "id")
+        self.index("toolchains", "firmware")
+        for name in DEPENDENCY_CACHES:
+            self.dependency_index(name)
+        snapshot = {"version": SNAPSHOT_VERSION, "sources": stamps,
+                    "caches": self.caches, "indexes": self.indexes}
+        try:
+            temp = "%s.%d" % (SNAPSHOT_FILE, os.getpid())
+            with open(temp, "wb") as file:
+                file.write(marshal.dumps(snapshot))
+            os.replace(temp, SNAPSHOT_FILE)
+        except OSError:
+            pass
+
+    # Parsed contents of a JSON cache. The json module is only imported when the
+    # snapshot can not be used, which keeps completion startup fast.
+    def load(self, key):
+        if key not in self.caches:
+            import json
+            with open(jsonFiles[key], "r") as file:
+                self.caches[key] = json.load(file)
+        return self.caches[key]
+
+    # Entries of a list cache indexed by one of their fields (first entry wins)
+    def index(self, key, field):
+        if (key, field) not in self.indexes:
+            index = {}
+            for entry in self.load(key):
+                index.setdefault(entry[field], entry)
+            self.indexes[(key, field)] = index
+        return self.indexes[(key, field)]
+
+    # Official deviceOS release for a version, or None
+    def firmware(self, version):
+        return self.index("firmware", "version").get(version)
+
+    # All official deviceOS versions, oldest first
+    def firmware_versions(self):
+        return [entry["version"] for entry in self.load("firmware")]
+
+    # Official platform where a field (name, id, ...) has a value, or None
+    def platform(self, field, value):
+        return self.index("platforms", field).get(value)
+
+    # All official platform names
+    def platform_names(self):
+        return [entry["name"] for entry in self.load("platforms")]
+
+    # Official toolchain for a deviceOS version, or None
+    def toolchain(self, version):
+        return self.index("toolchains", "firmware").get("deviceOS@%s" % version)
+
+    # Dependency entries for this system (gcc-arm, buildtools, ...) indexed by version
+    def dependency_index(self, name):
+        key = (DEPENDENCY_CACHES[name], "version")
+        if key not in self.indexes:
+            index = {}
+            for entry in self.load(key[0])[operating_system]["x64"]:
+                index.setdefault(entry["version"], entry)
+            self.indexes[key] = index
+        return self.indexes[key]
+
+    # Dependency entry for this system, or None
+    def dependency(self, name, version):
+        return self.dependency_index(name).get(version)
+
+    # Parsed .workbench/manifest.json inside a deviceOS directory, or None.
+    # Missing manifests are not remembered since deviceOS may be installed later.
+    def custom_manifest(self, firmware_path):
+        if firmware_path not in self.custom:
+            custom_manifest = os.path.join(firmware_path, ".workbench", "manifest.json")
+            if not os.path.isfile(custom_manifest):
+                return None
+            import json
+            with open(custom_manifest, "r") as file:
+                data = json.load(file)
+            platforms = {}
+            for field in ("name", "id"):
+                platforms[field] = {}
+                for device in data.get("platforms", []):
+                    platforms[field].setdefault(device[field], device)
+            self.custom[firmware_path] = (data, platforms)
+        return self.custom[firmware_path]
+
+# Catalog shared by every lookup in this process
+current_catalog = None
+
+# Get the catalog, creating it on first use
+def get_catalog():
+    global current_catalog
+    if current_catalog is None:
+        current_catalog = Catalog()
+        current_catalog.restore()
+    return current_catalog
+
+# Forget loaded caches after they have been rewritten and snapshot them again
+def reset_catalog():
+    global current_catalog
+    current_catalog = None
+    get_catalog()
@@ -0,0 +1,170 @@
+import os
+import json
+import time
+import shlex
+import hashlib
+import subprocess
+import concurrent.futures
+
+# Local imports
+from .common import ProcessError, ProjectError, UserError, projectFiles, min_particle_env
+from .manifest import load_manifest
+from .project import get_settings, get_flags, get_setting
+from .toolchain import get_compiler, get_firmware_path
+from .jobs import make_jobs, split_jobs_option
+from .build import prepare_build, add_compiler, add_build_tools, project_artifact
+from .unity import plan_staging, batched_directory
+
+# Compile flags resolved from the Makefile, kept in the output directory of a configuration
+FLAGS_FILE = ".neopo-check.json"
+
+# Sources that are checked, by the language their flags are resolved for
+CHECKED_EXTENSIONS = (".c", ".cpp")
+
+# Sources that the Makefile compiles, including those that can not be checked on their own
+SOURCE_EXTENSIONS = (".c", ".cpp", ".S", ".ino")
+
+# Options that only matter for the object file or its dependencies
+OUTPUT_OPTIONS = ["-c", "-MD", "-MMD", "-MP"]
+OUTPUT_VALUE_OPTIONS = ["-o", "-MF", "-MT", "-MQ"]
+
+# Sources of a project and its libraries that the Makefile compiles
+def project_sources(project_path):
+    return sorted(path for relative, (_, path) in plan_staging(project_path, 1, {}).items()
+                  if os.path.dirname(relative) and batched_directory(os.path.dirname(relative))
+                  and relative.endswith(SOURCE_EXTENSIONS))
+
+# Everything that the compile flags of a project depend on, as a key for the cached flags
+def flags_key(project_path, platform, version):
+    _, script_version, tools_version, _ = load_manifest()
+    libraries = sorted(os.path.dirname(path) for path in project_sources(project_path)
+                       if path.startswith(os.path.join(project_path, "lib") + os.sep))
+    values = json.dumps([project_path, platform, version, get_firmware_path(version), get_flags(project_path),
+                         get_compiler(version), script_version, tools_version, sorted(set(libraries))])
+    return hashlib.sha256(values.encode("utf-8")).hexdigest()
+
+# Split a compile command from the Makefile into the compiler, its flags and the source
+def parse_compile(words):
+    flags, sources = [], []
+    index = 1
+    while index < len(words):
+        word = words[index]
+        index += 1
+        if word in OUTPUT_VALUE_OPTIONS:
+            index += 1
+        elif word in OUTPUT_OPTIONS:
+            continue
+        elif not word.startswith("-") and word.endswith(CHECKED_EXTENSIONS):
+            sources.append(word)
+        else:
+            flags.append(word)
+    return words[0], flags, sources[0] if len(sources) == 1 else None
+
+# Ask make which commands it would run to build every object of a project, and keep
+# the compiler and flags it uses for the sources of the project in each language
+def resolve_flags(project_path, platform, version):
+    build = prepare_build(project_path, "compile-user", False, 0, platform=platform, version=version)
+    process = [arg for arg in build["process"] if arg != "-k"]
+    process = ["-f" if arg == "-sf" else "APPDIR=%s" % project_path if arg.startswith("APPDIR=") else arg
+               for arg in process]
+    process[1:1] = ["-n", "-B", "-w"]
+    result = subprocess.run(process, env=build["env"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                            universal_newlines=True, errors="replace")
+
+    flags = {}
+    directory = project_path
+    for line in result.stdout.splitlines():
+        # Relative paths are relative to the directory make is in
+        if "Entering directory" in line:
+            directory = line.split("Entering directory", 1)[1].strip(" '`\"")
+            continue
+        try:
+            words = shlex.split(line)
+        except ValueError:
+            continue
+        if "-c" not in words:
+            continue
+        compiler, options, source = parse_compile(words)
+        if not source:
+            continue
+        source = os.path.normpath(os.path.join(directory, source))
+        extension = os.path.splitext(source)[1]
+        if source.startswith(project_path + os.sep) and extension not in flags:
+            flags[extension] = {"compiler": compiler, "flags": options, "directory": directory}
+    if not flags:
+        print(result.stdout)
+        raise ProcessError("Could not find the compile flags of %s!" % project_path)
+    return build["configuration"], flags
+
+# Compile flags of a project, resolved with make once per configuration and read
+# from the output directory afterwards
+def compile_flags(project_path, platform, version, extensions):
+    output_path = os.path.dirname(project_artifact(project_path, platform, version))
+    key = flags_key(project_path, platform, version)
+    try:
+        with open(os.path.join(output_path, FLAGS_FILE), "r") as file:
+            cached = json.load(file)
+        if cached["key"] == key and all(extension in cached["flags"] for extension in extensions):
+            return cached
+    except (OSError, ValueError, KeyError):
+        pass
+
+    configuration, flags = resolve_flags(project_path, platform, version)
+    cached = {"key": key, "gcc-arm": configuration["gcc-arm"],
+              "buildtools": configuration["buildtools"], "flags": flags}
+    os.makedirs(output_path, exist_ok=True)
+    with open(os.path.join(output_path, FLAGS_FILE), "w") as file:
+        json.dump(cached, file, indent=4)
+    return cached
+
+# Check the syntax of one source, returning its diagnostics and whether it passed
+def check_source(source, flags, environment):
+    result = subprocess.run([flags["compiler"], *flags["flags"], "-fsyntax-only", source],
+                            cwd=flags["directory"], env=environment, stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT, universal_newlines=True, errors="replace")
+    return result.stdout, result.returncode == 0
+
+# Check the syntax of every source of a project and its libraries in parallel, with the
+# flags the Makefile would compile them with. Diagnostics are printed as sources finish.
+def check_project(project_path, jobs=None):
+    try:
+        platform, version = get_settings(project_path)
+    except (FileNotFoundError, KeyError) as error:
+        if os.path.isfile(os.path.join(project_path, projectFiles["properties"])):
+            raise ProjectError(
+                "Project not configured!\nUse: neopo configure <platform> <version> <project>") from error
+        raise UserError("%s is not a Particle project!" % project_path) from error
+
+    sources = project_sources(project_path)
+    checked = [source for source in sources if source.endswith(CHECKED_EXTENSIONS)]
+    if not checked:
+        raise UserError("No sources to check in %s!" % project_path)
+    start = time.monotonic()
+    cached = compile_flags(project_path, platform, version, {os.path.splitext(source)[1] for source in checked})
+
+    environment = min_particle_env()
+    add_build_tools(environment, cached["buildtools"])
+    add_compiler(environment, cached["gcc-arm"], False)
+
+    failed = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=make_jobs(jobs, get_setting(project_path, "MAKE_JOBS"))) as executor:
+        futures = {executor.submit(check_source, source, cached["flags"][os.path.splitext(source)[1]],
+                                   environment): source for source in checked}
+        for future in concurrent.futures.as_completed(futures):
+            diagnostics, passed = future.result()
+            if not passed:
+                failed.append(futures[future])
+            print(diagnostics, end="", flush=True)
+
+    skipped = len(sources) - len(checked)
+    print("Checked %d sources in %.1fs%s." % (len(checked), time.monotonic() - start,
+                                              ", skipped %d .ino and assembly sources" % skipped if skipped else ""))
+    if failed:
+        raise ProcessError("%d of %d sources have errors!" % (len(failed), len(checked)))
+
+# Wrapper for [check]
+def check_command(args):
+    jobs, args = split_jobs_option(args[2:])
+    if len(args) > 1:
+        raise UserError("Too many arguments!")
+    check_project(os.path.abspath(args[0]) if args else os.getcwd(), jobs)
@@ -51,8 +51,8 @@ def particle(args=None):
     particle_command([None, None, *args])
 
 # Build options
-def build(project_path=os.getcwd(), verbosity=""):
-    compile_command([None, None, project_path, verbosity])
+def build(project_path=os.getcwd(), verbosity="", force=False):
+    return compile_command([None, None, project_path, verbosity, "--force" if force else ""])
 
 def flash(project_path=os.getcwd(), verbosity=""):
     flash_command([None, None, project_path, verbosity])
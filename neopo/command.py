@@ -1,20 +1,69 @@
 import os
 import sys
-import subprocess
+from importlib import import_module
 
 # Local imports
 from .version import NEOPO_VERSION
-from .common import NEOPO_DEPS
+from .common import NEOPO_DEPS, DAEMON_SOCKET
 from .common import ProcessError, UserError, particle_cli, running_on_windows
-from .utility import print_help, handle_missing_file, unexpected_error
-from .workbench import install_or_update, workbench_install
-from .toolchain import versions_command, get_command, download_unlisted_command, remove_command
-from .project import create_command, configure_command, flags_command, settings_command, libraries_command
-from .build import compile_command, flash_command, flash_all_command, clean_command, run_command, export_command
-from .build import flash_bootloader_command
-from .completion import versions_compressed, platforms_command, find_valid_projects, get_makefile_targets
-from .particle import particle_command, particle_env
-from .serial import get_particle_serial_ports, serial_open, dfu_open, serial_reset, dfu_close, get_dfu_device
+
+# Stand-in for a function in another module that imports the module on first call.
+# Completion and the other quick commands never load the download and build code.
+def deferred(module, name):
+    def function(*args, **kwargs):
+        return getattr(import_module(module, __package__), name)(*args, **kwargs)
+    function.__name__ = name
+    return function
+
+print_help = deferred(".utility", "print_help")
+handle_missing_file = deferred(".utility", "handle_missing_file")
+unexpected_error = deferred(".utility", "unexpected_error")
+install_or_update = deferred(".workbench", "install_or_update")
+workbench_install = deferred(".workbench", "workbench_install")
+versions_command = deferred(".toolchain", "versions_command")
+get_command = deferred(".toolchain", "get_command")
+download_unlisted_command = deferred(".toolchain", "download_unlisted_command")
+remove_command = deferred(".toolchain", "remove_command")
+create_command = deferred(".project", "create_command")
+configure_command = deferred(".project", "configure_command")
+flags_command = deferred(".project", "flags_command")
+settings_command = deferred(".project", "settings_command")
+libraries_command = deferred(".project", "libraries_command")
+jobs_command = deferred(".project", "jobs_command")
+precompiled_command = deferred(".project", "precompiled_command")
+unity_command = deferred(".project", "unity_command")
+scratch_command = deferred(".project", "scratch_command")
+shared_libraries_command = deferred(".project", "shared_libraries_command")
+check_command = deferred(".check", "check_command")
+test_command = deferred(".host", "test_command")
+compile_command = deferred(".build", "compile_command")
+flash_command = deferred(".build", "flash_command")
+flash_all_command = deferred(".build", "flash_all_command")
+clean_command = deferred(".build", "clean_command")
+run_command = deferred(".build", "run_command")
+export_command = deferred(".build", "export_command")
+flash_bootloader_command = deferred(".build", "flash_bootloader_command")
+warm_command = deferred(".build", "warm_command")
+build_all_command = deferred(".batch", "build_all_command")
+matrix_command = deferred(".batch", "matrix_command")
+watch_command = deferred(".watch", "watch_command")
+versions_compressed = deferred(".completion", "versions_compressed")
+platforms_command = deferred(".completion", "platforms_command")
+find_valid_projects = deferred(".completion", "find_valid_projects")
+get_makefile_targets = deferred(".completion", "get_makefile_targets")
+particle_command = deferred(".particle", "particle_command")
+particle_env = deferred(".particle", "particle_env")
+get_particle_serial_ports = deferred(".serial", "get_particle_serial_ports")
+serial_open = deferred(".serial", "serial_open")
+dfu_open = deferred(".serial", "dfu_open")
+serial_reset = deferred(".serial", "serial_reset")
+dfu_close = deferred(".serial", "dfu_close")
+get_dfu_device = deferred(".serial", "get_dfu_device")
+cache_command = deferred(".compiler_cache", "cache_command")
+daemon_command = deferred(".daemon", "daemon_command")
+forward_command = deferred(".daemon", "forward_command")
+outputs_command = deferred(".outputs", "outputs_command")
+library_store_command = deferred(".libstore", "library_store_command")
 
 # Print all commands (for completion)
 def options(args):
@@ -107,6 +156,7 @@ iterable_commands = {
 
 # Iterate through all connected devices and run a command
 def iterate_command(args):
+    import subprocess
     # Find Particle deviceIDs connected via USB
     process = [particle_cli, "serial", "list"]
     particle = subprocess.run(process, stdout=subprocess.PIPE, env=particle_env(),
@@ -185,6 +235,7 @@ def legacy_options(args):
 
 # Run POSTINSTALL setup script for Manjaro/Arch
 def setup_command(args):
+    import subprocess
     # Check for lock file in ~/.neopo to discourage
     # running setup_command multiple times
     lock_file = os.path.join(NEOPO_DEPS, ".setupdone")
@@ -228,7 +279,13 @@ commands = {
     "build": compile_command,
     "flash": flash_command,
     "flash-all": flash_all_command,
+    "build-all": build_all_command,
+    "matrix": matrix_command,
+    "watch": watch_command,
+    "check": check_command,
+    "test": test_command,
     "bootloader": flash_bootloader_command,
+    "warm": warm_command,
     "clean": clean_command,
     "run": run_command,
     "export": export_command,
@@ -253,17 +310,40 @@ commands = {
     "wait": script_wait,
     "print": script_print,
     "settings": settings_command,
+    "jobs": jobs_command,
+    "pch": precompiled_command,
+    "unity": unity_command,
+    "scratch": scratch_command,
+    "shared-libs": shared_libraries_command,
     "libs": libraries_command,
     "setup": setup_command,
-    "setup-workbench": workbench_install
+    "setup-workbench": workbench_install,
+    "cache": cache_command,
+    "outputs": outputs_command,
+    "library-store": library_store_command,
+    "daemon": daemon_command
 }
 
+# Commands that run in the build daemon when it is running
+daemon_commands = ["compile", "build", "flash", "flash-all", "clean", "run", "versions"]
+
+# Check whether a command should be forwarded to the build daemon. The socket
+# module is only imported when the daemon has been started.
+def use_daemon(args):
+    return (args[1] in daemon_commands and not running_on_windows
+            and os.environ.get("NEOPO_DAEMON") != "0" and os.path.exists(DAEMON_SOCKET))
+
 # Evaluate command-line arguments and call necessary functions
 def main(args):
     if len(args) == 1:
         print_help(None)
     elif args[1] in commands:
         try:
+            # Let the daemon run the command, or run it here if the daemon is gone
+            if use_daemon(args):
+                code = forward_command(args)
+                if code is not None:
+                    sys.exit(code)
             commands[args[1]](args)
         except FileNotFoundError as error:
             handle_missing_file(error.filename)
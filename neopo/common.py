@@ -1,15 +1,34 @@
 # Paths, dictionaries, and errors used by other modules
 import os
-import platform
+import sys
 
-# Windows tricks
-running_on_windows = platform.system() == "Windows"
+# Windows tricks (the platform module is slow to import, so avoid it here)
+running_on_windows = sys.platform == "win32"
+
+# Lowercase operating system name, as used by the dependency caches
+operating_system = "windows" if running_on_windows else os.uname().sysname.lower()
 
 # Home directory of user running neopo
 HOME_DIR = os.path.expanduser("~") if running_on_windows else os.environ["HOME"]
 
-# Enable parallel downloads with opt-in variable
-NEOPO_PARALLEL = "NEOPO_PARALLEL" in os.environ
+# Limit how many dependencies are downloaded and extracted at once. Example:
+# NEOPO_DOWNLOADS=1 NEOPO_EXTRACTS=1 neopo install
+NEOPO_DOWNLOADS = max(1, int(os.environ.get("NEOPO_DOWNLOADS", "4")))
+NEOPO_EXTRACTS = max(1, int(os.environ.get("NEOPO_EXTRACTS", "2")))
+
+# Number of parallel make jobs used by builds, chosen from the available cores and
+# memory when unset. Example:
+# NEOPO_JOBS=8 neopo build
+NEOPO_JOBS = os.environ.get("NEOPO_JOBS")
+
+# Scratch directory (a tmpfs for example) for the intermediate files of every build,
+# or auto for one in memory where possible. Example:
+# NEOPO_SCRATCH=auto neopo build
+NEOPO_SCRATCH = os.environ.get("NEOPO_SCRATCH")
+
+# Precompile Particle.h for every project, not only those that enable it. Example:
+# NEOPO_PCH=1 neopo build
+NEOPO_PCH = os.environ.get("NEOPO_PCH") == "1"
 
 # Specify custom path. Example:
 # NEOPO_PATH=$PWD/temp neopo particle
@@ -37,6 +56,38 @@ else:
     NEOPO_DEPS = os.path.join(HOME_DIR, ".neopo")
     CACHE_DIR = os.path.join(NEOPO_DEPS, "cache")
 
+# Content-addressed store of verified archives, shareable between roots. Example:
+# NEOPO_ARCHIVES=/srv/neopo/archives neopo install -f
+ARCHIVE_DIR = os.environ.get("NEOPO_ARCHIVES", os.path.join(CACHE_DIR, "archives"))
+
+# Maximum size of the archive store in MiB, least recently used archives are
+# evicted first (0 disables the store). Example:
+# NEOPO_ARCHIVE_LIMIT=8192 neopo get 4.0.0
+ARCHIVE_LIMIT = int(os.environ.get("NEOPO_ARCHIVE_LIMIT", "4096")) * 1024 * 1024
+
+# Compiler cache used by every build, bounded to a size in MiB with least recently
+# used objects evicted first (0 disables the cache). Example:
+# NEOPO_CCACHE_LIMIT=8192 neopo build
+COMPILER_CACHE_DIR = os.environ.get("NEOPO_CCACHE", os.path.join(NEOPO_DEPS, "ccache"))
+COMPILER_CACHE_LIMIT = int(os.environ.get("NEOPO_CCACHE_LIMIT", "2048")) * 1024 * 1024
+
+# Device OS libraries built once per platform, version, compiler and flags and
+# linked by every project with that configuration. Example:
+# NEOPO_DEVICE_OS_LIBS=/srv/neopo/device-os neopo warm argon 4.0.0
+DEVICE_OS_LIBS_DIR = os.environ.get("NEOPO_DEVICE_OS_LIBS", os.path.join(NEOPO_DEPS, "device-os-libs"))
+
+# Compiled Particle libraries shared by projects that use the same version with the
+# same configuration, for every project (NEOPO_SHARED_LIBS=1) or those that enable it. Example:
+# NEOPO_LIBRARY_STORE=/srv/neopo/libraries NEOPO_SHARED_LIBS=1 neopo build
+LIBRARY_STORE_DIR = os.environ.get("NEOPO_LIBRARY_STORE", os.path.join(NEOPO_DEPS, "library-store"))
+NEOPO_SHARED_LIBS = os.environ.get("NEOPO_SHARED_LIBS") == "1"
+
+# Socket of the optional build daemon, which neopo forwards builds to when it is
+# running (NEOPO_DAEMON=0 runs them directly). Example:
+# neopo daemon start
+DAEMON_SOCKET = os.environ.get("NEOPO_DAEMON_SOCKET", os.path.join(NEOPO_DEPS, "daemon.sock"))
+DAEMON_LOG = os.path.join(NEOPO_DEPS, "daemon.log")
+
 # DEBUG
 # print(BASE_DIR, PARTICLE_DEPS, NEOPO_DEPS, CACHE_DIR, sep="\n")
 
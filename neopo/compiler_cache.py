@@ -0,0 +1,260 @@
+import os
+import sys
+import shutil
+import hashlib
+import subprocess
+
+# Local imports
+from .common import COMPILER_CACHE_DIR, COMPILER_CACHE_LIMIT, running_on_windows, UserError
+from .precompiled import precompiled_arguments
+
+# Compilers that are wrapped by the cache
+CACHED_COMPILERS = ["arm-none-eabi-gcc", "arm-none-eabi-g++"]
+
+# Inputs that can be compiled from their preprocessed form
+SOURCE_EXTENSIONS = (".c", ".cc", ".cp", ".cpp", ".cxx", ".c++", ".C", ".S")
+
+# Options followed by a separate value
+VALUE_OPTIONS = ["-o", "-x", "-D", "-U", "-I", "-include", "-imacros", "-isystem", "-iquote",
+                 "-idirafter", "-iprefix", "-iwithprefix", "-isysroot", "-MF", "-MT", "-MQ",
+                 "-Xassembler", "-Xpreprocessor", "-aux-info"]
+
+# Options that produce something other than a single object file
+UNCACHEABLE_OPTIONS = ["-E", "-S", "-M", "-MM", "-save-temps", "-fprofile-arcs", "--coverage"]
+
+# Dependency file options, which do not change the object file
+DEPENDENCY_OPTIONS = ["-MD", "-MMD", "-MP"]
+DEPENDENCY_VALUE_OPTIONS = ["-MF", "-MT", "-MQ"]
+
+# Outcomes counted for [cache stats]
+OUTCOMES = ["hits", "misses", "uncacheable"]
+
+# Check whether the compiler cache is in use
+def cache_enabled():
+    return COMPILER_CACHE_LIMIT > 0 and not running_on_windows
+
+# Count an outcome by appending a byte to its file, which is safe from parallel compilers
+def count(outcome):
+    path = os.path.join(COMPILER_CACHE_DIR, "stats")
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, outcome), "ab") as file:
+        file.write(b".")
+
+# Times an outcome was counted
+def counted(outcome):
+    try:
+        return os.path.getsize(os.path.join(COMPILER_CACHE_DIR, "stats", outcome))
+    except OSError:
+        return 0
+
+# Split a compiler invocation into what the cache needs, or None if it can not be cached.
+# Returns the object file, the arguments to preprocess it and the arguments that affect it.
+def parse_arguments(args):
+    if "-c" not in args:
+        return None
+    output, sources, dependencies, targeted = None, [], False, False
+    preprocess, key = [], []
+    index = 0
+    while index < len(args):
+        arg = args[index]
+        value = args[index + 1] if arg in VALUE_OPTIONS and index + 1 < len(args) else None
+        index += 2 if value is not None else 1
+        if arg in UNCACHEABLE_OPTIONS or arg.startswith("@") or arg.startswith("-Wp,"):
+            return None
+        if arg == "-o":
+            output = value
+        elif arg in DEPENDENCY_OPTIONS:
+            dependencies = True
+            preprocess.append(arg)
+        elif arg in DEPENDENCY_VALUE_OPTIONS:
+            targeted = targeted or arg != "-MF"
+            preprocess.extend([arg, value])
+        elif arg == "-c":
+            preprocess.append("-E")
+            key.append(arg)
+        elif value is not None:
+            preprocess.extend([arg, value])
+            key.extend([arg, value])
+        elif not arg.startswith("-") and arg.endswith(SOURCE_EXTENSIONS):
+            sources.append(arg)
+            preprocess.append(arg)
+        else:
+            preprocess.append(arg)
+            key.append(arg)
+
+    if not output or len(sources) != 1:
+        return None
+
+    # Write the same dependency file as the compiler would, while preprocessing
+    if dependencies:
+        if "-MF" not in args:
+            preprocess.extend(["-MF", os.path.splitext(output)[0] + ".d"])
+        if not targeted:
+            preprocess.extend(["-MQ", output])
+
+    # Debug information records the working directory
+    if any(arg.startswith("-g") for arg in key):
+        key.append(os.getcwd())
+    return output, preprocess, key
+
+# Hash the compiler binary, the options and the preprocessed source into a cache key
+def cache_key(compiler, key, preprocessed):
+    real = os.path.realpath(shutil.which(compiler) or compiler)
+    stat = os.stat(real)
+    digest = hashlib.sha256(("%s\0%d\0%d\0" % (real, stat.st_size, stat.st_mtime_ns)).encode("utf-8"))
+    digest.update("\0".join(key).encode("utf-8") + b"\0")
+    digest.update(preprocessed)
+    return digest.hexdigest()
+
+# Path of a cache entry without extension
+def entry_path(key):
+    return os.path.join(COMPILER_CACHE_DIR, key[:2], key)
+
+# Copy a file into place atomically
+def copy_file(source, destination):
+    temp = "%s.%d.tmp" % (destination, os.getpid())
+    shutil.copyfile(source, temp)
+    os.replace(temp, destination)
+
+# Compile through the cache, returning the exit code of the compiler
+def compile_cached(compiler, args):
+    args = precompiled_arguments(compiler, args)
+    arguments = parse_arguments(args) if cache_enabled() else None
+    if not arguments:
+        if cache_enabled() and "-c" in args:
+            count("uncacheable")
+        return subprocess.call([compiler, *args])
+    output, preprocess, key = arguments
+
+    # Errors are reported by the real compilation
+    preprocessed = subprocess.run([compiler, *preprocess], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if preprocessed.returncode != 0:
+        count("uncacheable")
+        return subprocess.call([compiler, *args])
+
+    entry = entry_path(cache_key(compiler, key, preprocessed.stdout))
+    if os.path.isfile(entry + ".o"):
+        try:
+            copy_file(entry + ".o", output)
+            if os.path.isfile(entry + ".stderr"):
+                with open(entry + ".stderr", "rb") as file:
+                    sys.stderr.buffer.write(file.read())
+            # Mark as recently used
+            os.utime(entry + ".o")
+            count("hits")
+            return 0
+        except OSError:
+            pass
+
+    result = subprocess.run([compiler, *args], stderr=subprocess.PIPE)
+    sys.stderr.buffer.write(result.stderr)
+    count("misses")
+    if result.returncode == 0 and os.path.isfile(output):
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        if result.stderr:
+            with open(entry + ".stderr", "wb") as file:
+                file.write(result.stderr)
+        copy_file(output, entry + ".o")
+    return result.returncode
+
+# Create scripts named like the compilers in a gcc-arm bin directory that call them
+# through the cache (and precompiled headers), returning the directory to put on
+# PATH in place of bin
+def compiler_shims(compiler_bin, precompiled=False):
+    if running_on_windows or not (cache_enabled() or precompiled):
+        return compiler_bin
+    name = hashlib.sha256(compiler_bin.encode("utf-8")).hexdigest()[:16]
+    shims = os.path.join(COMPILER_CACHE_DIR, "bin", name)
+    os.makedirs(shims, exist_ok=True)
+
+    # Run this module with the interpreter, package and cache used by neopo now
+    package_parent = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    for compiler in CACHED_COMPILERS:
+        real = os.path.join(compiler_bin, compiler)
+        if not os.path.isfile(real):
+            continue
+        script = "\n".join([
+            "#!/bin/sh",
+            'NEOPO_CCACHE="%s" PYTHONPATH="%s${PYTHONPATH:+:$PYTHONPATH}" exec "%s" -m neopo.compiler_cache "%s" "$@"' % (
+                COMPILER_CACHE_DIR, package_parent, sys.executable, real), ""])
+        path = os.path.join(shims, compiler)
+        try:
+            with open(path, "r") as file:
+                if file.read() == script:
+                    continue
+        except OSError:
+            pass
+        temp = "%s.%d.tmp" % (path, os.getpid())
+        with open(temp, "w") as file:
+            file.write(script)
+        os.chmod(temp, 0o755)
+        os.replace(temp, path)
+
+    # Tools that are not wrapped (ar, objcopy, ...) are still found in bin
+    return os.pathsep.join([shims, compiler_bin])
+
+# Cached objects as (mtime, size, path) tuples
+def cache_entries():
+    entries = []
+    if not os.path.isdir(COMPILER_CACHE_DIR):
+        return entries
+    for directory in os.listdir(COMPILER_CACHE_DIR):
+        path = os.path.join(COMPILER_CACHE_DIR, directory)
+        if len(directory) != 2 or not os.path.isdir(path):
+            continue
+        for file in os.listdir(path):
+            if file.endswith(".o"):
+                stat = os.stat(os.path.join(path, file))
+                entries.append((stat.st_mtime, stat.st_size, os.path.join(path, file)))
+    return entries
+
+# Delete least recently used objects until the cache fits within its limit
+def trim_cache(limit=COMPILER_CACHE_LIMIT):
+    if not cache_enabled():
+        return
+    entries = cache_entries()
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= limit:
+            break
+        for stale in (path, path[:-2] + ".stderr"):
+            if os.path.isfile(stale):
+                os.remove(stale)
+        total -= size
+
+# Print hit rate and size of the compiler cache
+def cache_stats():
+    hits, misses, uncacheable = [counted(outcome) for outcome in OUTCOMES]
+    entries = cache_entries()
+    print("Compiler cache: %s" % COMPILER_CACHE_DIR)
+    if not cache_enabled():
+        print("The compiler cache is disabled.")
+    print("Hits: %d" % hits)
+    print("Misses: %d" % misses)
+    print("Uncacheable: %d" % uncacheable)
+    if hits + misses:
+        print("Hit rate: %.1f%%" % (100.0 * hits / (hits + misses)))
+    print("Objects: %d" % len(entries))
+    print("Size: %.1f MiB of %.1f MiB" % (sum(size for _, size, _ in entries) / 1048576,
+                                          COMPILER_CACHE_LIMIT / 1048576))
+
+# Delete every cached object and reset the statistics
+def cache_clear():
+    for directory in os.listdir(COMPILER_CACHE_DIR) if os.path.isdir(COMPILER_CACHE_DIR) else []:
+        if directory != "bin":
+            shutil.rmtree(os.path.join(COMPILER_CACHE_DIR, directory), ignore_errors=True)
+    print("Cleared the compiler cache.")
+
+# Wrapper for [cache]
+def cache_command(args):
+    cache_commands = {"stats": cache_stats, "clear": cache_clear}
+    try:
+        cache_commands[args[2]]()
+    except IndexError:
+        cache_stats()
+    except KeyError as error:
+        raise UserError("Invalid cache command! Commands are: %s" % ", ".join(cache_commands)) from error
+
+# Compilers are invoked through the shims as: <compiler> <arguments...>
+if __name__ == "__main__":
+    sys.exit(compile_cached(sys.argv[1], sys.argv[2:]))
@@ -1,35 +1,82 @@
 import os
-import json
 
 # Local imports
-from .common import jsonFiles, projectFiles, PARTICLE_DEPS
+from .common import jsonFiles, projectFiles, PARTICLE_DEPS, CACHE_DIR
+from .catalog import get_catalog
 
-# Print available versions compressed (for completion)
-def versions_compressed(args):
-    total_versions = set()
-    with open(jsonFiles["firmware"], "r") as firmware_file:
-        total_versions.update([entry["version"] for entry in json.load(firmware_file)])
+# Flat index read by the completion script, one "<key> <word>..." line per key:
+# versions, platforms, buildscripts (the installed version) and targets@<buildscripts version>
+INDEX_FILE = os.path.join(CACHE_DIR, "completion.index")
+
+# Targets listed on the .PHONY lines of a Makefile
+def makefile_targets(path):
+    sep = ".PHONY: "
+    with open(path, "r") as makefile:
+        return [target for line in makefile if line.startswith(sep)
+                for target in line.partition(sep)[2].split()]
+
+# Sort key ordering versions like sort -V, so 5.10.0 comes after 5.2.0
+def version_key(version):
+    return [(0, int(part), "") if part.isdigit() else (1, 0, part)
+            for part in version.replace("-", ".").split(".")]
+
+# Rebuild the completion index after dependencies or caches change
+def write_completion_index():
+    import json
+    catalog = get_catalog()
+    versions = set(catalog.firmware_versions())
     device_os_path = os.path.join(PARTICLE_DEPS, "deviceOS")
     if os.path.isdir(device_os_path):
         _, installed_versions, _ = next(os.walk(device_os_path))
-        total_versions.update(installed_versions)
-    print(*sorted(total_versions))
+        versions.update(installed_versions)
+    index = [("versions", sorted(versions, key=version_key)), ("platforms", catalog.platform_names())]
+
+    try:
+        with open(jsonFiles["manifest"], "r") as manifest:
+            index.append(("buildscripts", [json.load(manifest)["buildscripts"]]))
+    except (OSError, ValueError, KeyError):
+        pass
+
+    buildscripts_path = os.path.join(PARTICLE_DEPS, "buildscripts")
+    if os.path.isdir(buildscripts_path):
+        for version in sorted(os.listdir(buildscripts_path), key=version_key):
+            makefile = os.path.join(buildscripts_path, version, "Makefile")
+            if os.path.isfile(makefile):
+                index.append(("targets@%s" % version, makefile_targets(makefile)))
+
+    temp = "%s.%d" % (INDEX_FILE, os.getpid())
+    with open(temp, "w") as file:
+        for key, words in index:
+            file.write(" ".join([key, *words]) + "\n")
+    os.replace(temp, INDEX_FILE)
+
+# Load the completion index, creating it if neopo has not written one yet
+def read_completion_index():
+    if not os.path.isfile(INDEX_FILE):
+        write_completion_index()
+    with open(INDEX_FILE, "r") as file:
+        return {key: words for key, *words in (line.split() for line in file if line.strip())}
+
+# Print available versions compressed (for completion)
+def versions_compressed(args):
+    print(*read_completion_index().get("versions", []))
 
 # Print available platforms (for completion)
 def platforms_command(args):
-    with open(jsonFiles["platforms"], "r") as platform_file:
-        print(*[entry["name"] for entry in json.load(platform_file)])
+    print(*read_completion_index().get("platforms", []))
+
+# Subdirectories of a directory that are Particle projects
+def valid_projects(path):
+    (_, dirs, _) = next(os.walk(path))
+    return [dir for dir in sorted(dirs)
+        if os.access(os.path.join(path, dir, projectFiles["properties"]), os.R_OK)]
 
 # Find all valid projects in PWD (for completion)
 def find_valid_projects(args):
-    (_, dirs, _) = next(os.walk(os.getcwd()))
-    print(*[dir for dir in dirs
-        if os.access(os.path.join(dir, projectFiles["properties"]), os.R_OK)])
+    print(*valid_projects(os.getcwd()))
 
 # Find all makefile targets (for completion)
 def get_makefile_targets(args):
-    with open(jsonFiles["manifest"], "r") as manifest:
-        with open(os.path.join(PARTICLE_DEPS, "buildscripts", json.load(manifest)["buildscripts"], "Makefile")) as makefile:
-            sep = ".PHONY: "
-            print(*[line.partition(sep)[2].strip("\n")
-                    for line in makefile.readlines() if line.startswith(sep)])
+    index = read_completion_index()
+    buildscripts = index.get("buildscripts", [None])[0]
+    print(*index.get("targets@%s" % buildscripts, []))
@@ -0,0 +1,488 @@
+import os
+import sys
+import json
+import time
+import heapq
+import signal
+import socket
+import struct
+import importlib
+import selectors
+import traceback
+
+# Local imports. Building is only imported by the daemon itself, so forwarding
+# a command from the client stays quick.
+from .common import DAEMON_SOCKET, DAEMON_LOG, jsonFiles, projectFiles, running_on_windows, UserError
+from .catalog import SNAPSHOT_SOURCES, source_stamps, get_catalog, reset_catalog
+from .jobs import make_jobs, split_jobs_option
+
+# Frames sent to clients: a type, the length of the payload and the payload
+FRAME_HEADER = struct.Struct("!cI")
+OUTPUT_FRAME = b"o"
+EXIT_FRAME = b"x"
+LOCAL_FRAME = b"l"
+
+# Commands forwarded to the daemon and their priority, lower runs first. Flashing
+# goes before compiling since a device is waiting, and versions needs no make jobs.
+PRIORITIES = {"versions": 0, "flash": 1, "flash-all": 1, "compile": 2, "build": 2, "clean": 2, "run": 2}
+QUICK_COMMANDS = ["versions"]
+
+# Modules imported before serving so requests start warm
+PRELOADED_MODULES = [".command", ".build", ".batch", ".project", ".toolchain", ".workbench",
+                     ".completion", ".utility", ".help_info", ".particle"]
+
+# Variables outside NEOPO_* that settings are read from when neopo starts
+SETTINGS_VARIABLES = ["HOME"]
+
+# Variables that do not change the settings of a request
+IGNORED_VARIABLES = ["NEOPO_DAEMON"]
+
+# Seconds to wait for a started daemon to accept connections
+START_TIMEOUT = 10
+
+# Send a frame to a client
+def send_frame(connection, kind, payload):
+    connection.sendall(FRAME_HEADER.pack(kind, len(payload)) + payload)
+
+# Read frames from the daemon until it closes the connection
+def read_frames(connection):
+    data = b""
+    while True:
+        while len(data) >= FRAME_HEADER.size:
+            kind, length = FRAME_HEADER.unpack_from(data)
+            if len(data) < FRAME_HEADER.size + length:
+                break
+            yield kind, data[FRAME_HEADER.size:FRAME_HEADER.size + length]
+            data = data[FRAME_HEADER.size + length:]
+        chunk = connection.recv(65536)
+        if not chunk:
+            return
+        data += chunk
+
+# Connect to the daemon, or return None if it is not running
+def connect():
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(DAEMON_SOCKET)
+    except OSError:
+        connection.close()
+        return None
+    return connection
+
+# Variables of an environment that neopo reads its settings from when it starts.
+# These are only read once in the daemon, so requests that set them differently run locally.
+def settings_variables(environment):
+    return {name: value for name, value in environment.items()
+            if (name.startswith("NEOPO_") or name in SETTINGS_VARIABLES) and name not in IGNORED_VARIABLES}
+
+# Send a request to the daemon and print its output, returning the exit code,
+# or None if the daemon is not running or the request must run locally
+def send_request(request):
+    connection = connect()
+    if not connection:
+        return None
+    with connection:
+        connection.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        try:
+            for kind, payload in read_frames(connection):
+                if kind == OUTPUT_FRAME:
+                    sys.stdout.buffer.write(payload)
+                    sys.stdout.flush()
+                elif kind == EXIT_FRAME:
+                    return int(payload)
+                elif kind == LOCAL_FRAME:
+                    return None
+        except KeyboardInterrupt:
+            # Closing the connection stops the request in the daemon
+            print()
+            return 130
+    print("Lost connection to the neopo daemon!")
+    return 1
+
+# Run a command in the daemon as if it ran here, or return None if the daemon is not running
+def forward_command(args):
+    return send_request({"args": args, "cwd": os.getcwd(), "env": dict(os.environ)})
+
+# Modification time and size of everything a prepared build depends on
+def context_stamps(project_path, prepared):
+    paths = [os.path.join(project_path, projectFiles["settings"]),
+             os.path.join(project_path, projectFiles["properties"]),
+             os.path.join(project_path, "lib"),
+             jsonFiles["manifest"],
+             *[jsonFiles[key] for key in SNAPSHOT_SOURCES]]
+    if prepared.get("configuration"):
+        paths.append(prepared["configuration"]["deviceOS-path"])
+    stamps = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            stamps.append([path, stat.st_mtime_ns, stat.st_size])
+        except OSError:
+            stamps.append([path, None, None])
+    return stamps
+
+# Prepared builds in a request process: those the daemon knows are reused while nothing
+# they depend on changed, and new ones are sent back to the daemon for later requests
+class RequestContexts:
+    def __init__(self, contexts, pipe):
+        self.contexts = contexts
+        self.pipe = pipe
+
+    def get(self, key):
+        context = self.contexts.get(key)
+        if context and context["stamps"] == context_stamps(context["project"], context["build"]):
+            return context["build"]
+        return None
+
+    def put(self, key, prepared):
+        context = {"project": prepared["project"], "build": prepared,
+                   "stamps": context_stamps(prepared["project"], prepared)}
+        os.write(self.pipe, json.dumps({"key": key, "context": context}).encode("utf-8") + b"\n")
+
+# A single threaded server that runs each request in a process forked from itself,
+# so requests start with the catalog, modules and prepared builds already loaded.
+# Make jobs are shared between the builds that run at the same time.
+class BuildDaemon:
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+        self.queue = []
+        self.sequence = 0
+        self.running = {}
+        self.budget = make_jobs()
+        self.free = self.budget
+        self.contexts = {}
+        self.catalog_stamps = None
+        self.started = time.time()
+        self.served = 0
+        self.stopping = False
+        self.settings = settings_variables(os.environ)
+
+    # Load everything a request might need once
+    def warm(self):
+        for module in PRELOADED_MODULES:
+            importlib.import_module(module, __package__)
+        self.refresh_catalog()
+
+    # Reload the catalog if install or update rewrote the JSON caches
+    def refresh_catalog(self):
+        try:
+            stamps = source_stamps()
+        except FileNotFoundError:
+            return
+        if stamps != self.catalog_stamps:
+            if self.catalog_stamps:
+                reset_catalog()
+            else:
+                get_catalog()
+            self.catalog_stamps = stamps
+
+    def serve(self):
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(DAEMON_SOCKET)
+        os.chmod(DAEMON_SOCKET, 0o600)
+        listener.listen(64)
+        self.selector.register(listener, selectors.EVENT_READ, (self.accept, None))
+        print("neopo daemon %d listening on %s with %d jobs" % (os.getpid(), DAEMON_SOCKET, self.budget), flush=True)
+        try:
+            while not (self.stopping and not self.running and not self.queue):
+                for key, _ in self.selector.select(timeout=1):
+                    handler, request = key.data
+                    handler(key.fileobj, request)
+        finally:
+            self.selector.unregister(listener)
+            listener.close()
+            if os.path.exists(DAEMON_SOCKET):
+                os.unlink(DAEMON_SOCKET)
+
+    def accept(self, listener, _):
+        connection, _ = listener.accept()
+        request = {"connection": connection, "buffer": b""}
+        self.selector.register(connection, selectors.EVENT_READ, (self.receive, request))
+
+    # Read a request line from a client, or notice that the client went away
+    def receive(self, connection, request):
+        try:
+            data = connection.recv(65536)
+        except OSError:
+            data = b""
+        if not data:
+            self.disconnect(request)
+            return
+        if "args" in request:
+            return
+        request["buffer"] += data
+        if b"\n" not in request["buffer"]:
+            return
+        try:
+            request.update(json.loads(request.pop("buffer").decode("utf-8")))
+        except ValueError:
+            self.reply(request, "Invalid request!\n", 1)
+            return
+
+        control = request.get("control")
+        if control == "status":
+            self.reply(request, self.status(), 0)
+        elif control == "stop":
+            self.stopping = True
+            self.reply(request, "Stopping the neopo daemon.\n", 0)
+        elif self.stopping:
+            self.reply(request, "The neopo daemon is stopping.\n", 1)
+        elif len(request.get("args") or []) < 2 or request["args"][1] not in PRIORITIES:
+            self.reply(request, "The neopo daemon does not run this command.\n", 1)
+        elif settings_variables(request.get("env") or {}) != self.settings:
+            self.run_locally(request)
+        else:
+            self.sequence += 1
+            heapq.heappush(self.queue, (PRIORITIES[request["args"][1]], self.sequence, request))
+            self.schedule()
+
+    # Send a complete reply and close the connection
+    def reply(self, request, output, code):
+        connection = request["connection"]
+        try:
+            self.selector.unregister(connection)
+        except KeyError:
+            pass
+        try:
+            if output:
+                send_frame(connection, OUTPUT_FRAME, output.encode("utf-8"))
+            send_frame(connection, EXIT_FRAME, str(code).encode("utf-8"))
+        except OSError:
+            pass
+        connection.close()
+
+    # Tell a client to run its request itself and close the connection
+    def run_locally(self, request):
+        connection = request["connection"]
+        self.selector.unregister(connection)
+        try:
+            send_frame(connection, LOCAL_FRAME, b"")
+        except OSError:
+            pass
+        connection.close()
+
+    # Stop the request of a client that disconnected
+    def disconnect(self, request):
+        request["cancelled"] = True
+        try:
+            self.selector.unregister(request["connection"])
+        except KeyError:
+            pass
+        if request.get("pid"):
+            try:
+                os.killpg(request["pid"], signal.SIGTERM)
+            except OSError:
+                pass
+        else:
+            request["connection"].close()
+
+    # Start queued requests while make jobs are free
+    def schedule(self):
+        while self.queue:
+            _, _, request = self.queue[0]
+            if request.get("cancelled"):
+                heapq.heappop(self.queue)
+                continue
+            quick = request["args"][1] in QUICK_COMMANDS
+            if not quick and self.free < 1:
+                return
+            heapq.heappop(self.queue)
+            request["jobs"] = 0
+            if not quick:
+                waiting = sum(1 for _, _, other in self.queue if other["args"][1] not in QUICK_COMMANDS)
+                request["jobs"] = max(1, self.free // (waiting + 1))
+                self.free -= request["jobs"]
+            self.start(request)
+
+    # Run a request in a forked process with its output sent back through a pipe
+    def start(self, request):
+        self.refresh_catalog()
+        args = list(request["args"])
+        try:
+            requested, _ = split_jobs_option(args[2:])
+        except UserError:
+            requested = None
+        if request["jobs"] and not requested:
+            args.extend(["-j", str(request["jobs"])])
+
+        output_read, output_write = os.pipe()
+        contexts_read, contexts_write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(output_read)
+            os.close(contexts_read)
+            self.run_request(request, args, output_write, contexts_write)
+
+        os.close(output_write)
+        os.close(contexts_write)
+        request.update({"pid": pid, "output": output_read, "contexts": contexts_read,
+                        "context_data": b"", "open": 2})
+        self.running[pid] = request
+        self.selector.register(output_read, selectors.EVENT_READ, (self.relay_output, request))
+        self.selector.register(contexts_read, selectors.EVENT_READ, (self.collect_contexts, request))
+
+    # In the forked process: run the command like neopo would and exit
+    def run_request(self, request, args, output, contexts):
+        code = 1
+        try:
+            os.setpgid(0, 0)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            for key in list(self.selector.get_map().values()):
+                if key.fileobj is not request["connection"]:
+                    os.close(key.fd)
+            request["connection"].close()
+            devnull = os.open(os.devnull, os.O_RDONLY)
+            os.dup2(devnull, 0)
+            os.dup2(output, 1)
+            os.dup2(output, 2)
+            os.close(output)
+            for stream in (sys.stdout, sys.stderr):
+                try:
+                    stream.reconfigure(line_buffering=True)
+                except AttributeError:
+                    pass
+
+            os.chdir(request.get("cwd") or "/")
+            os.environ.clear()
+            os.environ.update(request.get("env") or {})
+            os.environ["NEOPO_DAEMON"] = "0"
+            from .build import reuse_prepared_builds
+            from .command import main
+            reuse_prepared_builds(RequestContexts(self.contexts, contexts))
+            try:
+                main(args)
+                code = 0
+            except SystemExit as error:
+                code = error.code if isinstance(error.code, int) else (0 if error.code is None else 1)
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            try:
+                sys.stdout.flush()
+                sys.stderr.flush()
+            finally:
+                os._exit(code)
+
+    # Send output of a request to its client as it arrives
+    def relay_output(self, output, request):
+        data = os.read(output, 65536)
+        if data and not request.get("cancelled"):
+            try:
+                send_frame(request["connection"], OUTPUT_FRAME, data)
+            except OSError:
+                self.disconnect(request)
+        elif not data:
+            self.close_pipe(output, request)
+
+    # Remember prepared builds sent back by a request
+    def collect_contexts(self, contexts, request):
+        data = os.read(contexts, 65536)
+        if data:
+            request["context_data"] += data
+            return
+        for line in request["context_data"].splitlines():
+            try:
+                update = json.loads(line.decode("utf-8"))
+                self.contexts[update["key"]] = update["context"]
+            except (ValueError, KeyError):
+                pass
+        self.close_pipe(contexts, request)
+
+    def close_pipe(self, pipe, request):
+        self.selector.unregister(pipe)
+        os.close(pipe)
+        request["open"] -= 1
+        if request["open"] == 0:
+            self.finish(request)
+
+    # Send the exit code of a finished request and start the next ones
+    def finish(self, request):
+        _, status = os.waitpid(request["pid"], 0)
+        code = 128 + os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+        del self.running[request["pid"]]
+        self.free += request["jobs"]
+        self.served += 1
+        if request.get("cancelled"):
+            request["connection"].close()
+        else:
+            self.reply(request, None, code)
+        self.schedule()
+
+    def status(self):
+        return "\n".join([
+            "pid: %d" % os.getpid(),
+            "socket: %s" % DAEMON_SOCKET,
+            "uptime: %ds" % (time.time() - self.started),
+            "requests served: %d" % self.served,
+            "running: %s" % (", ".join(" ".join(request["args"][1:]) for request in self.running.values()) or "none"),
+            "queued: %d" % len([entry for entry in self.queue if not entry[2].get("cancelled")]),
+            "make jobs: %d of %d free" % (self.free, self.budget),
+            "prepared builds: %d" % len(self.contexts), ""])
+
+# Run the daemon in this process
+def serve_daemon():
+    if running_on_windows:
+        raise UserError("The neopo daemon is not available on Windows!")
+    connection = connect()
+    if connection:
+        connection.close()
+        raise UserError("The neopo daemon is already running!")
+    if os.path.exists(DAEMON_SOCKET):
+        os.unlink(DAEMON_SOCKET)
+    os.makedirs(os.path.dirname(DAEMON_SOCKET), exist_ok=True)
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    daemon = BuildDaemon()
+    daemon.warm()
+    daemon.serve()
+
+# Start the daemon in the background and wait until it accepts requests
+def start_daemon():
+    if running_on_windows:
+        raise UserError("The neopo daemon is not available on Windows!")
+    connection = connect()
+    if connection:
+        connection.close()
+        print("The neopo daemon is already running.")
+        return
+
+    import subprocess
+    environment = os.environ.copy()
+    package_parent = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    environment["PYTHONPATH"] = os.pathsep.join(filter(None, [package_parent, environment.get("PYTHONPATH")]))
+    os.makedirs(os.path.dirname(DAEMON_LOG), exist_ok=True)
+    with open(DAEMON_LOG, "ab") as log:
+        daemon = subprocess.Popen([sys.executable, "-m", "neopo", "daemon", "serve"], env=environment,
+                                  stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT,
+                                  start_new_session=True)
+
+    deadline = time.monotonic() + START_TIMEOUT
+    while time.monotonic() < deadline and daemon.poll() is None:
+        connection = connect()
+        if connection:
+            connection.close()
+            print("Started the neopo daemon (pid %d)." % daemon.pid)
+            return
+        time.sleep(0.05)
+    raise UserError("The neopo daemon failed to start! See %s" % DAEMON_LOG)
+
+# Stop the daemon after running requests finish
+def stop_daemon():
+    if send_request({"control": "stop"}) is None:
+        print("The neopo daemon is not running.")
+
+# Print what the daemon is doing
+def daemon_status():
+    if send_request({"control": "status"}) is None:
+        print("The neopo daemon is not running.")
+
+# Wrapper for [daemon]
+def daemon_command(args):
+    daemon_commands = {"start": start_daemon, "stop": stop_daemon,
+                       "status": daemon_status, "serve": serve_daemon}
+    try:
+        daemon_commands[args[2]]()
+    except IndexError:
+        daemon_status()
+    except KeyError as error:
+        raise UserError("Invalid daemon command! Commands are: %s" % ", ".join(daemon_commands)) from error
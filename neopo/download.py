@@ -0,0 +1,193 @@
+import os
+import time
+import shutil
+import hashlib
+import tarfile
+import pathlib
+import contextlib
+import http.client
+import urllib.error
+
+# Not available on Windows, where dependencies are installed without locking
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Local imports
+from .extract import extract_tarball
+from .network import request
+
+# Bytes read from the network at a time
+CHUNK_SIZE = 64 * 1024
+
+# Reconnection attempts after a transient failure, and the initial delay between them
+RETRIES = 5
+BACKOFF = 1
+
+# File-like wrapper that hashes a stream as it is consumed
+class HashingReader:
+    def __init__(self, stream):
+        self.stream = stream
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def read(self, size=CHUNK_SIZE):
+        if size is None or size < 0:
+            size = CHUNK_SIZE
+        data = self.stream.read(size)
+        self.sha256.update(data)
+        self.size += len(data)
+        return data
+
+    # Consume the rest of the stream (tar padding) so the digest covers the whole file
+    def drain(self):
+        while self.read(CHUNK_SIZE):
+            pass
+
+    def hexdigest(self):
+        return self.sha256.hexdigest()
+
+# Decide whether a failed request is worth retrying
+def transient(error):
+    if isinstance(error, urllib.error.HTTPError):
+        return error.code >= 500 or error.code in (408, 429)
+    return True
+
+# File-like download that is persisted to a partial file as it is read. Bytes
+# already in the partial file are replayed first, then the rest is requested
+# with a Range header, reconnecting with exponential backoff when it drops.
+class ResumableStream:
+    def __init__(self, url, partial, retries=None, backoff=None):
+        self.url = url
+        self.retries = RETRIES if retries is None else retries
+        self.backoff = BACKOFF if backoff is None else backoff
+        self.offset = 0
+        self.size = None
+        self.response = None
+        self.replaying = True
+        pathlib.Path(os.path.dirname(partial)).mkdir(parents=True, exist_ok=True)
+        self.partial = open(partial, "a+b")
+        self.partial.seek(0)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.disconnect()
+        self.partial.close()
+
+    def disconnect(self):
+        if self.response:
+            self.response.close()
+            self.response = None
+
+    # Request the remainder of the file, starting at the current offset
+    def connect(self):
+        headers = {"Range": "bytes=%d-" % self.offset} if self.offset else {}
+        try:
+            self.response = request(self.url, headers=headers)
+        except urllib.error.HTTPError as error:
+            # The partial file already holds the whole archive
+            if error.code == 416 and self.offset:
+                return False
+            raise
+        if self.response.length is not None:
+            self.size = self.response.length + (self.offset if self.response.status == 206 else 0)
+        # The server ignored the Range header, so skip what is already on disk
+        if self.offset and self.response.status != 206:
+            remaining = self.offset
+            while remaining:
+                skipped = self.response.read(min(remaining, CHUNK_SIZE))
+                if not skipped:
+                    raise http.client.IncompleteRead(b"")
+                remaining -= len(skipped)
+        return True
+
+    def read(self, size=CHUNK_SIZE):
+        if size is None or size < 0:
+            size = CHUNK_SIZE
+        if self.replaying:
+            data = self.partial.read(size)
+            if data:
+                self.offset += len(data)
+                return data
+            self.replaying = False
+
+        attempt = 0
+        while True:
+            try:
+                if not self.response and not self.connect():
+                    return b""
+                data = self.response.read(size)
+                # http.client reports a dropped connection as an early end of data
+                if not data and self.response.length:
+                    raise http.client.IncompleteRead(b"", self.response.length)
+                break
+            except (OSError, http.client.HTTPException) as error:
+                self.disconnect()
+                if attempt >= self.retries or not transient(error):
+                    raise
+            time.sleep(self.backoff * 2 ** attempt)
+            attempt += 1
+
+        self.partial.write(data)
+        self.offset += len(data)
+        return data
+
+# Size of a file or download being streamed, or None if it is not known yet
+def stream_size(stream):
+    try:
+        return os.fstat(stream.fileno()).st_size
+    except (AttributeError, OSError):
+        return getattr(stream, "size", None)
+
+# Extract a gzipped tarball from a stream while hashing it, returning the sha256. Opening
+# the tarball reads from the stream, so the size of a download is known when extracting.
+def stream_extract(stream, path):
+    reader = HashingReader(stream)
+    with tarfile.open(fileobj=reader, mode="r|gz") as tarball:
+        extract_tarball(tarball, path, stream_size(stream))
+        # A damaged header ends a streamed tarball early without an error, so what is
+        # left of it must be the zero padding after the last member
+        for data in iter(lambda: tarball.fileobj.read(CHUNK_SIZE), b""):
+            if data.count(0) != len(data):
+                raise tarfile.ReadError("Unexpected data after the end of the archive")
+    reader.drain()
+    return reader.hexdigest()
+
+# Hold an exclusive lock on an install path while a dependency is fetched and moved
+# into place, so processes installing the same dependency never share its staging
+# directory or partial download
+@contextlib.contextmanager
+def install_lock(path):
+    if not fcntl:
+        yield
+        return
+    pathlib.Path(os.path.dirname(path)).mkdir(parents=True, exist_ok=True)
+    with open(os.path.join(os.path.dirname(path), ".%s.lock" % os.path.basename(path)), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+# Create an empty staging directory next to the final install path
+def create_staging(path):
+    staging = os.path.join(os.path.dirname(path), ".%s.partial" % os.path.basename(path))
+    shutil.rmtree(staging, ignore_errors=True)
+    pathlib.Path(staging).mkdir(parents=True)
+    return staging
+
+# Replace the install path with a completed staging directory
+def commit_staging(staging, path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    os.replace(staging, path)
+
+# Delete a staging directory after a failed download
+def discard_staging(staging):
+    shutil.rmtree(staging, ignore_errors=True)
@@ -0,0 +1,154 @@
+import os
+import shutil
+import tarfile
+import threading
+import concurrent.futures
+
+# Threads writing extracted files to disk
+EXTRACT_WORKERS = min(8, os.cpu_count() or 1)
+
+# The pool is only faster than extracting on one thread with enough cores to decompress
+# and write at the same time, and for archives large enough to pay for starting it
+POOL_MIN_CPUS = 4
+POOL_MIN_SIZE = 32 * 1024 * 1024
+
+# Files larger than this are written by the decompressing thread as they stream
+LARGE_FILE = 1024 * 1024
+
+# Small files are handed to the writers in batches of about this many bytes
+BATCH_SIZE = 1024 * 1024
+
+# Batches waiting for a writer, bounding memory to QUEUED_BATCHES * (BATCH_SIZE + LARGE_FILE)
+QUEUED_BATCHES = EXTRACT_WORKERS * 2
+
+# Resolve the path of an archive entry, refusing anything outside of the destination,
+# including through symbolic links extracted before it. Resolved directories can be
+# cached in a dictionary, which must be cleared whenever a symbolic link is extracted.
+def member_path(path, name, resolved=None):
+    resolved = {} if resolved is None else resolved
+    target = os.path.normpath(os.path.join(path, name))
+    for directory in (path, os.path.dirname(target)):
+        if directory not in resolved:
+            resolved[directory] = os.path.realpath(directory)
+    real = resolved[path]
+    if os.path.commonpath([path, target]) != path or \
+            os.path.commonpath([real, resolved[os.path.dirname(target)]]) != real:
+        raise tarfile.ExtractError("Refusing to extract %s outside of %s" % (name, path))
+    return target
+
+# Create a directory (and its parents) unless it was already created
+def make_dirs(directory, directories):
+    if directory not in directories:
+        os.makedirs(directory, exist_ok=True)
+        directories.add(directory)
+
+# Write a batch of small files that were read into memory, releasing its queue slot
+def write_batch(batch, slots):
+    try:
+        for target, data in batch:
+            with open(target, "wb") as file:
+                file.write(data)
+    finally:
+        slots.release()
+
+# Apply the deferred mode and mtime of an extracted member
+def apply_attributes(entry):
+    target, member = entry
+    os.chmod(target, member.mode)
+    os.utime(target, (member.mtime, member.mtime))
+
+# Members of an archive, refusing any whose path or link target is outside of the destination
+def checked_members(tarball, path):
+    resolved = {}
+    for member in tarball:
+        target = member_path(path, member.name, resolved)
+        if member.issym():
+            member_path(path, os.path.join(os.path.dirname(target), member.linkname), resolved)
+            resolved.clear()
+        elif member.islnk():
+            member_path(path, member.linkname, resolved)
+        # Devices and FIFOs are never part of toolchain archives
+        if member.isdir() or member.isreg() or member.issym() or member.islnk():
+            yield member
+
+# Check whether writing files from a pool pays off for an archive of a size (None if unknown)
+def parallel_extraction(size, workers=EXTRACT_WORKERS):
+    return workers > 1 and (os.cpu_count() or 1) >= POOL_MIN_CPUS and (size is None or size >= POOL_MIN_SIZE)
+
+# Extract an open streaming tarball of a size (None if unknown) into a directory, with a pool
+# of writers where that is faster and with tarfile otherwise
+def extract_tarball(tarball, path, size=None, workers=EXTRACT_WORKERS):
+    path = os.path.abspath(path)
+    if parallel_extraction(size, workers):
+        extract_parallel(tarball, path, workers)
+        return
+    # Paths are checked here, so tarfile needs no extraction filter of its own
+    trusted = {"filter": "fully_trusted"} if hasattr(tarfile, "fully_trusted_filter") else {}
+    tarball.extractall(path, members=checked_members(tarball, path), **trusted)
+
+# Extract an open streaming tarball, decompressing on this thread and writing files from a pool.
+# Directories are created once each, while permissions, mtimes and links are applied at the end.
+def extract_parallel(tarball, path, workers):
+    directories = {path}
+    files, folders, links, copies = [], [], [], []
+    slots = threading.BoundedSemaphore(QUEUED_BATCHES)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        writes, batch, batch_size, resolved = [], [], 0, {}
+        for member in tarball:
+            target = member_path(path, member.name, resolved)
+            if member.isdir():
+                make_dirs(target, directories)
+                folders.append((target, member))
+            elif member.isreg():
+                make_dirs(os.path.dirname(target), directories)
+                source = tarball.extractfile(member)
+                if member.size > LARGE_FILE:
+                    with open(target, "wb") as file:
+                        shutil.copyfileobj(source, file)
+                else:
+                    batch.append((target, source.read()))
+                    batch_size += member.size
+                    if batch_size >= BATCH_SIZE:
+                        slots.acquire()
+                        writes.append(pool.submit(write_batch, batch, slots))
+                        batch, batch_size = [], 0
+                files.append((target, member))
+            elif member.issym():
+                # Links may only point inside the destination
+                source = member_path(path, os.path.join(os.path.dirname(target), member.linkname), resolved)
+                resolved.clear()
+                make_dirs(os.path.dirname(target), directories)
+                if os.path.lexists(target):
+                    os.remove(target)
+                try:
+                    os.symlink(member.linkname, target)
+                except OSError:
+                    # No symlink support, so copy the link target once it exists
+                    copies.append((source, target))
+            elif member.islnk():
+                make_dirs(os.path.dirname(target), directories)
+                links.append((member_path(path, member.linkname, resolved), target))
+            # Devices and FIFOs are never part of toolchain archives
+
+        slots.acquire()
+        writes.append(pool.submit(write_batch, batch, slots))
+        for write in concurrent.futures.as_completed(writes):
+            write.result()
+
+        # Links can only be made once their targets have been written
+        for source, target in links:
+            if os.path.lexists(target):
+                os.remove(target)
+            try:
+                os.link(source, target)
+            except OSError:
+                shutil.copy2(source, target)
+        for source, target in copies:
+            if os.path.isfile(source):
+                shutil.copy2(source, target)
+
+        # Files first, then directories deepest first so read-only modes can not block writes
+        list(pool.map(apply_attributes, files))
+        for entry in sorted(folders, key=lambda entry: entry[0], reverse=True):
+            apply_attributes(entry)
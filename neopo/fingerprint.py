@@ -0,0 +1,46 @@
+import os
+import json
+import hashlib
+
+# Record of the last successful build, kept in the output directory of each configuration
+BUILD_RECORD = ".neopo-build.json"
+
+# Top level project directories that hold outputs rather than sources
+OUTPUT_DIRS = ["target", "bin"]
+
+# Bytes hashed at a time
+CHUNK_SIZE = 64 * 1024
+
+# Hash every source file of a project (paths and contents) along with the build
+# configuration. Hidden directories are skipped since the settings that matter
+# from .vscode/settings.json are part of the configuration.
+def build_fingerprint(project_path, configuration):
+    digest = hashlib.sha256(json.dumps(configuration, sort_keys=True).encode("utf-8"))
+    for root, dirs, files in os.walk(project_path):
+        dirs[:] = sorted(name for name in dirs if not name.startswith(".")
+                         and not (root == project_path and name in OUTPUT_DIRS))
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            digest.update(os.path.relpath(path, project_path).encode("utf-8") + b"\0")
+            with open(path, "rb") as file:
+                for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+                    digest.update(chunk)
+            digest.update(b"\0")
+    return digest.hexdigest()
+
+# Artifact of the last successful build in an output directory with this fingerprint, or None
+def up_to_date(output_path, fingerprint):
+    try:
+        with open(os.path.join(output_path, BUILD_RECORD), "r") as file:
+            record = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if record.get("fingerprint") != fingerprint or not os.path.isfile(record.get("artifact", "")):
+        return None
+    return record["artifact"]
+
+# Remember a successful build in its output directory
+def record_build(output_path, fingerprint, artifact):
+    os.makedirs(output_path, exist_ok=True)
+    with open(os.path.join(output_path, BUILD_RECORD), "w") as file:
+        json.dump({"fingerprint": fingerprint, "artifact": artifact}, file, indent=4)
@@ -40,21 +40,91 @@ help_commands = {
     ],
     # Build commands
     "compile": [
-        "Compile the current or specified project locally",
-        "[project] [verbosity]",
+        "Compile the current or specified project locally.\nSkipped if nothing changed since the last build",
+        "[project] [verbosity] [--force] [-j <jobs>] [--platform <platform>] [--version <version>]",
         None,
         [
             ("-v", "Verbose compiler output"),
             ("-q", "Quiet compiler output"),
+            ("--force", "Compile even if the project is up to date"),
+            ("-j", "Number of parallel make jobs"),
+            ("--platform", "Build for a platform other than the configured one"),
+            ("--version", "Build for a deviceOS version other than the configured one"),
         ],
     ],
     "build": [
-        "Compile the current or specified project locally",
-        "[project] [verbosity]",
+        "Compile the current or specified project locally.\nSkipped if nothing changed since the last build",
+        "[project] [verbosity] [--force] [-j <jobs>] [--platform <platform>] [--version <version>]",
         None,
         [
             ("-v", "Verbose compiler output"),
             ("-q", "Quiet compiler output"),
+            ("--force", "Compile even if the project is up to date"),
+            ("-j", "Number of parallel make jobs"),
+            ("--platform", "Build for a platform other than the configured one"),
+            ("--version", "Build for a deviceOS version other than the configured one"),
+        ],
+    ],
+    "build-all": [
+        """Build every project in the given directories, or in the current directory,
+concurrently. Directories may be projects or contain projects. The make jobs are
+shared between builds, and a summary is printed when all builds finish.\n""",
+        "[directory...] [verbosity] [--force] [-j <jobs>]",
+        None,
+        [
+            ("-v", "Verbose compiler output"),
+            ("-q", "Only print output of failed builds"),
+            ("--force", "Compile even if projects are up to date"),
+            ("-j", "Number of make jobs shared by all builds"),
+        ],
+    ],
+    "matrix": [
+        """Build a project for several platforms and deviceOS versions at once. Missing
+deviceOS versions and toolchains are installed first, each combination is built
+concurrently into its own directory, and the project settings are not changed.\n""",
+        "[project] --platforms <list> --versions <list> [verbosity] [--force] [-j <jobs>]",
+        None,
+        [
+            ("--platforms", "Comma separated platforms (default: configured)"),
+            ("--versions", "Comma separated deviceOS versions (default: configured)"),
+            ("-v", "Verbose compiler output"),
+            ("-q", "Only print output of failed builds"),
+            ("--force", "Compile even if builds are up to date"),
+            ("-j", "Number of make jobs shared by all builds"),
+        ],
+    ],
+    "watch": [
+        """Watch the sources, libraries and project.properties of a project and build it
+again whenever they change. A build that is outdated by newer changes is cancelled.\n""",
+        "[project] [target] [verbosity] [--flash] [-j <jobs>]",
+        None,
+        [
+            ("-v", "Verbose compiler output"),
+            ("-q", "Quiet compiler output"),
+            ("--flash", "Flash the application after it compiles"),
+            ("-j", "Number of parallel make jobs"),
+        ],
+    ],
+    "check": [
+        """Check the syntax of every source of a project and its libraries in parallel, with
+the include paths, defines and EXTRA_CFLAGS the Makefile would compile them with.
+The flags are resolved once per configuration, so later checks do not run make.\n""",
+        "[project] [-j <jobs>]",
+        None,
+        [
+            ("-j", "Number of sources checked at once"),
+        ],
+    ],
+    "test": [
+        """Compile the sources of a project and its libraries with the tests in its test/
+directory for this computer, against a stub of the Particle API, and run them. One
+of the tests must define main(). Objects are kept between runs.\n""",
+        "[project] [--sources <list>] [-j <jobs>] [-- <arguments>]",
+        None,
+        [
+            ("--sources", "Sources or directories to test instead of all"),
+            ("-j", "Number of sources compiled at once"),
+            ("--", "Pass the remaining arguments to the tests"),
         ],
     ],
     "flash": [
@@ -118,8 +188,37 @@ making it possible to use the Particle toolchains without requiring neopo.\n""",
         "Set the EXTRA_CFLAGS variable in a project which neopo passes to the compiler",
         "<quoted string> [project]",
     ],
+    "jobs": [
+        """Set the number of parallel make jobs used to build a project. By default one job
+runs per core, limited by free memory. Use auto to restore the default.\n""",
+        "<number/auto> [project]",
+    ],
+    "pch": [
+        """Precompile Particle.h once per build configuration and include it in every source
+of a project and its libraries that includes Particle.h or application.h first.\n""",
+        "<on/off> [project]",
+    ],
+    "unity": [
+        """Compile the sources in each directory of a project and its libraries in batches
+(unity build) to parse the Device OS headers fewer times. Sources of batches that
+fail to compile are compiled on their own. Builds report their number of objects
+and link time.\n""",
+        "<on/off/batch size> [project]",
+    ],
+    "scratch": [
+        """Build a project in a scratch directory, such as a tmpfs, and copy only the .bin,
+.elf and .map files back to the project. Use auto for a directory in memory where
+possible. The build tree is kept between builds.\n""",
+        "<directory/auto/off> [project]",
+    ],
+    "shared-libs": [
+        """Compile the Particle libraries of a project once per version and configuration
+into a store shared by every project, and use the stored objects in later builds.
+Libraries with local changes are compiled from source.\n""",
+        "<on/off> [project]",
+    ],
     "settings": [
-        "View configured settings in a project.\nIncludes platform, version, and EXTRA_CFLAGS",
+        "View configured settings in a project.\nIncludes platform, version, EXTRA_CFLAGS, jobs,\nprecompiled header, unity build, scratch directory\nand shared libraries",
         "[project]",
     ],
     "libs": [
@@ -138,6 +237,16 @@ After building the bootloader it is flashed over serial using particle-cli.\n"""
             ("-q", "Quiet compiler output"),
         ],
     ],
+    "warm": [
+        """Build the Device OS libraries for a platform and version ahead of time. Projects
+with the same platform, version, compiler and flags link against the same copy.\n""",
+        "<platform> <version> [verbosity]",
+        None,
+        [
+            ("-v", "Verbose compiler output"),
+            ("-q", "Quiet compiler output"),
+        ],
+    ],
     "iterate": [
         """Iterate over all Particle devices connected via USB, placing each device into
 DFU mode and running a command on the device.\n""",
@@ -164,6 +273,46 @@ for gen 2 devices. Only available on Linux and macOS at this time.\n""",
             ("dfu close", "exit DFU mode on older devices"),
         ],
     ],
+    "cache": [
+        """Show statistics for or clear the compiler cache shared by all builds.
+Set NEOPO_CCACHE_LIMIT=0 to disable the cache.\n""",
+        "<command>",
+        [
+            ("stats", "Print hits, misses and size of the cache"),
+            ("clear", "Delete all cached objects"),
+        ],
+    ],
+    "library-store": [
+        """List or clear the compiled Particle libraries shared by projects that use
+shared-libs.\n""",
+        "<command>",
+        [
+            ("list", "Print the stored libraries and their size"),
+            ("clear", "Delete all stored libraries"),
+        ],
+    ],
+    "outputs": [
+        """List or prune the build outputs of a project. Each platform, deviceOS version,
+compiler and EXTRA_CFLAGS combination keeps its own outputs, so switching back to a
+configuration only rebuilds what changed.\n""",
+        "<command> [project]",
+        [
+            ("list", "Print the output directories and their configurations"),
+            ("prune", "Delete outputs of configurations that are not in use"),
+        ],
+    ],
+    "daemon": [
+        """Start, stop or check the optional build daemon. While it runs, compile, build,
+flash, flash-all, clean, run and versions are sent to it and run with the catalog,
+modules and project settings already loaded. Set NEOPO_DAEMON=0 to bypass it.\n""",
+        "<command>",
+        [
+            ("start", "Start the daemon in the background"),
+            ("stop", "Stop the daemon after running requests finish"),
+            ("status", "Print running and queued requests"),
+            ("serve", "Run the daemon in the foreground"),
+        ],
+    ],
     # Script commands
     "script": [
         "Load and execute a neopo script from a file or standard input",
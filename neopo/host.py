@@ -0,0 +1,398 @@
+import os
+import re
+import glob
+import json
+import time
+import shlex
+import hashlib
+import subprocess
+import concurrent.futures
+
+# Local imports
+from .common import ProcessError, UserError, projectFiles
+from .project import get_flags, get_setting
+from .jobs import make_jobs, split_jobs_option
+from .outputs import HOST_DIR
+
+# Directory of a project holding its tests, which include main()
+TEST_DIR = "test"
+
+# Sources compiled by the host compiler
+HOST_EXTENSIONS = (".c", ".cpp")
+
+# Options of EXTRA_CFLAGS that are used for host builds too
+HOST_FLAG_PREFIXES = ("-D", "-U", "-I")
+
+# Lightweight stand-in for the Particle API, enough for application logic to compile
+# and run on the host. Tests control the simulated clock and pins through neopo_stub.
+PARTICLE_STUB = """// Host stub of the Particle API, generated by neopo test
+#pragma once
+
+#include <stdint.h>
+#include <stddef.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <stdarg.h>
+#include <math.h>
+#include <algorithm>
+#include <string>
+
+using std::min;
+using std::max;
+
+typedef uint8_t byte;
+typedef bool boolean;
+typedef uint16_t pin_t;
+
+enum PinMode { INPUT, OUTPUT, INPUT_PULLUP, INPUT_PULLDOWN };
+enum SystemMode { AUTOMATIC, SEMI_AUTOMATIC, MANUAL };
+enum SystemThread { ENABLED, DISABLED };
+enum LogLevel { LOG_LEVEL_ALL = 1, LOG_LEVEL_TRACE = 1, LOG_LEVEL_INFO = 30, LOG_LEVEL_WARN = 40,
+                LOG_LEVEL_ERROR = 50, LOG_LEVEL_NONE = 70 };
+
+#define HIGH 1
+#define LOW 0
+#define DEC 10
+#define HEX 16
+#define OCT 8
+#define BIN 2
+#define D0 0
+#define D1 1
+#define D2 2
+#define D3 3
+#define D4 4
+#define D5 5
+#define D6 6
+#define D7 7
+#define A0 10
+#define A1 11
+#define A2 12
+#define A3 13
+#define A4 14
+#define A5 15
+#define SYSTEM_MODE(mode)
+#define SYSTEM_THREAD(state)
+#define STARTUP(code)
+#define PRODUCT_ID(id)
+#define PRODUCT_VERSION(version)
+
+// State of the simulated device, which tests may read and change
+namespace neopo_stub {
+    inline uint64_t clock_us = 0;
+    inline int pin_modes[32] = {};
+    inline int pin_values[32] = {};
+    inline void advance(uint32_t ms) { clock_us += (uint64_t)ms * 1000; }
+    inline void set_pin(pin_t pin, int value) { pin_values[pin % 32] = value; }
+    inline int get_pin(pin_t pin) { return pin_values[pin % 32]; }
+}
+
+inline unsigned long micros() { return (unsigned long)neopo_stub::clock_us; }
+inline unsigned long millis() { return (unsigned long)(neopo_stub::clock_us / 1000); }
+inline void delay(unsigned long ms) { neopo_stub::advance(ms); }
+inline void delayMicroseconds(unsigned int us) { neopo_stub::clock_us += us; }
+
+inline void pinMode(pin_t pin, PinMode mode) { neopo_stub::pin_modes[pin % 32] = mode; }
+inline void digitalWrite(pin_t pin, int value) { neopo_stub::set_pin(pin, value ? HIGH : LOW); }
+inline int32_t digitalRead(pin_t pin) { return neopo_stub::get_pin(pin) ? HIGH : LOW; }
+inline int32_t analogRead(pin_t pin) { return neopo_stub::get_pin(pin); }
+inline void analogWrite(pin_t pin, uint32_t value) { neopo_stub::set_pin(pin, (int)value); }
+
+template <typename T> T constrain(T value, T low, T high) { return value < low ? low : value > high ? high : value; }
+inline long map(long value, long from_low, long from_high, long to_low, long to_high) {
+    return (value - from_low) * (to_high - to_low) / (from_high - from_low) + to_low;
+}
+
+class String {
+public:
+    String() {}
+    String(const char *value) : text(value ? value : "") {}
+    String(const std::string &value) : text(value) {}
+    String(char value) : text(1, value) {}
+    String(int value, int base = DEC) : text(digits(value, base)) {}
+    String(unsigned int value, int base = DEC) : text(digits(value, base)) {}
+    String(long value, int base = DEC) : text(digits(value, base)) {}
+    String(unsigned long value, int base = DEC) : text(digits(value, base)) {}
+    String(double value, int decimals = 2) { char buffer[64]; snprintf(buffer, sizeof(buffer), "%.*f", decimals, value); text = buffer; }
+    const char *c_str() const { return text.c_str(); }
+    unsigned int length() const { return text.length(); }
+    char charAt(unsigned int index) const { return index < text.length() ? text[index] : 0; }
+    char operator[](unsigned int index) const { return charAt(index); }
+    int indexOf(const String &value, unsigned int from = 0) const { size_t found = text.find(value.text, from); return found == std::string::npos ? -1 : (int)found; }
+    String substring(unsigned int from) const { return from < text.length() ? String(text.substr(from)) : String(); }
+    String substring(unsigned int from, unsigned int to) const { return from < text.length() ? String(text.substr(from, to > from ? to - from : 0)) : String(); }
+    bool startsWith(const String &value) const { return text.compare(0, value.text.length(), value.text) == 0; }
+    bool endsWith(const String &value) const { return text.length() >= value.text.length() && text.compare(text.length() - value.text.length(), value.text.length(), value.text) == 0; }
+    bool equals(const String &value) const { return text == value.text; }
+    long toInt() const { return atol(text.c_str()); }
+    float toFloat() const { return (float)atof(text.c_str()); }
+    String &toUpperCase() { for (char &c : text) c = (char)toupper(c); return *this; }
+    String &toLowerCase() { for (char &c : text) c = (char)tolower(c); return *this; }
+    String &trim() { size_t start = text.find_first_not_of(" \\t\\r\\n"); size_t end = text.find_last_not_of(" \\t\\r\\n"); text = start == std::string::npos ? "" : text.substr(start, end - start + 1); return *this; }
+    String &concat(const String &value) { text += value.text; return *this; }
+    String &operator+=(const String &value) { return concat(value); }
+    friend String operator+(const String &left, const String &right) { return String(left.text + right.text); }
+    bool operator==(const String &value) const { return text == value.text; }
+    bool operator!=(const String &value) const { return text != value.text; }
+    bool operator<(const String &value) const { return text < value.text; }
+    static String format(const char *format, ...) { char buffer[512]; va_list args; va_start(args, format); vsnprintf(buffer, sizeof(buffer), format, args); va_end(args); return String(buffer); }
+private:
+    template <typename T> static std::string digits(T value, int base) {
+        if (base == DEC) return std::to_string(value);
+        std::string text;
+        unsigned long long number = (unsigned long long)value;
+        do { text.insert(text.begin(), "0123456789abcdef"[number % base]); number /= base; } while (number);
+        return text;
+    }
+    std::string text;
+};
+
+class Print {
+public:
+    virtual ~Print() {}
+    virtual size_t write(uint8_t c) = 0;
+    size_t write(const char *text) { size_t n = 0; while (*text) n += write((uint8_t)*text++); return n; }
+    size_t print(const String &value) { return write(value.c_str()); }
+    size_t print(const char *value) { return write(value); }
+    size_t print(char value) { return write((uint8_t)value); }
+    size_t print(int value, int base = DEC) { return print(String(value, base)); }
+    size_t print(unsigned int value, int base = DEC) { return print(String(value, base)); }
+    size_t print(long value, int base = DEC) { return print(String(value, base)); }
+    size_t print(unsigned long value, int base = DEC) { return print(String(value, base)); }
+    size_t print(double value, int decimals = 2) { return print(String(value, decimals)); }
+    size_t println() { return write("\\n"); }
+    template <typename... T> size_t println(T... values) { size_t n = print(values...); return n + println(); }
+    size_t printf(const char *format, ...) { char buffer[512]; va_list args; va_start(args, format); vsnprintf(buffer, sizeof(buffer), format, args); va_end(args); return write(buffer); }
+    size_t printlnf(const char *format, ...) { char buffer[512]; va_list args; va_start(args, format); vsnprintf(buffer, sizeof(buffer), format, args); va_end(args); return write(buffer) + println(); }
+};
+
+class Stream : public Print {
+public:
+    virtual int available() { return 0; }
+    virtual int read() { return -1; }
+    virtual int peek() { return -1; }
+    virtual void flush() {}
+};
+
+// Serial ports write to standard output
+class USARTSerial : public Stream {
+public:
+    void begin(unsigned long baud = 9600) { (void)baud; }
+    void end() {}
+    bool isConnected() { return true; }
+    size_t write(uint8_t c) override { return fputc(c, stdout) == EOF ? 0 : 1; }
+    using Print::write;
+    explicit operator bool() { return true; }
+};
+inline USARTSerial Serial;
+inline USARTSerial Serial1;
+
+class Logger {
+public:
+    void trace(const char *format, ...) { va_list args; va_start(args, format); log("TRACE", format, args); va_end(args); }
+    void info(const char *format, ...) { va_list args; va_start(args, format); log("INFO", format, args); va_end(args); }
+    void warn(const char *format, ...) { va_list args; va_start(args, format); log("WARN", format, args); va_end(args); }
+    void error(const char *format, ...) { va_list args; va_start(args, format); log("ERROR", format, args); va_end(args); }
+    void operator()(const char *format, ...) { va_list args; va_start(args, format); log("INFO", format, args); va_end(args); }
+private:
+    void log(const char *level, const char *format, va_list args) { fprintf(stdout, "%010lu [app] %s: ", millis(), level); vfprintf(stdout, format, args); fputc('\\n', stdout); }
+};
+inline Logger Log;
+
+class SerialLogHandler {
+public:
+    SerialLogHandler(LogLevel level = LOG_LEVEL_INFO) { (void)level; }
+};
+
+// The cloud is never connected, and calls to it succeed without doing anything
+class CloudClass {
+public:
+    template <typename... T> bool publish(T...) { return true; }
+    template <typename... T> bool subscribe(T...) { return true; }
+    template <typename... T> bool function(T...) { return true; }
+    template <typename... T> bool variable(T...) { return true; }
+    bool connected() { return false; }
+    void connect() {}
+    void disconnect() {}
+    void process() {}
+    String deviceID() { return String("000000000000000000000000"); }
+};
+inline CloudClass Particle;
+
+class SystemClass {
+public:
+    uint32_t freeMemory() { return 65536; }
+    void reset() {}
+    String version() { return String("host"); }
+    uint64_t millis() { return neopo_stub::clock_us / 1000; }
+};
+inline SystemClass System;
+
+class TimeClass {
+public:
+    time_t now() { return (time_t)(neopo_stub::clock_us / 1000000); }
+    bool isValid() { return true; }
+};
+inline TimeClass Time;
+
+// Defined by the application, as with Device OS
+void setup();
+void loop();
+"""
+
+# Headers that application code includes to get the Particle API
+STUB_HEADERS = {"Particle.h": PARTICLE_STUB, "application.h": '#include "Particle.h"\n'}
+
+# Write a file only if its contents changed, so objects that include it stay up to date
+def write_if_changed(path, contents):
+    try:
+        with open(path, "r") as file:
+            if file.read() == contents:
+                return
+    except OSError:
+        pass
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as file:
+        file.write(contents)
+
+# Sources below a directory of a project, skipping hidden directories
+def sources_below(path):
+    sources = []
+    for root, dirs, files in os.walk(path):
+        dirs[:] = [name for name in dirs if not name.startswith(".")]
+        sources.extend(os.path.join(root, name) for name in files if name.endswith(HOST_EXTENSIONS))
+    return sorted(sources)
+
+# The user and library sources to test (all of them unless patterns select some),
+# and the sources of the test directory
+def test_sources(project_path, patterns=None):
+    tests = sources_below(os.path.join(project_path, TEST_DIR))
+    if not tests:
+        raise UserError("No tests in %s! Add sources with a main() function to %s/." % (project_path, TEST_DIR))
+    if patterns:
+        selected = set()
+        for pattern in patterns:
+            matches = glob.glob(os.path.join(project_path, pattern), recursive=True)
+            if not matches:
+                raise UserError("No sources match %s!" % pattern)
+            for match in matches:
+                selected.update(sources_below(match) if os.path.isdir(match) else
+                                [match] if match.endswith(HOST_EXTENSIONS) else [])
+        sources = sorted(selected)
+    else:
+        sources = sources_below(os.path.join(project_path, "src"))
+        for library in sorted(glob.glob(os.path.join(project_path, "lib", "*", "src"))):
+            sources.extend(sources_below(library))
+    return sources + tests
+
+# Host compiler and flags for a source. Include paths are the same as the Makefile
+# uses, with the stub headers first so they are used instead of Device OS.
+def host_command(project_path, source, include_path):
+    cxx = source.endswith(".cpp")
+    compiler = os.environ.get("CXX", "c++") if cxx else os.environ.get("CC", "cc")
+    flags = ["-std=gnu++17" if cxx else "-std=gnu11", "-g", "-O0", "-DNEOPO_TEST=1", "-I" + include_path]
+    flags.extend("-I" + path for path in [os.path.join(project_path, "src"),
+                                          *sorted(glob.glob(os.path.join(project_path, "lib", "*", "src"))),
+                                          os.path.join(project_path, TEST_DIR)])
+    flags.extend(flag for flag in shlex.split(get_flags(project_path)) if flag.startswith(HOST_FLAG_PREFIXES))
+    return [compiler, *flags]
+
+# Files an object was compiled from, read from its dependency file
+def object_dependencies(dependency_file):
+    try:
+        with open(dependency_file, "r") as file:
+            text = file.read().replace("\\\n", " ")
+    except OSError:
+        return None
+    _, _, dependencies = text.partition(": ")
+    return [path.replace("\\ ", " ") for path in re.split(r"(?<!\\)\s+", dependencies.split("\n")[0]) if path]
+
+# Check whether an object is newer than its source and everything the source included
+def object_current(obj, source):
+    dependencies = object_dependencies(os.path.splitext(obj)[0] + ".d")
+    if not os.path.isfile(obj) or dependencies is None:
+        return False
+    built = os.path.getmtime(obj)
+    try:
+        return all(os.path.getmtime(path) <= built for path in [source, *dependencies])
+    except OSError:
+        return False
+
+# Compile a source to an object, returning the compiler output and whether it succeeded
+def compile_object(command, source, obj):
+    os.makedirs(os.path.dirname(obj), exist_ok=True)
+    result = subprocess.run([*command, "-MMD", "-MF", os.path.splitext(obj)[0] + ".d", "-c", source, "-o", obj],
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True,
+                            errors="replace")
+    return result.stdout, result.returncode == 0
+
+# Compile the sources of a project and its tests for the host against the stub of the
+# Particle API, link them, and run the tests. Objects are kept between runs and only
+# compiled again when a source, a header it includes or the flags change.
+def test_project(project_path, patterns=None, jobs=None, arguments=None):
+    if not os.path.isfile(os.path.join(project_path, projectFiles["properties"])):
+        raise UserError("%s is not a Particle project!" % project_path)
+    host_path = os.path.join(project_path, HOST_DIR)
+    include_path = os.path.join(host_path, "include")
+    for name, contents in STUB_HEADERS.items():
+        write_if_changed(os.path.join(include_path, name), contents)
+
+    # Objects compiled with other flags are compiled again
+    sources = test_sources(project_path, patterns)
+    commands = {source: host_command(project_path, source, include_path) for source in sources}
+    stamp = hashlib.sha256(json.dumps(sorted(set(map(tuple, commands.values())))).encode("utf-8")).hexdigest()
+    write_if_changed(os.path.join(host_path, "flags"), stamp)
+    objects = {source: os.path.join(host_path, "obj", os.path.relpath(source, project_path) + ".o")
+               for source in sources}
+
+    start = time.monotonic()
+    stale = [source for source in sources if not object_current(objects[source], source)
+             or os.path.getmtime(objects[source]) < os.path.getmtime(os.path.join(host_path, "flags"))]
+    failed = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=make_jobs(jobs, get_setting(project_path, "MAKE_JOBS"))) as executor:
+        futures = {executor.submit(compile_object, commands[source], source, objects[source]): source
+                   for source in stale}
+        for future in concurrent.futures.as_completed(futures):
+            output, compiled = future.result()
+            if not compiled:
+                failed.append(futures[future])
+            print(output, end="", flush=True)
+    if failed:
+        raise ProcessError("%d of %d sources failed to compile!" % (len(failed), len(sources)))
+
+    # Link again if any object is newer than the test binary, or the sources changed
+    binary = os.path.join(host_path, "%s-test" % os.path.basename(project_path))
+    object_list = os.path.join(host_path, "objects")
+    write_if_changed(object_list, "\n".join(objects.values()) + "\n")
+    linked = os.path.isfile(binary) and not stale and os.path.getmtime(binary) >= max(
+        os.path.getmtime(path) for path in [object_list, *objects.values()])
+    if not linked:
+        result = subprocess.run([os.environ.get("CXX", "c++"), *objects.values(), "-o", binary])
+        if result.returncode != 0:
+            raise ProcessError("Failed to link the tests!")
+    print("Compiled %d of %d sources in %.1fs." % (len(stale), len(sources), time.monotonic() - start), flush=True)
+
+    returncode = subprocess.run([binary, *(arguments or [])], cwd=project_path).returncode
+    if returncode != 0:
+        raise ProcessError("Tests failed with exit code %d!" % returncode)
+
+# Wrapper for [test]
+def test_command(args):
+    # Arguments after -- are passed to the test binary
+    args, arguments = (args[2:args.index("--")], args[args.index("--") + 1:]) if "--" in args else (args[2:], [])
+    jobs, args = split_jobs_option(args)
+    patterns = []
+    project = os.getcwd()
+    index = 0
+    while index < len(args):
+        if args[index] == "--sources":
+            if index + 1 >= len(args):
+                raise UserError("You must specify a value for --sources!")
+            patterns.extend(args[index + 1].replace(",", " ").split())
+            index += 2
+            continue
+        if args[index].startswith("-"):
+            raise UserError("Invalid option: %s" % args[index])
+        project = os.path.abspath(args[index])
+        index += 1
+    test_project(project, patterns, jobs, arguments)
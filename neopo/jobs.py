@@ -0,0 +1,83 @@
+import os
+
+# Local imports
+from .common import NEOPO_JOBS, UserError
+
+# Memory set aside for each make job, since gcc-arm LTO links need about this much
+MEMORY_PER_JOB = 1024 * 1024 * 1024
+
+# Cores this process may run on
+def available_cpus():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+# Memory that can be used without swapping in bytes, or None if unknown
+def available_memory():
+    try:
+        with open("/proc/meminfo", "r") as file:
+            for line in file:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+# One job per core, as long as each job has enough memory
+def automatic_jobs():
+    jobs = available_cpus()
+    memory = available_memory()
+    if memory is not None:
+        jobs = min(jobs, memory // MEMORY_PER_JOB)
+    return max(1, jobs)
+
+# Parse a job count, where "auto" (or nothing) means automatic
+def parse_jobs(value):
+    if value in (None, "", "auto"):
+        return None
+    try:
+        jobs = int(value)
+    except ValueError as error:
+        raise UserError("Invalid number of jobs: %s" % value) from error
+    if jobs < 1:
+        raise UserError("Invalid number of jobs: %s" % value)
+    return jobs
+
+# First job count that was requested (per command, per project, NEOPO_JOBS), or None
+def requested_jobs(*values):
+    for value in (*values, NEOPO_JOBS):
+        jobs = parse_jobs(value)
+        if jobs:
+            return jobs
+    return None
+
+# Job count to run make with
+def make_jobs(*values):
+    return requested_jobs(*values) or automatic_jobs()
+
+# Remove a job count option (-j N, -jN, --jobs N, --jobs=N) from command arguments,
+# returning its value (or None) and the remaining arguments
+def split_jobs_option(args):
+    jobs, remaining = None, []
+    index = 0
+    while index < len(args):
+        arg = args[index]
+        if arg in ("-j", "--jobs"):
+            if index + 1 >= len(args):
+                raise UserError("You must specify a number of jobs!")
+            jobs = args[index + 1]
+            index += 2
+            continue
+        if isinstance(arg, str) and arg.startswith("--jobs="):
+            jobs = arg.partition("=")[2]
+        elif isinstance(arg, str) and arg.startswith("-j") and len(arg) > 2:
+            jobs = arg[2:]
+        else:
+            remaining.append(arg)
+        index += 1
+    parse_jobs(jobs)
+    return jobs, remaining
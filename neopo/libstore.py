@@ -0,0 +1,280 @@
+import os
+import re
+import json
+import shutil
+import hashlib
+
+# Local imports
+from .common import LIBRARY_STORE_DIR, UserError, projectFiles
+from .unity import read_isolated
+
+# Contents of a library as installed, to tell a local copy with changes from the original
+LIBRARY_RECORD = ".neopo-library.json"
+
+# Objects of a library in the store, with the paths they were built at
+STORE_INDEX = "objects.json"
+
+# Store entries seeded into a staged build, kept with its objects
+SEEDED_FILE = os.path.join("target", ".neopo-libraries.json")
+
+# Stands for the name of the project in the paths of stored objects
+PROJECT_PLACEHOLDER = "{project}"
+
+# Header names included by library sources
+INCLUDE = re.compile(r'^\s*#\s*include\s*[<"]([^>"]+)[>"]', re.M)
+
+# Bytes hashed at a time
+CHUNK_SIZE = 64 * 1024
+
+# Hash the files of a library, without hidden files and the install record
+def library_digest(path):
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(path):
+        dirs[:] = sorted(name for name in dirs if not name.startswith("."))
+        for name in sorted(files):
+            if name.startswith("."):
+                continue
+            file_path = os.path.join(root, name)
+            digest.update(os.path.relpath(file_path, path).encode("utf-8") + b"\0")
+            with open(file_path, "rb") as file:
+                for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+                    digest.update(chunk)
+            digest.update(b"\0")
+    return digest.hexdigest()
+
+# Remember the contents of a library as it was installed
+def record_library(path, name, version):
+    with open(os.path.join(path, LIBRARY_RECORD), "w") as file:
+        json.dump({"name": name, "version": version, "digest": library_digest(path)}, file, indent=4)
+
+# Properties of a library or project, or an empty dictionary
+def read_properties(path):
+    properties = {}
+    try:
+        with open(path, "r") as file:
+            for line in file:
+                key, separator, value = line.partition("=")
+                if separator:
+                    properties[key.strip()] = value.strip()
+    except OSError:
+        pass
+    return properties
+
+# Dependencies listed in properties as (name, version) tuples
+def dependencies(properties):
+    return sorted((key.split(".", 1)[1], value) for key, value in properties.items()
+                  if key.startswith("dependencies."))
+
+# Names of the files below a directory
+def file_names(path):
+    names = set()
+    for root, _, files in os.walk(path):
+        names.update(files)
+    return names
+
+# Names of the headers that the sources of a library include
+def included_headers(library_path):
+    headers = set()
+    for root, _, files in os.walk(library_path):
+        for name in files:
+            if name.endswith((".c", ".cpp", ".h", ".hpp")):
+                with open(os.path.join(root, name), "r", errors="replace") as file:
+                    headers.update(os.path.basename(include) for include in INCLUDE.findall(file.read()))
+    return headers
+
+# Check whether a library includes headers from the sources of the project, which
+# makes its objects depend on the project
+def includes_project_headers(library_path, project_path):
+    project_headers = file_names(os.path.join(project_path, "src"))
+    if not project_headers:
+        return False
+    return bool(included_headers(library_path) & (project_headers - file_names(library_path)))
+
+# Names and digests of the other libraries in lib/ that a library is compiled against:
+# those whose headers it includes, its dependencies, and theirs. Every lib/*/src is on
+# the include path, so changes to any of them change the objects of the library.
+def library_context(project_path, library_path, properties, digests):
+    lib_path = os.path.join(project_path, "lib")
+    names = set()
+    included = included_headers(library_path) - file_names(library_path)
+    required = [name for name, _ in dependencies(properties)]
+    for name in sorted(os.listdir(lib_path)):
+        path = os.path.join(lib_path, name)
+        if path != library_path and os.path.isdir(path) and included & file_names(path):
+            required.append(name)
+    while required:
+        name = required.pop()
+        path = os.path.join(lib_path, name)
+        if name in names or path == library_path or not os.path.isdir(path):
+            continue
+        names.add(name)
+        required.extend(dependency for dependency, _ in
+                        dependencies(read_properties(os.path.join(path, "library.properties"))))
+
+    context = []
+    for name in sorted(names):
+        if name not in digests:
+            digests[name] = library_digest(os.path.join(lib_path, name))
+        context.append([name, digests[name]])
+    return context
+
+# Libraries of a project that can use objects from the store, as dictionaries with
+# their name, version, path, digest and dependencies. These are the libraries that
+# project.properties requires (and their dependencies) in the installed version and
+# without local changes. Libraries installed before records were kept are recorded.
+def shared_libraries(project_path):
+    required = dependencies(read_properties(os.path.join(project_path, projectFiles["properties"])))
+    libraries, digests = [], {}
+    while required:
+        name, version = required.pop(0)
+        path = os.path.join(project_path, "lib", name)
+        properties = read_properties(os.path.join(path, "library.properties"))
+        if properties.get("version") != version or any(library["name"] == name for library in libraries):
+            continue
+        required.extend(dependencies(properties))
+
+        digest = digests[name] = library_digest(path)
+        try:
+            with open(os.path.join(path, LIBRARY_RECORD), "r") as file:
+                record = json.load(file)
+        except (OSError, ValueError):
+            record_library(path, name, version)
+            record = {"version": version, "digest": digest}
+        if record.get("version") != version or record.get("digest") != digest:
+            print("Library %s@%s has local changes, building it from source." % (name, version))
+            continue
+        if includes_project_headers(path, project_path):
+            continue
+        libraries.append({"name": name, "version": version, "path": path, "digest": digest,
+                          "dependencies": dependencies(properties),
+                          "context": library_context(project_path, path, properties, digests)})
+    return libraries
+
+# Directory in the store holding the objects of a library for a build configuration.
+# The libraries it is compiled against and the sources of the library that a unity
+# build compiles on their own are part of the key.
+def store_path(library, configuration, batch_size, isolated):
+    isolated = sorted(os.path.relpath(path, library["path"]) for path in isolated
+                      if path.startswith(library["path"] + os.sep))
+    values = json.dumps([library["name"], library["version"], library["digest"], library["dependencies"],
+                         library["context"], batch_size, isolated,
+                         *(configuration[key] for key in sorted(configuration))])
+    return os.path.join(LIBRARY_STORE_DIR, "%s-%s-%s-%s-%s" % (
+        library["name"], library["version"], configuration["platform"], configuration["deviceOS"],
+        hashlib.sha256(values.encode("utf-8")).hexdigest()[:16]))
+
+# Store entries that the objects of each library in a staged build came from
+def read_seeded(staging):
+    try:
+        with open(os.path.join(staging, SEEDED_FILE), "r") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+def write_seeded(staging, seeded):
+    os.makedirs(os.path.dirname(os.path.join(staging, SEEDED_FILE)), exist_ok=True)
+    with open(os.path.join(staging, SEEDED_FILE), "w") as file:
+        json.dump(seeded, file, indent=4)
+
+# Path of a stored object in a staged build. Objects are stored by the name of the
+# directory they were compiled into (roots) and their path below it, where the name
+# of the project is replaced so projects with other names can use them.
+def staged_object(roots, stored, project_name):
+    root, _, relative = stored.partition("/")
+    parts = [project_name if part == PROJECT_PLACEHOLDER else part for part in relative.split("/")]
+    return os.path.join(roots[root], *parts)
+
+# Objects compiled from the sources of a library in the directories of a staged build,
+# by the names they are stored under
+def library_objects(roots, name, project_name):
+    objects = []
+    marker = os.sep + os.path.join("lib", name, "src") + os.sep
+    for key, path in roots.items():
+        for root, _, files in os.walk(path):
+            for file in files:
+                relative = os.path.relpath(os.path.join(root, file), path)
+                if file.endswith(".o") and marker in os.sep + relative:
+                    parts = [PROJECT_PLACEHOLDER if part == project_name else part
+                             for part in relative.split(os.sep)]
+                    objects.append("/".join([key, *parts]))
+    return sorted(objects)
+
+# Put the stored objects of libraries into a staged build, newer than their sources
+# so make does not compile them again. Objects are only copied where they are missing
+# or came from another entry, so builds stay incremental.
+def seed_objects(staging, roots, libraries, configuration, batch_size):
+    isolated, seeded = read_isolated(staging), read_seeded(staging)
+    for library in libraries:
+        entry = store_path(library, configuration, batch_size, isolated)
+        try:
+            with open(os.path.join(entry, STORE_INDEX), "r") as file:
+                objects = json.load(file)
+        except (OSError, ValueError):
+            continue
+        library["entry"] = entry
+        copied = 0
+        for stored in objects:
+            path = staged_object(roots, stored, os.path.basename(staging))
+            if seeded.get(library["name"]) == entry and os.path.isfile(path):
+                continue
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            shutil.copyfile(os.path.join(entry, "objects", *stored.split("/")), path)
+            copied += 1
+        seeded[library["name"]] = entry
+        if copied:
+            print("Using prebuilt %s@%s." % (library["name"], library["version"]))
+    write_seeded(staging, seeded)
+
+# Add the objects of libraries that are not in the store yet after a successful build.
+# Entries are written to a temporary directory first so other builds never see them
+# half written.
+def store_objects(staging, roots, libraries, configuration, batch_size):
+    isolated, seeded = read_isolated(staging), read_seeded(staging)
+    for library in libraries:
+        entry = store_path(library, configuration, batch_size, isolated)
+        if library.get("entry") == entry or os.path.isdir(entry):
+            continue
+        objects = library_objects(roots, library["name"], os.path.basename(staging))
+        if not objects:
+            continue
+        temp = "%s.%d.tmp" % (entry, os.getpid())
+        shutil.rmtree(temp, ignore_errors=True)
+        for stored in objects:
+            path = os.path.join(temp, "objects", *stored.split("/"))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            shutil.copyfile(staged_object(roots, stored, os.path.basename(staging)), path)
+        with open(os.path.join(temp, STORE_INDEX), "w") as file:
+            json.dump(objects, file, indent=4)
+        try:
+            os.rename(temp, entry)
+        except OSError:
+            # Stored by a concurrent build in the meantime
+            shutil.rmtree(temp, ignore_errors=True)
+        seeded[library["name"]] = entry
+    write_seeded(staging, seeded)
+
+# Print the libraries in the store
+def list_store():
+    entries = sorted(os.listdir(LIBRARY_STORE_DIR)) if os.path.isdir(LIBRARY_STORE_DIR) else []
+    entries = [entry for entry in entries if not entry.endswith(".tmp")]
+    total = 0
+    for entry in entries:
+        path = os.path.join(LIBRARY_STORE_DIR, entry)
+        size = sum(os.path.getsize(os.path.join(root, file)) for root, _, files in os.walk(path) for file in files)
+        total += size
+        print("%s (%.1f KiB)" % (entry, size / 1024))
+    print("%d prebuilt libraries, %.1f MiB in %s" % (len(entries), total / 1048576, LIBRARY_STORE_DIR))
+
+# Delete every library in the store
+def clear_store():
+    shutil.rmtree(LIBRARY_STORE_DIR, ignore_errors=True)
+    print("Cleared the library store.")
+
+# Wrapper for [library-store]
+def library_store_command(args):
+    store_commands = {"list": list_store, "clear": clear_store}
+    try:
+        command = store_commands[args[2]] if len(args) > 2 else list_store
+    except KeyError as error:
+        raise UserError("Invalid library-store command! Commands are: %s" % ", ".join(store_commands)) from error
+    command()
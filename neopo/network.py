@@ -0,0 +1,186 @@
+import zlib
+import threading
+import http.client
+import urllib.error
+import urllib.parse
+import urllib.request
+
+# Seconds to wait for a connection or a stalled response
+TIMEOUT = 30
+
+# Idle keep-alive connections kept open per host
+MAX_IDLE = 4
+
+# Redirects followed before giving up (GitHub releases redirect to a CDN)
+MAX_REDIRECTS = 5
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+
+# Bytes read at a time when decompressing
+CHUNK_SIZE = 64 * 1024
+
+# Idle connections by (scheme, host, port)
+idle_connections = {}
+pool_lock = threading.Lock()
+
+# Check whether the environment routes a URL through a proxy
+def proxied(url):
+    parts = urllib.parse.urlsplit(url)
+    return parts.scheme in urllib.request.getproxies() and not urllib.request.proxy_bypass(parts.hostname)
+
+# Take an idle connection to a host from the pool, or open a new one
+def get_connection(key):
+    with pool_lock:
+        connections = idle_connections.get(key)
+        if connections:
+            return connections.pop(), True
+    scheme, host, port = key
+    connection_class = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+    return connection_class(host, port, timeout=TIMEOUT), False
+
+# Return a connection whose response was fully read to the pool
+def release_connection(key, connection):
+    with pool_lock:
+        connections = idle_connections.setdefault(key, [])
+        if len(connections) < MAX_IDLE:
+            connections.append(connection)
+            return
+    connection.close()
+
+# Close every pooled connection
+def close_connections():
+    with pool_lock:
+        for connections in idle_connections.values():
+            for connection in connections:
+                connection.close()
+        idle_connections.clear()
+
+# Response from a pooled connection, transparently decompressing gzip bodies.
+# The connection goes back to the pool once the body has been read completely.
+class Response:
+    def __init__(self, key, connection, response):
+        self.key = key
+        self.connection = connection
+        self.response = response
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+        self.buffer = b""
+        gzipped = response.getheader("Content-Encoding", "").lower() == "gzip"
+        self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if gzipped else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    # Bytes of the (compressed) body still to be received, if known
+    @property
+    def length(self):
+        return self.response.length
+
+    def getheader(self, name, default=None):
+        return self.response.getheader(name, default)
+
+    # Read the body, raising URLError like urlopen when the connection times out or drops
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = -1
+        try:
+            if self.decompressor:
+                data = self.inflate(size)
+            else:
+                data = self.response.read(None if size < 0 else size)
+        except (OSError, http.client.HTTPException) as error:
+            self.discard()
+            raise urllib.error.URLError(error) from error
+        if self.response.isclosed():
+            self.finish()
+        return data
+
+    def inflate(self, size):
+        while size < 0 or len(self.buffer) < size:
+            chunk = self.response.read(CHUNK_SIZE)
+            if not chunk:
+                self.buffer += self.decompressor.flush()
+                break
+            self.buffer += self.decompressor.decompress(chunk)
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    # Pool the connection after a complete response, unless the server closes it. A body
+    # that ends before its Content-Length means the connection dropped, and http.client
+    # only reports that as a short read.
+    def finish(self):
+        if self.connection and self.response.length:
+            self.discard()
+        if self.connection:
+            if self.response.will_close:
+                self.connection.close()
+            else:
+                release_connection(self.key, self.connection)
+            self.connection = None
+
+    # Close the response and its connection, which can not be reused
+    def discard(self):
+        self.response.close()
+        if self.connection:
+            self.connection.close()
+            self.connection = None
+
+    def close(self):
+        if not self.response.isclosed():
+            # Unread data would corrupt the next request on this connection
+            self.discard()
+        self.finish()
+
+# Send a request on a pooled connection, retrying once if a reused connection went stale
+def send(key, method, target, headers, data):
+    connection, reused = get_connection(key)
+    try:
+        connection.request(method, target, body=data, headers=headers)
+        return Response(key, connection, connection.getresponse())
+    except (OSError, http.client.HTTPException) as error:
+        connection.close()
+        if reused and isinstance(error, ConnectionError):
+            return send(key, method, target, headers, data)
+        raise urllib.error.URLError(error) from error
+
+# Make an HTTP request with keep-alive connection pooling, following redirects.
+# Raises urllib.error.HTTPError/URLError like urllib.request.urlopen.
+def request(url, method="GET", headers=None, data=None, compressed=False):
+    headers = dict(headers or {})
+    headers.setdefault("User-Agent", "neopo")
+
+    # Let urllib handle proxies configured in the environment, without pooling
+    if proxied(url):
+        return Response(None, None, urllib.request.urlopen(
+            urllib.request.Request(url, data=data, headers=headers, method=method), timeout=TIMEOUT))
+
+    if compressed:
+        headers["Accept-Encoding"] = "gzip"
+
+    for _ in range(MAX_REDIRECTS + 1):
+        parts = urllib.parse.urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        target = (parts.path or "/") + ("?" + parts.query if parts.query else "")
+        response = send(key, method, target, headers, data)
+
+        location = response.getheader("Location")
+        if response.status in REDIRECT_CODES and location:
+            response.read()
+            response.close()
+            url = urllib.parse.urljoin(url, location)
+            if response.status == 303:
+                method, data = "GET", None
+            continue
+
+        if response.status >= 400:
+            response.read()
+            response.close()
+            raise urllib.error.HTTPError(url, response.status, response.reason, response.headers, None)
+        return response
+
+    raise urllib.error.URLError("Too many redirects for %s" % url)
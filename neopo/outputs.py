@@ -0,0 +1,143 @@
+import os
+import json
+import shutil
+import hashlib
+import contextlib
+
+# Not available on Windows, where output directories are switched without locking
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Local imports
+from .common import UserError
+
+# Configuration of the build in an output directory
+CONFIGURATION_FILE = ".neopo-configuration.json"
+
+# Output directories of configurations that are not in use, inside the project
+STORED_DIR = os.path.join("target", "configurations")
+
+# Host builds of neopo test, which are not the output of a configuration
+HOST_DIR = os.path.join("target", "host")
+
+# Settings that make the outputs of a build incompatible with another
+CONFIGURATION_KEYS = ["platform", "deviceOS", "deviceOS-path", "EXTRA_CFLAGS", "gcc-arm", "buildscripts"]
+
+# Short key identifying a build configuration
+def configuration_key(configuration):
+    values = json.dumps([configuration.get(key) for key in CONFIGURATION_KEYS])
+    return hashlib.sha256(values.encode("utf-8")).hexdigest()[:12]
+
+# Directory holding the outputs of a configuration while it is not in use
+def stored_path(project_path, configuration):
+    return os.path.join(project_path, STORED_DIR, "%s-%s-%s" % (
+        configuration["platform"], configuration["deviceOS"], configuration_key(configuration)))
+
+# Configuration recorded in an output directory, or None
+def read_configuration(output_path):
+    try:
+        with open(os.path.join(output_path, CONFIGURATION_FILE), "r") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+# Hold an exclusive lock on an output directory while a build uses it
+@contextlib.contextmanager
+def output_lock(output_path):
+    if not fcntl:
+        yield
+        return
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+# The buildscripts Makefile always builds a platform and deviceOS version into the same
+# directory, so the outputs of other configurations (EXTRA_CFLAGS, compiler, ...) are
+# moved aside and moved back when that configuration is built again
+def select_output(project_path, output_path, configuration):
+    configuration = {key: configuration.get(key) for key in CONFIGURATION_KEYS}
+    current = read_configuration(output_path)
+    if current == configuration:
+        return
+
+    # Outputs built before configurations were recorded are taken over as they are
+    if current is not None and os.path.isdir(output_path):
+        stored = stored_path(project_path, current)
+        shutil.rmtree(stored, ignore_errors=True)
+        os.makedirs(os.path.dirname(stored), exist_ok=True)
+        os.replace(output_path, stored)
+
+        stored = stored_path(project_path, configuration)
+        if os.path.isdir(stored):
+            os.replace(stored, output_path)
+    os.makedirs(output_path, exist_ok=True)
+    with open(os.path.join(output_path, CONFIGURATION_FILE), "w") as file:
+        json.dump(configuration, file, indent=4)
+
+# Every output directory in a project as (path, configuration, in use) tuples
+def output_directories(project_path):
+    directories = []
+    target = os.path.join(project_path, "target")
+    for version in sorted(os.listdir(target)) if os.path.isdir(target) else []:
+        version_path = os.path.join(target, version)
+        if version_path in (os.path.join(project_path, STORED_DIR), os.path.join(project_path, HOST_DIR)) \
+                or not os.path.isdir(version_path):
+            continue
+        for platform in sorted(os.listdir(version_path)):
+            path = os.path.join(version_path, platform)
+            if os.path.isdir(path):
+                directories.append((path, read_configuration(path), True))
+    stored_dir = os.path.join(project_path, STORED_DIR)
+    for name in sorted(os.listdir(stored_dir)) if os.path.isdir(stored_dir) else []:
+        path = os.path.join(stored_dir, name)
+        if os.path.isdir(path):
+            directories.append((path, read_configuration(path), False))
+    return directories
+
+# Total size of the files in a directory
+def directory_size(path):
+    return sum(os.path.getsize(os.path.join(root, file))
+               for root, _, files in os.walk(path) for file in files)
+
+# Print the output directories of a project
+def list_outputs(project_path):
+    directories = output_directories(project_path)
+    if not directories:
+        print("No build outputs in %s" % project_path)
+        return
+    for path, configuration, active in directories:
+        print("%s%s" % (os.path.relpath(path, project_path), "" if active else " (stored)"))
+        if configuration:
+            print("    platform: %s, deviceOS: %s, gcc-arm: %s" % (
+                configuration["platform"], configuration["deviceOS"], configuration["gcc-arm"]))
+            print("    EXTRA_CFLAGS: %s" % (configuration["EXTRA_CFLAGS"] or "<not set>"))
+        print("    size: %.1f MiB" % (directory_size(path) / 1048576))
+
+# Delete output directories whose configuration is not in use
+def prune_outputs(project_path):
+    freed = 0
+    for path, _, active in output_directories(project_path):
+        if not active:
+            freed += directory_size(path)
+            shutil.rmtree(path)
+            print("Removed %s" % os.path.relpath(path, project_path))
+    print("Freed %.1f MiB" % (freed / 1048576))
+
+# Wrapper for [outputs]
+def outputs_command(args):
+    outputs_commands = {"list": list_outputs, "prune": prune_outputs}
+    try:
+        command = outputs_commands[args[2]] if len(args) > 2 else list_outputs
+    except KeyError as error:
+        raise UserError("Invalid outputs command! Commands are: %s" % ", ".join(outputs_commands)) from error
+    try:
+        project = os.path.abspath(args[3])
+    except IndexError:
+        project = os.getcwd()
+    command(project)
@@ -0,0 +1,116 @@
+import os
+import json
+import shutil
+import hashlib
+import contextlib
+
+# Not available on Windows, where libraries are built without locking
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Local imports
+from .common import DEVICE_OS_LIBS_DIR, running_on_windows
+
+# Targets that build and link the Device OS libraries
+PREBUILT_TARGETS = ["compile-user", "flash-user", "compile-all", "flash-all"]
+
+# Directory of a scratch directory holding Device OS libraries
+SCRATCH_LIBS_DIR = "device-os-libs"
+
+# Written once a build has produced every library in a directory
+COMPLETE_MARKER = ".complete"
+
+# Directory in the output (or scratch) directory of a project passed as BUILD_PATH_BASE
+PROJECT_LIBS_DIR = "device-os"
+
+# Written in BUILD_PATH_BASE with the shared libraries its modules were copied from
+COPIED_MARKER = ".neopo-libraries"
+
+# Modules of BUILD_PATH_BASE that only hold Device OS code and are shared between
+# projects, matched on the name before the first dash (hal-dynalib, system-part1).
+# Everything else, such as the user, user-part and main modules built from the
+# application, stays in the project so projects never pick up each other's objects.
+SYSTEM_MODULES = ["bootloader", "communication", "crypto", "dynalib", "gsm0710muxer", "hal",
+                  "newlib_nano", "platform", "proto_c", "rt", "services", "system", "third_party",
+                  "wiring", "wiring_globals"]
+
+# Directory holding the Device OS libraries for a build configuration, copied into
+# the BUILD_PATH_BASE of each project. Builds in a scratch directory keep their
+# libraries there too.
+def libraries_path(platform, firmware_version, device_os_path, compiler_version, script_version, flags,
+                   scratch=None):
+    configuration = json.dumps([platform, firmware_version, device_os_path,
+                                compiler_version, script_version, flags])
+    digest = hashlib.sha256(configuration.encode("utf-8")).hexdigest()[:16]
+    base = os.path.join(scratch, SCRATCH_LIBS_DIR) if scratch else DEVICE_OS_LIBS_DIR
+    return os.path.join(base, "%s-%s-%s" % (platform, firmware_version, digest))
+
+# Check whether an entry of BUILD_PATH_BASE is a Device OS module shared between projects
+def system_module(name):
+    return name.split("-", 1)[0] in SYSTEM_MODULES
+
+# Replace a Device OS module in BUILD_PATH_BASE with a copy of another, keeping the
+# modification times so make finds its objects up to date
+def copy_module(source, target):
+    if os.path.islink(target):
+        os.remove(target)
+    else:
+        shutil.rmtree(target, ignore_errors=True)
+    shutil.copytree(source, target, symlinks=True)
+
+# Copy the shared Device OS modules of a configuration into the BUILD_PATH_BASE of a
+# project once they are complete. Make only ever rebuilds the copy of the project, so
+# the shared modules never change under other builds linking against them. Until they
+# are complete, and on Windows, the project builds its own.
+def copy_libraries(path, project_libraries):
+    os.makedirs(project_libraries, exist_ok=True)
+    if not libraries_complete(path) or running_on_windows:
+        return
+    source = "%s %d" % (path, os.stat(os.path.join(path, COMPLETE_MARKER)).st_mtime_ns)
+    marker = os.path.join(project_libraries, COPIED_MARKER)
+    try:
+        with open(marker) as file:
+            if file.read() == source:
+                return
+    except FileNotFoundError:
+        pass
+    for name in os.listdir(path):
+        if system_module(name):
+            copy_module(os.path.join(path, name), os.path.join(project_libraries, name))
+    with open(marker, "w") as file:
+        file.write(source)
+
+# Check whether a build has produced every library in a directory
+def libraries_complete(path):
+    return os.path.isfile(os.path.join(path, COMPLETE_MARKER))
+
+# Hold an exclusive lock while libraries are incomplete, so only one build at a
+# time writes them. Once complete they are only read, by copying, and never wait.
+@contextlib.contextmanager
+def libraries_lock(path):
+    if not path or libraries_complete(path) or not fcntl:
+        yield
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+# After a successful build, copy the Device OS modules a project built into the shared
+# directory (while holding its lock) and mark the libraries as built. The project keeps
+# its own modules, which now match the shared ones.
+def mark_complete(path, project_libraries):
+    if not path or libraries_complete(path) or running_on_windows:
+        return
+    os.makedirs(path, exist_ok=True)
+    for name in os.listdir(project_libraries):
+        source = os.path.join(project_libraries, name)
+        if system_module(name) and os.path.isdir(source) and not os.path.islink(source):
+            copy_module(source, os.path.join(path, name))
+    open(os.path.join(path, COMPLETE_MARKER), "w").close()
+    copy_libraries(path, project_libraries)
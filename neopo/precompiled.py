@@ -0,0 +1,136 @@
+import os
+import re
+import sys
+import shutil
+import hashlib
+import subprocess
+
+# Not available on Windows, where precompiled headers are not used
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Directory inside the output directory of a configuration holding its precompiled headers
+PRECOMPILED_DIR = "precompiled"
+
+# Header that is precompiled, which also provides application.h
+PRECOMPILED_HEADER = "Particle.h"
+
+# Headers that a source must include first to use the precompiled header
+PRECOMPILED_INCLUDES = ["Particle.h", "application.h"]
+
+# C++ sources, the only ones that include Particle.h
+CXX_EXTENSIONS = (".cpp", ".cc", ".cp", ".cxx", ".c++", ".C")
+
+# Options that only matter for the object file or its dependencies
+OUTPUT_OPTIONS = ["-c", "-MD", "-MMD", "-MP"]
+OUTPUT_VALUE_OPTIONS = ["-o", "-MF", "-MT", "-MQ"]
+
+# Written instead of a precompiled header when the header can not be precompiled
+FAILED_MARKER = "failed"
+
+# Comments and blank space before the first directive of a source
+LEADING_TEXT = re.compile(r"\s*(//[^\n]*|/\*.*?\*/)?", re.S)
+FIRST_INCLUDE = re.compile(r'#\s*include\s*[<"]([^>"]+)[>"]')
+
+# Environment variables that pass the precompiled header settings to the compiler shims
+DIRECTORY_VARIABLE = "NEOPO_PRECOMPILED_DIR"
+APPDIR_VARIABLE = "NEOPO_PRECOMPILED_APPDIR"
+
+# Settings for the compiler shims to precompile Particle.h for the sources of a project,
+# and of the staged copy it is built from if there is one
+def precompiled_env(environment, project_path, output_path, staged_path=None):
+    environment[DIRECTORY_VARIABLE] = os.path.join(output_path, PRECOMPILED_DIR)
+    environment[APPDIR_VARIABLE] = os.pathsep.join(filter(None, [project_path, staged_path]))
+
+# Check whether a source file includes Particle.h or application.h before anything else,
+# so including the precompiled header ahead of it does not change what is compiled
+def includes_particle_first(source):
+    try:
+        with open(source, "r", errors="replace") as file:
+            text = file.read(4096)
+    except OSError:
+        return False
+    position = 0
+    while position < len(text):
+        match = LEADING_TEXT.match(text, position)
+        if match.end() == position:
+            break
+        position = match.end()
+    match = FIRST_INCLUDE.match(text, position)
+    return bool(match) and os.path.basename(match.group(1)) in PRECOMPILED_INCLUDES
+
+# Split a compile into the options that the precompiled header must share and its source
+def header_options(args):
+    options, sources = [], []
+    index = 0
+    while index < len(args):
+        arg = args[index]
+        if arg in OUTPUT_VALUE_OPTIONS:
+            index += 2
+            continue
+        index += 1
+        if arg in OUTPUT_OPTIONS:
+            continue
+        if not arg.startswith("-") and arg.endswith(CXX_EXTENSIONS):
+            sources.append(arg)
+        else:
+            options.append(arg)
+    return options, sources
+
+# Precompile Particle.h with the options of a compile, once for each set of options.
+# Returns the header to include, next to which gcc finds the precompiled header, or
+# None if it could not be precompiled. Parallel compiles wait for the first to finish.
+def precompile_header(compiler, options, directory):
+    real = os.path.realpath(shutil.which(compiler) or compiler)
+    digest = hashlib.sha256(real.encode("utf-8") + b"\0" + "\0".join(options).encode("utf-8"))
+    path = os.path.join(directory, digest.hexdigest()[:16])
+    header = os.path.join(path, PRECOMPILED_HEADER)
+    if os.path.isfile(header + ".gch"):
+        return header
+    if os.path.isfile(os.path.join(path, FAILED_MARKER)):
+        return None
+
+    os.makedirs(path, exist_ok=True)
+    with open(path + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            if os.path.isfile(header + ".gch"):
+                return header
+            if os.path.isfile(os.path.join(path, FAILED_MARKER)):
+                return None
+
+            # The header includes the real Particle.h from the include path, which
+            # is also what gcc falls back to if the precompiled header can not be used
+            with open(header, "w") as file:
+                file.write("#include <%s>\n" % PRECOMPILED_HEADER)
+            temp = "%s.%d.tmp" % (header + ".gch", os.getpid())
+            result = subprocess.run([compiler, *options, "-x", "c++-header", header, "-o", temp],
+                                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            if result.returncode != 0 or not os.path.isfile(temp):
+                with open(os.path.join(path, FAILED_MARKER), "wb") as file:
+                    file.write(result.stdout)
+                sys.stderr.write("Could not precompile %s, compiling without it.\n" % PRECOMPILED_HEADER)
+                return None
+            os.replace(temp, header + ".gch")
+            return header
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+# Arguments of a compile with the precompiled header included first, or the same
+# arguments for compiles that can not use it (C, Device OS, other first includes)
+def precompiled_arguments(compiler, args):
+    directory = os.environ.get(DIRECTORY_VARIABLE)
+    appdirs = os.environ.get(APPDIR_VARIABLE)
+    if not (directory and appdirs and fcntl) or "-c" not in args or "-include" in args:
+        return args
+    options, sources = header_options(args)
+    if len(sources) != 1:
+        return args
+    source = os.path.realpath(sources[0])
+    if not any(source.startswith(os.path.realpath(appdir) + os.sep) for appdir in appdirs.split(os.pathsep)) \
+            or not includes_particle_first(source):
+        return args
+    header = precompile_header(compiler, options, directory)
+    return ["-include", header, *args] if header else args
@@ -5,13 +5,15 @@ import pathlib
 import subprocess
 
 # Local imports
-from .common import TRAVIS_YML, min_particle_env
+from .common import TRAVIS_YML, NEOPO_PCH, NEOPO_SCRATCH, NEOPO_SHARED_LIBS, min_particle_env
 from .common import particle_cli, running_on_windows
 from .common import ProcessError, ProjectError, UserError
 from .common import projectFiles, vscodeFiles
 from .utility import write_file, check_login, download_library
 from .manifest import get_manifest_value
 from .toolchain import check_firmware_version
+from .jobs import parse_jobs, automatic_jobs
+from .unity import DEFAULT_BATCH
 
 # Create a Particle project and copy in Workbench settings
 def create_project(path, name, config_device = None, config_version = None):
@@ -179,25 +181,36 @@ def install_libraries(libraries, project_path, active):
                 print("Library %s@%s is already installed." % library)
     return libraries_intact
 
-# Get EXTRA_CFLAGS for a project or return empty string
-def get_flags(project_path):
+# Get a setting of a project, or a default if it is not set
+def get_setting(project_path, key, default=None):
     try:
         settings_path = os.path.join(project_path, projectFiles["settings"])
         with open(settings_path, "r") as file:
             settings = json.load(file)
-        return settings["EXTRA_CFLAGS"]
+        return settings[key]
     except (FileNotFoundError, KeyError):
-        return ""
+        return default
 
-# Set EXTRA_CFLAGS for a project
-def set_flags(project_path, make_flags):
+# Set a setting of a project, or remove it when the value is None
+def set_setting(project_path, key, value):
     settings_path = os.path.join(project_path, projectFiles["settings"])
     with open(settings_path, "r") as file:
         settings = json.load(file)
-    settings["EXTRA_CFLAGS"] = make_flags
+    if value is None:
+        settings.pop(key, None)
+    else:
+        settings[key] = value
     with open(settings_path, "w") as file:
         json.dump(settings, file, indent=4)
 
+# Get EXTRA_CFLAGS for a project or return empty string
+def get_flags(project_path):
+    return get_setting(project_path, "EXTRA_CFLAGS", "")
+
+# Set EXTRA_CFLAGS for a project
+def set_flags(project_path, make_flags):
+    set_setting(project_path, "EXTRA_CFLAGS", make_flags)
+
 # Wrapper for [create]
 def create_command(args):
     try:
@@ -232,6 +245,67 @@ def flags_command(args):
 
     set_flags(project, make_flags)
 
+# Set a setting from the arguments of a command, in the project that follows the
+# value or the current directory
+def setting_command(args, key, value):
+    try:
+        project = os.path.abspath(args[3])
+    except IndexError:
+        project = os.getcwd()
+
+    set_setting(project, key, value)
+
+# Parse the on or off argument of a command
+def parse_state(args):
+    states = {"on": True, "off": False}
+    try:
+        return states[args[2]]
+    except IndexError as error:
+        raise UserError("You must specify on or off!") from error
+    except KeyError as error:
+        raise UserError("Invalid state! States are: on, off") from error
+
+# Wrapper for [jobs]
+def jobs_command(args):
+    try:
+        jobs = parse_jobs(args[2])
+    except IndexError as error:
+        raise UserError("You must provide a number of jobs or auto!") from error
+    setting_command(args, "MAKE_JOBS", jobs)
+
+# Wrapper for [pch]. Off is stored so a project can opt out of NEOPO_PCH.
+def precompiled_command(args):
+    setting_command(args, "PRECOMPILED_HEADER", parse_state(args))
+
+# Wrapper for [unity]
+def unity_command(args):
+    try:
+        state = args[2]
+    except IndexError as error:
+        raise UserError("You must specify on, off or a batch size!") from error
+    if state in ("on", "off"):
+        batch_size = DEFAULT_BATCH if state == "on" else None
+    elif state.isdigit() and int(state) > 1:
+        batch_size = int(state)
+    else:
+        raise UserError("Invalid batch size: %s" % state)
+    setting_command(args, "UNITY_BATCH", batch_size)
+
+# Wrapper for [scratch]
+def scratch_command(args):
+    try:
+        scratch = args[2]
+    except IndexError as error:
+        raise UserError("You must specify a directory, auto or off!") from error
+    if scratch not in ("auto", "off"):
+        scratch = os.path.abspath(os.path.expanduser(scratch))
+    # Off is stored so a project can opt out of NEOPO_SCRATCH
+    setting_command(args, "BUILD_SCRATCH", False if scratch == "off" else scratch)
+
+# Wrapper for [shared-libs]. Off is stored so a project can opt out of NEOPO_SHARED_LIBS.
+def shared_libraries_command(args):
+    setting_command(args, "SHARED_LIBRARIES", parse_state(args))
+
 # Wrapper for [settings]
 def settings_command(args):
     try:
@@ -242,6 +316,16 @@ def settings_command(args):
         print("platform: %s" % settings[0])
         print("version: %s" % settings[1])
         print("EXTRA_CFLAGS: %s" % (flags if flags else "<not set>"))
+        jobs = get_setting(project_path, "MAKE_JOBS")
+        print("jobs: %s" % (jobs if jobs else "auto (%d)" % automatic_jobs()))
+        precompiled = get_setting(project_path, "PRECOMPILED_HEADER", NEOPO_PCH)
+        print("precompiled header: %s" % ("on" if precompiled else "off"))
+        unity = get_setting(project_path, "UNITY_BATCH")
+        print("unity build: %s" % ("batches of %d" % unity if unity else "off"))
+        scratch = get_setting(project_path, "BUILD_SCRATCH", NEOPO_SCRATCH)
+        print("scratch: %s" % (scratch if scratch else "off"))
+        shared = get_setting(project_path, "SHARED_LIBRARIES", NEOPO_SHARED_LIBS)
+        print("shared libraries: %s" % ("on" if shared else "off"))
     except FileNotFoundError as error:
         raise UserError("%s is not a Particle project!" %
                         project_path) from error
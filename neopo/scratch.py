@@ -0,0 +1,24 @@
+import os
+import hashlib
+import tempfile
+
+# Local imports
+from .outputs import configuration_key
+
+# Scratch directory used for "auto", in memory where the system has a tmpfs for it
+SHARED_MEMORY = "/dev/shm"
+
+# Directory holding the build trees of every project on a scratch path
+def scratch_root(value):
+    if value == "auto":
+        base = SHARED_MEMORY if os.path.isdir(SHARED_MEMORY) and os.access(SHARED_MEMORY, os.W_OK) \
+            else tempfile.gettempdir()
+        return os.path.join(base, "neopo-%s" % getattr(os, "getuid", lambda: "build")())
+    return os.path.abspath(os.path.expanduser(value))
+
+# Directory on a scratch path holding the build tree of a project for a configuration.
+# It is kept between builds, so only a cleared tmpfs makes the next build start over.
+def scratch_path(root, project_path, configuration):
+    digest = hashlib.sha256(project_path.encode("utf-8")).hexdigest()[:12]
+    return os.path.join(root, "%s-%s" % (os.path.basename(project_path), digest),
+                        configuration_key(configuration))
@@ -0,0 +1,95 @@
+import os
+import json
+import string
+import hashlib
+import pathlib
+import threading
+
+# Local imports
+from .common import ARCHIVE_DIR, ARCHIVE_LIMIT
+
+# Maps download URLs to the sha256 of the archive they served
+INDEX_FILE = os.path.join(ARCHIVE_DIR, "index.json")
+
+# Guards the index when dependencies are installed in parallel
+index_lock = threading.Lock()
+
+# Check whether the archive store is in use
+def store_enabled():
+    return ARCHIVE_LIMIT > 0
+
+# Check that a manifest hash can be used as a store key ("SKIP" can not)
+def valid_hash(sha256):
+    return len(sha256) == 64 and all(char in string.hexdigits for char in sha256)
+
+# Path of the archive with a given sha256
+def archive_path(sha256):
+    return os.path.join(ARCHIVE_DIR, sha256[:2], "%s.tar.gz" % sha256)
+
+# Load the URL index of the store
+def load_index():
+    try:
+        with open(INDEX_FILE, "r") as file:
+            return json.load(file)
+    except (FileNotFoundError, json.decoder.JSONDecodeError):
+        return {}
+
+# Replace the URL index of the store atomically
+def write_index(index):
+    temp = INDEX_FILE + ".tmp%d" % threading.get_ident()
+    with open(temp, "w") as file:
+        json.dump(index, file, indent=4)
+    os.replace(temp, INDEX_FILE)
+
+# Find the sha256 of a stored archive for a dependency, or None
+def lookup_archive(dep):
+    if not store_enabled():
+        return None
+    sha256 = dep["sha256"]
+    # Unlisted dependencies have no hash, so find them by URL instead
+    if not valid_hash(sha256):
+        sha256 = load_index().get(dep["url"])
+    if not sha256 or not os.path.isfile(archive_path(sha256)):
+        return None
+    # Mark as recently used
+    os.utime(archive_path(sha256))
+    return sha256
+
+# Path where an interrupted download of a URL is kept until it can be resumed
+def partial_path(url):
+    name = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    return os.path.join(ARCHIVE_DIR, "partial", "%s.partial" % name)
+
+# Move a completed download into the store under its sha256
+def add_archive(partial, sha256, url):
+    path = archive_path(sha256)
+    pathlib.Path(os.path.dirname(path)).mkdir(parents=True, exist_ok=True)
+    os.replace(partial, path)
+    with index_lock:
+        index = load_index()
+        index[url] = sha256
+        write_index(index)
+    evict_archives()
+
+# Delete an archive from the store (corrupt or no longer wanted)
+def remove_archive(sha256):
+    path = archive_path(sha256)
+    if os.path.isfile(path):
+        os.remove(path)
+
+# Delete least recently used archives until the store fits within its limit
+def evict_archives(limit=ARCHIVE_LIMIT):
+    archives = []
+    for root, _, files in os.walk(ARCHIVE_DIR):
+        for file in files:
+            if file.endswith(".tar.gz"):
+                path = os.path.join(root, file)
+                stat = os.stat(path)
+                archives.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in archives)
+    for _, size, path in sorted(archives):
+        if total <= limit:
+            break
+        os.remove(path)
+        total -= size
@@ -1,59 +1,41 @@
 import os
-import json
 import shutil
-import platform
 import subprocess
 
 # Local imports
-from .common import NEOPO_PARALLEL, jsonFiles, PARTICLE_DEPS, DependencyError, UserError
-from .workbench import download_dep, attempt_download
-from .workbench import INSTALL_RECEIPT, fix_gcc_arm, install_receipt, parallel_handler
+from .common import PARTICLE_DEPS, DependencyError, UserError
+from .catalog import get_catalog
+from .completion import write_completion_index
+from .workbench import attempt_download
+from .workbench import INSTALL_RECEIPT, fix_gcc_arm, install_receipt, install_deps
 
 # Attempt to get custom toolchain data from .workbench/manifest.json
 def get_custom_toolchain(firmware_version, component="toolchains", all_items=False):
-    firmware_path = get_firmware_path(firmware_version)
-    custom_manifest = os.path.join(firmware_path, ".workbench", "manifest.json")
-    if os.path.isfile(custom_manifest):
-        with open(custom_manifest) as file:
-            data = json.load(file)
-            toolchain = data[component]
-            return toolchain if all_items else toolchain[0]
+    custom = get_catalog().custom_manifest(get_firmware_path(firmware_version))
+    if custom:
+        toolchain = custom[0][component]
+        return toolchain if all_items else toolchain[0]
     return None
 
 # Get a deviceOS dependency from a version
 def get_firmware_data(version):
-    with open(jsonFiles["firmware"], "r") as firmware:
-        for entry in json.load(firmware):
-            if entry["version"] == version:
-                return entry
-        return False
+    return get_catalog().firmware(version) or False
 
 # Convert between platform IDs and device names
 def platform_convert(data, key1, key2, custom_version=None):
     # Custom manifest
     if custom_version:
-        platforms = get_custom_toolchain(custom_version, "platforms", True)
-        if platforms:
-            for device in platforms:
-                if device[key1] == data:
-                    return device[key2]
-        return False
+        custom = get_catalog().custom_manifest(get_firmware_path(custom_version))
+        device = custom[1][key1].get(data) if custom else None
+        return device[key2] if device else False
 
     # Official manifest
-    with open(jsonFiles["platforms"], "r") as platforms:
-        for device in json.load(platforms):
-            if device[key1] == data:
-                return device[key2]
-        return False
+    device = get_catalog().platform(key1, data)
+    return device[key2] if device else False
 
 # List the supported platform IDs for a given version
 def get_supported_platforms(version):
-    with open(jsonFiles["toolchains"], "r") as toolchains:
-        for toolchain in json.load(toolchains):
-            if toolchain["firmware"] == "deviceOS@%s" % version:
-                return toolchain["platforms"]
-
-    toolchain = get_custom_toolchain(version)
+    toolchain = get_catalog().toolchain(version) or get_custom_toolchain(version)
     return toolchain["platforms"] if toolchain else False
 
 # Verify platform and deviceOS version and download deviceOS dependency if required
@@ -93,14 +75,12 @@ def get_compiler(firmware_version):
 # Print available versions and platforms
 def versions_command(args):
     official_versions = set()
-    with open(jsonFiles["firmware"], "r") as firmware_file:
-        print("Available deviceOS versions:\n")
-        for entry in reversed(json.load(firmware_file)):
-            version = entry["version"]
-            official_versions.add(version)
-            devices = ", ".join([platform_convert(platform, "id", "name")
-                                 for platform in get_supported_platforms(version)])
-            print("   %s\t [ %s ]" % (version, devices))
+    print("Available deviceOS versions:\n")
+    for version in reversed(get_catalog().firmware_versions()):
+        official_versions.add(version)
+        devices = ", ".join([platform_convert(platform, "id", "name")
+                             for platform in get_supported_platforms(version)])
+        print("   %s\t [ %s ]" % (version, devices))
 
     custom_versions = None
     device_os_path = os.path.join(PARTICLE_DEPS, "deviceOS")
@@ -132,13 +112,7 @@ def get_command(args):
 # Given a deviceOS version, get a dictionary of deps and versions
 def get_firmware_deps(version):
     keys = ["compilers", "tools", "scripts", "debuggers"]
-    with open(jsonFiles["toolchains"]) as toolchains:
-        data = json.load(toolchains)
-        for toolchain in data:
-            if toolchain["firmware"] == "deviceOS@%s" % version:
-                return {toolchain[key].split("@")[0]:toolchain[key].split("@")[1] for key in keys}
-
-    toolchain = get_custom_toolchain(version)
+    toolchain = get_catalog().toolchain(version) or get_custom_toolchain(version)
     if toolchain:
         return {toolchain[key].split("@")[0]:toolchain[key].split("@")[1] for key in keys}
     raise DependencyError("Invalid firmware version!")
@@ -158,41 +132,36 @@ def check_deps_installed(deps_dict):
 
 # Get the dependency data for a specified dep and version
 def get_dep_data(dep, version):
-    system = platform.system().lower()
-    lookup = {
-        "gcc-arm": jsonFiles["compilers"], "buildtools": jsonFiles["tools"],
-        "buildscripts": jsonFiles["scripts"], "openocd": jsonFiles["debuggers"]}
-    try:
-        with open(lookup[dep]) as file:
-            dep_file = json.load(file)
-            section = dep_file[system]["x64"]
-            dep_full = [x for x in section if x["version"] == version][0]
-            if dep == "gcc-arm":
-                fix_gcc_arm(dep_full)
-            return dep_full
-    except IndexError as error:
-        raise DependencyError("Invalid dependency %s@%s!" % (dep, version)) from error
+    dep_full = get_catalog().dependency(dep, version)
+    if not dep_full:
+        raise DependencyError("Invalid dependency %s@%s!" % (dep, version))
+    # Copy so the cached entry is not patched
+    dep_full = dict(dep_full)
+    if dep == "gcc-arm":
+        fix_gcc_arm(dep_full)
+    return dep_full
 
 # Install specified dependencies
 def install_firmware_deps(deps_dict):
-    if NEOPO_PARALLEL:
-        deps = [get_dep_data(dep, version) for (dep, version) in deps_dict.items()]
-        parallel_handler(deps)
-    else:
-        for (dep, version) in deps_dict.items():
-            download_dep(get_dep_data(dep, version), False, True)
+    install_deps([get_dep_data(dep, version) for (dep, version) in deps_dict.items()], False)
+
+# Dependencies that must be installed to use a deviceOS version, including itself
+def missing_firmware_deps(version):
+    missing_deps = check_deps_installed(get_firmware_deps(version))
+    deps = [get_dep_data(dep, dep_version) for (dep, dep_version) in missing_deps.items()]
+
+    # The firmware is installed alongside its dependencies
+    if check_deps_installed({"deviceOS":version}):
+        firmware = get_firmware_data(version)
+        if firmware:
+            deps.append(firmware)
+        else:
+            print("Could not download deviceOS version %s!" % version)
+    return deps
 
 # Download a specific deviceOS version (along with any of its dependencies)
 def download_firmware(version):
-    deps = get_firmware_deps(version)
-    # deps.append(get_firmware_data(version)) #?
-    missing_deps = check_deps_installed(deps)
-    if missing_deps:
-        install_firmware_deps(missing_deps)
-    if not check_deps_installed({"deviceOS":version}):
-        return
-    if not download_dep(get_firmware_data(version), False, True):
-        print("Could not download deviceOS version %s!" % version)
+    install_deps(missing_firmware_deps(version), False)
 
 # Clone a specific tag (version) from the device-os repo
 def clone_tag_from_git(version):
@@ -232,6 +201,7 @@ def download_unlisted(version, skip_mirror=False):
         # Try to download from github
         print("Trying to clone v%s from GitHub..." % version)
         clone_tag_from_git(version)
+    write_completion_index()
 
 # Wrapper for [download-unlisted]
 def download_unlisted_command(args):
@@ -263,6 +233,7 @@ def remove_firmware(version):
         answer = input("Do you want to remove this dependency? [Y/n]: ")
         if answer.lower() == "y":
             shutil.rmtree(dep_path)
+            write_completion_index()
             print("Removed deviceOS@%s." % version)
         else:
             print("Aborted.")
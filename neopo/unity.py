@@ -0,0 +1,175 @@
+import os
+import json
+import shutil
+
+# Local imports
+from .precompiled import includes_particle_first
+
+# Directory inside the output directory of a configuration holding the staged project,
+# named like the project since the buildscripts name the binary after its directory
+UNITY_DIR = "unity"
+
+# Sources compiled on their own because they failed to compile in a batch
+ISOLATED_FILE = ".neopo-unity.json"
+
+# Batch size used when unity builds are enabled without one
+DEFAULT_BATCH = 8
+
+# Sources that are batched together
+BATCHED_EXTENSIONS = (".cpp",)
+
+# Sources that are compiled into objects
+COMPILED_EXTENSIONS = (".c", ".cpp", ".S")
+
+# Top level project directories that are not staged
+SKIPPED_DIRS = ["target", "bin"]
+
+# Files copied from the staged output directory back to the real one
+ARTIFACT_EXTENSIONS = (".bin", ".elf", ".map", ".hex", ".lst")
+
+# Sources whose batch failed to compile, with their modification times then
+def read_isolated(staging):
+    try:
+        with open(os.path.join(staging, ISOLATED_FILE), "r") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+def write_isolated(staging, isolated):
+    os.makedirs(staging, exist_ok=True)
+    with open(os.path.join(staging, ISOLATED_FILE), "w") as file:
+        json.dump(isolated, file, indent=4)
+
+# Check whether the sources of a directory are batched (src and library sources)
+def batched_directory(relative):
+    parts = relative.split(os.sep)
+    return parts[0] == "src" or (len(parts) >= 3 and parts[0] == "lib" and parts[2] == "src")
+
+# Name of a batch, unique in the project so its object file can be found
+def unit_name(relative, index):
+    return "unity_%s_%d.cpp" % (relative.replace(os.sep, "_").replace(".", "_"), index)
+
+# Contents of a batch. Sources are included by absolute path so their own includes
+# resolve from their real directory. Particle.h goes first when every source starts
+# with it, so a precompiled header can be used for the batch.
+def unit_contents(sources):
+    lines = ["// Generated by neopo for a unity build, do not edit"]
+    if all(includes_particle_first(source) for source in sources):
+        lines.append('#include "Particle.h"')
+    lines.extend('#include "%s"' % source.replace("\\", "/") for source in sources)
+    return "\n".join(lines) + "\n"
+
+# Plan the staged project: the files to link to the project and the batches to
+# generate, as a dictionary of relative paths to ("link", path) or ("unit", sources)
+def plan_staging(project_path, batch_size, isolated):
+    plan = {}
+    for root, dirs, files in os.walk(project_path):
+        relative = os.path.relpath(root, project_path)
+        dirs[:] = sorted(name for name in dirs if not name.startswith(".")
+                         and not (root == project_path and name in SKIPPED_DIRS))
+        batched = []
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            if relative != "." and batched_directory(relative) and name.endswith(BATCHED_EXTENSIONS) \
+                    and isolated.get(path) != os.stat(path).st_mtime_ns:
+                batched.append(path)
+            else:
+                plan[os.path.normpath(os.path.join(relative, name))] = ("link", path)
+        for index in range(0, len(batched), batch_size):
+            sources = batched[index:index + batch_size]
+            if len(sources) == 1:
+                plan[os.path.join(relative, os.path.basename(sources[0]))] = ("link", sources[0])
+            else:
+                plan[os.path.join(relative, unit_name(relative, index // batch_size))] = ("unit", sources)
+    return plan
+
+# Bring the staged project in line with the plan, only touching files that changed
+# so make rebuilds no more than it would in the project itself
+def stage_project(project_path, staging, batch_size):
+    isolated = read_isolated(staging)
+    plan = plan_staging(project_path, batch_size, isolated)
+
+    # Remove files that are no longer part of the project
+    for root, dirs, files in os.walk(staging, topdown=False):
+        relative = os.path.relpath(root, staging)
+        if relative.split(os.sep)[0] in SKIPPED_DIRS:
+            continue
+        for name in files:
+            path = os.path.normpath(os.path.join(relative, name))
+            if path not in plan and path != ISOLATED_FILE:
+                os.remove(os.path.join(root, name))
+        if root != staging and not os.listdir(root):
+            os.rmdir(root)
+
+    for relative, (kind, value) in plan.items():
+        path = os.path.join(staging, relative)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if kind == "link":
+            if os.path.islink(path) and os.readlink(path) == value:
+                continue
+            if os.path.lexists(path):
+                os.remove(path)
+            os.symlink(value, path)
+            continue
+
+        contents = unit_contents(value)
+        try:
+            with open(path, "r") as file:
+                current = None if os.path.islink(path) else file.read()
+        except OSError:
+            current = None
+        if current != contents:
+            if os.path.lexists(path):
+                os.remove(path)
+            with open(path, "w") as file:
+                file.write(contents)
+
+        # A batch is as new as its newest source, for makefiles without dependency files
+        newest = max(os.stat(source).st_mtime_ns for source in value)
+        if os.stat(path).st_mtime_ns < newest:
+            os.utime(path, ns=(newest, newest))
+    return plan
+
+# Compile the sources of batches that failed on their own from now on. Pending holds
+# the names of the sources make would still compile after the failed run, which are
+# the batches that did not compile, whatever the age of their old objects. Returns
+# False if no batch failed, in which case the error is not caused by batching.
+def isolate_failed(staging, plan, pending):
+    isolated = read_isolated(staging)
+    failed = []
+    for relative, (kind, sources) in plan.items():
+        if kind != "unit":
+            continue
+        if os.path.basename(relative) in pending:
+            failed.extend(sources)
+    if not failed:
+        return False
+    print("Compiling %d sources that failed in a batch on their own:" % len(failed))
+    for source in failed:
+        print("    %s" % source)
+        isolated[source] = os.stat(source).st_mtime_ns
+    write_isolated(staging, isolated)
+    return True
+
+# Copy the binaries of a staged build to the output directory of the project
+def copy_artifacts(project_path, staging, output_path):
+    staged_output = os.path.join(staging, os.path.relpath(output_path, project_path))
+    for name in os.listdir(staged_output) if os.path.isdir(staged_output) else []:
+        if name.endswith(ARTIFACT_EXTENSIONS):
+            shutil.copy2(os.path.join(staged_output, name), os.path.join(output_path, name))
+
+# Number of objects compiled from the sources of a plan
+def count_objects(plan):
+    return sum(1 for relative, (kind, _) in plan.items() if kind == "unit" or (
+        os.path.dirname(relative) and batched_directory(os.path.dirname(relative))
+        and relative.endswith(COMPILED_EXTENSIONS)))
+
+# Time spent linking the last build, from the newest object or library in the
+# directories to the .elf
+def link_time(paths, elf):
+    inputs = [os.path.join(root, name) for path in paths if path for root, _, files in os.walk(path)
+              for name in files if name.endswith((".o", ".a"))]
+    if not os.path.isfile(elf) or not inputs:
+        return None
+    newest = max(os.path.getmtime(path) for path in inputs)
+    return max(0.0, os.path.getmtime(elf) - newest)
@@ -1,12 +1,11 @@
 import os
 import sys
 import stat
+import shutil
 import subprocess
 import traceback
 
 import io
-import urllib.request
-import tarfile
 import pathlib
 import xml.etree.ElementTree as ET
 
@@ -14,6 +13,10 @@ import xml.etree.ElementTree as ET
 from .common import particle_cli, running_on_windows, ProcessError
 from .common import PARTICLE_DEPS, NEOPO_DEPS, CACHE_DIR, min_particle_env
 from .common import s3_bucket, s3_prefix
+from .download import ResumableStream, stream_extract
+from .network import request
+from .store import partial_path
+from .libstore import record_library
 
 from .help_info import get_help
 
@@ -40,9 +43,7 @@ def check_login():
     return True
 
 def search(lib_query):
-    request = urllib.request.Request(
-        s3_bucket + s3_prefix + lib_query)
-    with urllib.request.urlopen(request) as response:
+    with request(s3_bucket + s3_prefix + lib_query, compressed=True) as response:
         content = response.read()
         return io.BytesIO(content)
 
@@ -67,20 +68,22 @@ def install_library(name, version, project_path):
     library_url = s3_bucket + lib
     print("Downloading library %s@%s..." % (name, version))
     download_library_archive(library_url, name, project_path)
+    record_library(os.path.join(project_path, "lib", name), name, version)
 
 def download_library_archive(url, name, project_path):
-    base = os.path.join(project_path, "lib")
-    path = os.path.join(base, name)
-    archive = os.path.join(base, name + ".tar.gz")
+    path = os.path.join(project_path, "lib", name)
     pathlib.Path(path).mkdir(parents=True, exist_ok=True)
-    request = urllib.request.Request(url)
-    with urllib.request.urlopen(request) as response:
-        content = response.read()
-    with open(archive, "wb") as gz_file:
-        gz_file.write(content)
-    with tarfile.open(archive, "r:gz") as tar:
-        tar.extractall(path)
-    os.remove(archive)
+    partial = partial_path(url)
+    try:
+        with ResumableStream(url, partial) as stream:
+            stream_extract(stream, path)
+    except BaseException:
+        # Start over next time instead of replaying a prefix that can not be extracted
+        shutil.rmtree(path, ignore_errors=True)
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    os.remove(partial)
 
 def download_library(library, project_path):
     name, version = library
@@ -115,6 +118,14 @@ Refer to the manual for more detailed help:
 
   Build Commands:
       compile | build [project] [-v/q]  # Compile application (local)
+                      [--force]         # even if it is up to date
+                      [-j <jobs>]       # with a number of make jobs
+      build-all [dir...] [-v/q]         # Compile projects concurrently
+      matrix [project] --platforms <list> --versions <list>
+                                        # Compile for many configurations
+      watch [project] [target] [-v/q]   # Rebuild when files change
+      check [project] [-j <jobs>]       # Check syntax of all sources
+      test [project] [--sources <list>] # Run tests on this computer
       flash [project] [-v/q]            # Flash application (local)
       flash-all [project] [-v/q]        # Flash application and DeviceOS
       clean [project] [-v/q]            # Clean application
@@ -125,15 +136,25 @@ Refer to the manual for more detailed help:
       run <target> [project] [-v/q]             # Run a makefile target
       export <target> [project] [-v/q]          # Export target to a script
       flags <string> [project]                  # Set EXTRA_CFLAGS in a project 
+      jobs <number/auto> [project]              # Set make jobs in a project
+      pch <on/off> [project]                    # Precompile Particle.h in a project
+      unity <on/off/size> [project]             # Compile sources in batches
+      scratch <dir/auto/off> [project]          # Build in a scratch directory
+      shared-libs <on/off> [project]            # Share compiled libraries
       settings [project]                        # View configured settings
       libs [project]                            # Install Particle libraries
 
   Special Commands:
       bootloader <platform> <version> [-v/-q]   # Flash device bootloader
+      warm <platform> <version> [-v/-q]         # Prebuild Device OS libraries
       iterate <command> [OPTIONS] [-v/q]        # Put devices into DFU mode
                                                 # and run commands on them
       legacy <command>                          # Put legacy devices into
                                                 # serial or DFU mode
+      cache <stats/clear>                       # Manage the compiler cache
+      outputs <list/prune> [project]            # Manage build outputs
+      library-store <list/clear>                # Manage shared libraries
+      daemon <start/stop/status>                # Manage the build daemon
   Script Commands:
       script [file]       # Execute a script or read a script from stdin
       print [message]     # Print a message to the console
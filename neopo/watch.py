@@ -0,0 +1,241 @@
+import os
+import sys
+import time
+import select
+import struct
+import threading
+
+# Local imports
+from .common import UserError, projectFiles
+from .build import prepare_build, run_build
+from .jobs import split_jobs_option
+
+# Seconds without further changes before a burst of saves starts a build
+DEBOUNCE = 0.3
+
+# Seconds between scans of the project when inotify is not available
+POLL_INTERVAL = 0.5
+
+# Project directories whose contents are watched recursively
+SOURCE_DIRS = ["src", "lib"]
+
+# inotify constants from <sys/inotify.h>
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT_HEADER = struct.Struct("iIII")
+
+# Files outside the source directories that change the build settings
+def settings_files(project_path):
+    return [os.path.join(project_path, projectFiles["properties"]),
+            os.path.join(project_path, projectFiles["settings"])]
+
+# Check whether a changed path affects the build. Hidden files and editor backups are ignored.
+def relevant_change(project_path, path):
+    if path in settings_files(project_path):
+        return True
+    relative = os.path.relpath(path, project_path).split(os.sep)
+    if relative[0] not in SOURCE_DIRS:
+        return False
+    name = relative[-1]
+    return not (name.startswith(".") or name.endswith("~") or name.endswith(".swp"))
+
+# Watch a project with inotify, which reports changes as they happen
+class InotifyWatcher:
+    def __init__(self, project_path):
+        import ctypes
+        import ctypes.util
+        self.project_path = project_path
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "Failed to initialize inotify")
+        self.watches = {}
+        self.add(project_path)
+        self.add(os.path.dirname(settings_files(project_path)[1]))
+        for directory in SOURCE_DIRS:
+            self.add_tree(os.path.join(project_path, directory))
+
+    # Watch a single directory
+    def add(self, path):
+        if os.path.isdir(path):
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+            if wd >= 0:
+                self.watches[wd] = path
+
+    # Watch a directory and every directory below it
+    def add_tree(self, path):
+        for root, dirs, _ in os.walk(path):
+            dirs[:] = [name for name in dirs if not name.startswith(".")]
+            self.add(root)
+
+    # Paths that changed within a timeout in seconds (None waits forever)
+    def changes(self, timeout):
+        changed = set()
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return changed
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return changed
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b"\0")
+            offset += EVENT_HEADER.size + length
+            if wd not in self.watches:
+                continue
+            path = os.path.join(self.watches[wd], os.fsdecode(name))
+
+            # New directories (src, lib, or below them) are watched too
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO) and relevant_change(self.project_path, path):
+                self.add_tree(path)
+            changed.add(path)
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+# Watch a project by comparing modification times, where inotify is not available
+class PollingWatcher:
+    def __init__(self, project_path):
+        self.project_path = project_path
+        self.snapshot = self.scan()
+
+    # Modification time and size of every watched file
+    def scan(self):
+        files = {}
+        paths = settings_files(self.project_path)
+        for directory in SOURCE_DIRS:
+            for root, dirs, names in os.walk(os.path.join(self.project_path, directory)):
+                dirs[:] = [name for name in dirs if not name.startswith(".")]
+                paths.extend(os.path.join(root, name) for name in names)
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files[path] = (stat.st_mtime_ns, stat.st_size)
+        return files
+
+    # Paths that changed within a timeout in seconds (None waits forever)
+    def changes(self, timeout):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            time.sleep(POLL_INTERVAL if deadline is None else max(0, min(POLL_INTERVAL, deadline - time.monotonic())))
+            snapshot = self.scan()
+            changed = {path for path in set(snapshot) | set(self.snapshot)
+                       if snapshot.get(path) != self.snapshot.get(path)}
+            self.snapshot = snapshot
+            if changed or (deadline is not None and time.monotonic() >= deadline):
+                return changed
+
+    def close(self):
+        pass
+
+# Use inotify on Linux and fall back to polling elsewhere
+def project_watcher(project_path):
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(project_path)
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(project_path)
+
+# Wait for relevant changes and return them once a burst of changes is over
+def wait_for_changes(watcher, project_path):
+    changed = set()
+    while not changed:
+        changed = {path for path in watcher.changes(None) if relevant_change(project_path, path)}
+    while True:
+        more = watcher.changes(DEBOUNCE)
+        if not more:
+            return changed
+        changed.update(path for path in more if relevant_change(project_path, path))
+
+# Run a build, and flash the binary afterwards if it changed
+def watch_build(build, flash, cancel):
+    start = time.monotonic()
+    artifact = build.get("artifact")
+    before = os.path.getmtime(artifact) if artifact and os.path.isfile(artifact) else None
+    try:
+        if run_build(build, False, cancel) is None and cancel.is_set():
+            return
+        changed = artifact and os.path.isfile(artifact) and os.path.getmtime(artifact) != before
+        if flash and build["command"] == "compile-user" and changed:
+            flash_build = dict(build, command="flash-user", process=build["process"][:-1] + ["flash-user"])
+            if run_build(flash_build, False, cancel) is None and cancel.is_set():
+                return
+        print("Finished %s in %.1fs. Waiting for changes..." % (build["command"], time.monotonic() - start))
+    except RuntimeError as error:
+        print(error)
+        print("Waiting for changes...")
+
+# Rebuild a project whenever its sources change. The build environment is resolved
+# once and again only when project.properties or the settings change. A build that
+# is still running when more changes arrive is cancelled and started over.
+def watch_project(project_path, command="compile-user", verbosity=0, flash=False, jobs=None):
+    build = prepare_build(project_path, command, False, verbosity, jobs=jobs)
+    watcher = project_watcher(project_path)
+    print("Watching %s with %s. Press Ctrl+C to stop." % (
+        project_path, "inotify" if isinstance(watcher, InotifyWatcher) else "polling"))
+
+    cancel = threading.Event()
+    worker = threading.Thread(target=watch_build, args=(build, flash, cancel), daemon=True)
+    worker.start()
+    try:
+        while True:
+            changed = wait_for_changes(watcher, project_path)
+            if worker.is_alive():
+                cancel.set()
+                worker.join()
+                print("Cancelled the previous build.")
+            print("Changed: %s" % ", ".join(sorted(os.path.relpath(path, project_path) for path in changed)))
+
+            if build is None or any(path in settings_files(project_path) for path in changed):
+                try:
+                    build = prepare_build(project_path, command, False, verbosity, jobs=jobs)
+                except (RuntimeError, OSError) as error:
+                    build = None
+                    print(error)
+                    print("Waiting for changes...")
+                    continue
+
+            cancel = threading.Event()
+            worker = threading.Thread(target=watch_build, args=(build, flash, cancel), daemon=True)
+            worker.start()
+    except KeyboardInterrupt:
+        cancel.set()
+        worker.join()
+        print()
+    finally:
+        watcher.close()
+
+# Wrapper for [watch]
+def watch_command(args):
+    verbosity_dict = {"-v": 1, "-q": -1}
+    flash = "--flash" in args
+    jobs, args = split_jobs_option([arg for arg in args[2:] if arg != "--flash"])
+    verbosity = 0
+    positional = []
+    for arg in args:
+        if arg in verbosity_dict:
+            verbosity = verbosity_dict[arg]
+        elif arg.startswith("-"):
+            raise UserError("Invalid option: %s" % arg)
+        else:
+            positional.append(arg)
+    if len(positional) > 2:
+        raise UserError("Too many arguments!")
+
+    project = os.path.abspath(positional[0]) if positional else os.getcwd()
+    command = positional[1] if len(positional) > 1 else "compile-user"
+    watch_project(project, command, verbosity, flash, jobs)
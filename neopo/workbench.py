@@ -5,21 +5,28 @@ import time
 import shutil
 import zipfile
 import tarfile
-import hashlib
 import pathlib
 import platform
+import threading
+import contextlib
 import subprocess
-import urllib.request
-
-# Experimental
+import http.client
+import urllib.error
 import concurrent.futures
 
 # Local imports
 from .common import DependencyError
-from .common import HOME_DIR, PARTICLE_DEPS, CACHE_DIR, ARM_GCC_ARM, NEOPO_PARALLEL
+from .common import HOME_DIR, PARTICLE_DEPS, CACHE_DIR, ARM_GCC_ARM, NEOPO_DOWNLOADS, NEOPO_EXTRACTS
 from .common import extensionFiles, vscodeFiles, jsonFiles
 from .common import particle_cli, running_on_windows
 from .utility import write_file, write_executable
+from .network import request
+from .catalog import reset_catalog
+from .completion import write_completion_index
+from .download import ResumableStream, stream_extract, create_staging, commit_staging, discard_staging
+from .download import install_lock
+from .store import store_enabled, valid_hash, archive_path, lookup_archive, remove_archive
+from .store import partial_path, add_archive
 from .manifest import write_manifest, create_manifest, get_manifest_value
 
 INSTALL_RECEIPT=".particle-install-receipt"
@@ -31,16 +38,14 @@ def get_extension_url(extension_name=WORKBENCH_EXTENSION):
         print("Finding Workbench extension URL...")
     payload = '{"assetTypes":null,"filters":[{"criteria":[{"filterType":7,"value":"%s"}],"direction":2,"pageSize":100,"pageNumber":1,"sortBy":0,"sortOrder":0,"pagingToken":null}],"flags":103}' % extension_name
 
-    request = urllib.request.Request(
-        "https://marketplace.visualstudio.com/_apis/public/gallery/extensionquery",
-        method="POST",
-        headers={
-            "content-type": "application/json",
-            "accept": "application/json;api-version=6.0-preview.1;excludeUrls=true",
-        }, data=payload.encode("utf-8"))
-
     try:
-        with urllib.request.urlopen(request) as response:
+        with request(
+            "https://marketplace.visualstudio.com/_apis/public/gallery/extensionquery",
+            method="POST",
+            headers={
+                "content-type": "application/json",
+                "accept": "application/json;api-version=6.0-preview.1;excludeUrls=true",
+            }, data=payload.encode("utf-8"), compressed=True) as response:
             content = response.read()
     except urllib.error.URLError as error:
         raise DependencyError("Failed to get extension URL!") from error
@@ -53,7 +58,7 @@ def get_extension_url(extension_name=WORKBENCH_EXTENSION):
 def get_extension(url):
     print("Downloading Workbench extension...")
     try:
-        with urllib.request.urlopen(url) as response:
+        with request(url) as response:
             content = response.read()
     except urllib.error.URLError as error:
         raise DependencyError("Failed to download extension!") from error
@@ -63,47 +68,121 @@ def get_extension(url):
 def get_file(file, path):
     return file.read(path)
 
-# Experimental
-def parallel_handler(deps, update_manifest=True):
-    if not deps or not isinstance(deps, list):
+# Install dependencies concurrently, updating the manifest only for those that succeed
+def install_deps(deps, update_manifest=True):
+    deps = [dep for dep in deps if dep]
+    if not deps:
         return
 
     # Ensure that installation directory exists
     pathlib.Path(PARTICLE_DEPS).mkdir(parents=True, exist_ok=True)
 
-    # Download dependencies in parallel
-    with concurrent.futures.ThreadPoolExecutor() as exector:
-        exector.map(parallel_download_dep, deps)
+    # Every install holds an extraction slot, and downloads also a network slot
+    network = threading.BoundedSemaphore(NEOPO_DOWNLOADS)
+    extraction = threading.BoundedSemaphore(NEOPO_EXTRACTS)
+
+    failed = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(deps)) as executor:
+        futures = {executor.submit(install_dep, dep, network, extraction): dep for dep in deps}
+        for future in concurrent.futures.as_completed(futures):
+            dep = futures[future]
+            try:
+                future.result()
+            except Exception as error:
+                print("%s@%s: %s" % (dep["name"], dep["version"], error))
+                failed.append(dep)
+                continue
+            if update_manifest:
+                create_manifest()
+                write_manifest(dep)
+    write_completion_index()
+
+    if failed:
+        raise DependencyError("Failed to install %s!" % ", ".join(
+            ["%s@%s" % (dep["name"], dep["version"]) for dep in failed]))
+
+# Download, verify, and install a single dependency within the scheduler limits
+def install_dep(dep, network, extraction):
+    name, version = dep["name"], dep["version"]
+    path = os.path.join(PARTICLE_DEPS, name, version)
+    installed = os.path.isdir(path)
+    with install_lock(path):
+        # Another process installed it while this one waited for the lock
+        if not installed and os.path.isdir(path):
+            print("%s@%s: installed" % (name, version))
+            return
+
+        if lookup_archive(dep):
+            print("Installing dependency %s@%s from archive cache..." % (name, version))
+        else:
+            print("Downloading dependency %s@%s..." % (name, version))
+        with extraction:
+            staging, content_sha256 = fetch_dep(dep, network)
+
+        if content_sha256 != dep["sha256"]:
+            discard_staging(staging)
+            raise DependencyError("SHA256 mismatch! (expected %s, got %s)" % (dep["sha256"], content_sha256))
+
+        commit_dep(dep, staging)
+    print("%s@%s: installed" % (name, version))
+
+# Move a verified dependency into place and apply platform fixes
+def commit_dep(dep, staging):
+    name, version = dep["name"], dep["version"]
+    try:
+        commit_staging(staging, os.path.join(PARTICLE_DEPS, name, version))
+    except OSError:
+        discard_staging(staging)
+        raise
 
-    # Update dependency manifest
-    if update_manifest:
-        create_manifest()
-        for dep in deps:
-            write_manifest(dep)
+    # Create install receipt so Workbench is happy
+    install_receipt(dep)
 
-# Experimental
-def parallel_download_dep(dep):
-    try:
-        with urllib.request.urlopen(dep["url"]) as response:
-                content = response.read()
-    except urllib.error.URLError as error:
-        print("%s@%s: failed to download!" % (dep["name"], dep["version"]))
-        return
-    print("%s@%s: downloaded" % (dep["name"], dep["version"]))
-    matched = hashlib.sha256(content).hexdigest() == dep["sha256"]
-    if not matched:
-        print("%s@%s: sha256 failed!" % (dep["name"], dep["version"]))
-        return
-    tarball = tarfile.open(fileobj=io.BytesIO(content), mode="r:gz")
+    # Fix buildtools and openocd for aarch64
+    if platform.machine() == "aarch64":
+        if name == "buildtools":
+            fix_buildtools(version)
+        elif name == "openocd":
+            fix_openocd(version)
+
+# Stream a dependency into a staging directory, hashing and extracting it as it arrives.
+# Downloads hold a slot of the network semaphore, if one is given.
+def fetch_dep(dep, network=None):
     path = os.path.join(PARTICLE_DEPS, dep["name"], dep["version"])
+    staging = create_staging(path)
+
+    # Install from the archive store without using the network
+    stored_sha256 = lookup_archive(dep)
+    if stored_sha256:
+        try:
+            with open(archive_path(stored_sha256), "rb") as archive:
+                if stream_extract(archive, staging) == stored_sha256:
+                    return staging, stored_sha256
+        except (OSError, EOFError, tarfile.TarError):
+            pass
+        # The stored archive is corrupt, so replace it
+        remove_archive(stored_sha256)
+        staging = create_staging(path)
+
+    # Interrupted downloads are resumed from the partial file on the next attempt
+    partial = partial_path(dep["url"])
     try:
-        tarball.extractall(path)
-        tarball.close()
-        install_receipt(dep)
-        # write_manifest(dep) #?
-        print("%s@%s: extracted" % (dep["name"], dep["version"]))
-    except PermissionError:
-        print("%s@%s: failed to extract!" % (dep["name"], dep["version"]))
+        with network or contextlib.nullcontext(), ResumableStream(dep["url"], partial) as stream:
+            content_sha256 = stream_extract(stream, staging)
+    except (OSError, http.client.HTTPException) as error:
+        discard_staging(staging)
+        raise DependencyError("Failed to download dependency!") from error
+    except (EOFError, tarfile.TarError) as error:
+        discard_staging(staging)
+        os.remove(partial)
+        raise DependencyError("Failed to extract dependency!") from error
+
+    # Only store archives that were verified (or have no hash to verify against)
+    if store_enabled() and (content_sha256 == dep["sha256"] or not valid_hash(dep["sha256"])):
+        add_archive(partial, content_sha256, dep["url"])
+    else:
+        os.remove(partial)
+    return staging, content_sha256
 
 # Download the specified dependency
 def download_dep(dep, update_manifest, check_hash):
@@ -112,45 +191,30 @@ def download_dep(dep, update_manifest, check_hash):
     if update_manifest:
         write_manifest(dep)
 
-    name, version, url, sha256 = dep["name"], dep["version"], dep["url"], dep["sha256"]
-    print("Downloading dependency %s@%s..." % (name, version))
+    name, version, sha256 = dep["name"], dep["version"], dep["sha256"]
+    if lookup_archive(dep):
+        print("Installing dependency %s@%s from archive cache..." % (name, version))
+    else:
+        print("Downloading dependency %s@%s..." % (name, version))
 
-    try:
-        with urllib.request.urlopen(url) as response:
-            content = response.read()
-    except urllib.error.URLError as error:
-        raise DependencyError("Failed to download dependency!") from error
+    # Hold the install path while fetching, like install_dep
+    with install_lock(os.path.join(PARTICLE_DEPS, name, version)):
+        # The archive is never held in RAM or written to disk whole
+        staging, content_sha256 = fetch_dep(dep)
 
-    # Verify that the sha256 matches
-    if check_hash:
-        content_sha256 = hashlib.sha256(content).hexdigest()
-        if content_sha256 != sha256:
+        # Verify that the sha256 matches
+        if check_hash and content_sha256 != sha256:
             print("SHA256 mismatch!")
             print("Expected: %s" % sha256)
             print("Actual: %s" % content_sha256)
             print()
             print("Would you like to proceed anyway?")
             if input("(Y/N): ").lower() != "y":
+                discard_staging(staging)
                 return False
 
-    # Ensure that installation directory exists
-    path = os.path.join(PARTICLE_DEPS, name, version)
-    pathlib.Path(path).mkdir(parents=True, exist_ok=True)
-
-    # Write the archive to a file to save RAM
-    archive = os.path.join(path, "%s-v%s.tar.gz" % (name, version))
-    with open(archive, "wb") as gz_file:
-        gz_file.write(content)
-
-    # Extract the archive
-    with tarfile.open(archive, "r:gz") as file:
-        file.extractall(path)
-
-    # Create install receipt so Workbench is happy
-    install_receipt(dep)
-
-    # Delete the temporary archive
-    os.remove(archive)
+        # Move the extracted files into place
+        commit_dep(dep, staging)
     return True
 
 # Create the install receipt for a dependency
@@ -201,6 +265,7 @@ def write_json_caches(data, keys):
         with open(jsonFiles[key], "w") as file:
             key_data = data[key]
             json.dump(key_data, file, indent=4)
+    reset_catalog()
 
 # Install or update neopo dependencies (not the neopo script)
 def install_or_update(install, force, skip_deps):
@@ -233,23 +298,13 @@ def install_or_update(install, force, skip_deps):
     if skip_deps:
         for dep in dep_json:
             write_manifest(dep)
+        write_completion_index()
         print("Skipped installation of all dependencies.")
         return
 
-    # Experimental (parallel downloading to save time)
-    # Currently opt-in
-    if NEOPO_PARALLEL:
-        deps_to_install = []
-        for dep in dep_json:
-            install_path = os.path.join(PARTICLE_DEPS, dep["name"], dep["version"])
-            installed = os.path.isdir(install_path)
-            if force or not installed: deps_to_install.append(dep)
-        # Download needed deps in parallel
-        parallel_handler(deps_to_install)
-        return
-
     # Either install or update
     if install:
+        deps_to_install = []
         skipped_deps = []
         for dep in dep_json:
             # Install dependency if not currently installed, or forced, otherwise skip
@@ -259,38 +314,38 @@ def install_or_update(install, force, skip_deps):
             receipt = os.path.isfile(os.path.join(install_path, INSTALL_RECEIPT))
 
             if not installed or force:
-                download_dep(dep, True, True)
+                deps_to_install.append(dep)
             else:
                 skipped_deps.append(dep)
                 if not receipt:
                     install_receipt(dep)
 
-        # Fix buildtools and openocd for aarch64
-        if install_platform == "aarch64":
-            buildtools_version = [dep["version"] for dep in dep_json if dep["name"] == "buildtools"][0]
-            fix_buildtools(buildtools_version)
-            openocd_version = [dep["version"] for dep in dep_json if dep["name"] == "openocd"][0]
-            fix_openocd(openocd_version)
-
         # Put skippedDeps in manifest.json
         for dep in skipped_deps:
             write_manifest(dep)
 
         # Notify user of dependencies skipped to save bandwidth and time
         if skipped_deps:
-            print()
             print("Skipped previously installed dependencies:")
             print(*["%s@%s" % (dep["name"], dep["version"])
                     for dep in skipped_deps], sep=", ")
+            print()
+
+        # install_deps rebuilds the completion index when it installs anything
+        install_deps(deps_to_install)
+        if not deps_to_install:
+            write_completion_index()
         print()
 
     else:
         # Only install a dependency if newer
+        newer_deps = []
         for dep in dep_json:
             new = int(dep["version"].split("-")[0].replace(".", ""))
             old = int(get_manifest_value(dep["name"]).split("-")[0].replace(".", ""))
             if new > old:
-                download_dep(dep, True, True)
+                newer_deps.append(dep)
+        install_deps(newer_deps)
         print("Dependencies are up to date!")
 
 # Try to download given firmware